@@ -0,0 +1,54 @@
+import os, statistics, sys, time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'worker'))
+import mlx.core as mx
+from mflux.models.vae.vae import VAE
+from mflux.post_processing.array_util import ArrayUtil
+from mflux.post_processing.latent_preview import LatentPreview
+
+# Measures what a preview adds to each denoise step: the linear latent -> RGB map plus JPEG encoding (LatentPreview.to_jpeg),
+# next to the full VAE decode that StepwiseHandler runs per step. Needs no weights - an untrained VAE does the same amount of work.
+
+def main(cli_args):
+    vae = None if cli_args.skip_vae else VAE()
+    for resolution in cli_args.resolutions:
+        width, height = (int(x) for x in resolution.lower().split("x"))
+        latents = mx.random.normal((1, (height // 16) * (width // 16), 64))
+        mx.eval(latents)
+
+        preview_seconds = time_repeats(lambda: LatentPreview.to_jpeg(latents, height, width), cli_args.repeats)
+        jpeg_bytes = len(LatentPreview.to_jpeg(latents, height, width))
+        report(f"{resolution} preview ({width // 8}x{height // 8} JPEG, {jpeg_bytes} bytes)", preview_seconds)
+
+        if vae is not None:
+            def vae_decode():
+                mx.eval(vae.decode(ArrayUtil.unpack_latents(latents = latents, height = height, width = width)))
+            vae_seconds = time_repeats(vae_decode, max(1, cli_args.repeats // 10))
+            report(f"{resolution} VAE decode", vae_seconds)
+            print(f"  preview is {statistics.median(vae_seconds) / statistics.median(preview_seconds):.0f}x cheaper")
+
+
+def time_repeats(fn, repeats):
+    # The first call builds the graph - leave it out
+    fn()
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def report(label, seconds):
+    millis = sorted(s * 1000 for s in seconds)
+    print(f"{label}: median={statistics.median(millis):.2f}ms max={millis[-1]:.2f}ms (n={len(millis)})")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--resolutions", type = str, nargs = "*", default = ["256x256", "512x512", "1024x1024"], help = "WIDTHxHEIGHT of the images being generated")
+    parser.add_argument("--repeats", type = int, default = 50)
+    parser.add_argument("--skip_vae", action = "store_true", help = "Only time the preview (the VAE decode is slow without a GPU)")
+    cli_args = parser.parse_args()
+    main(cli_args)
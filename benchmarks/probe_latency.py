@@ -0,0 +1,79 @@
+import asyncio, json, statistics, time
+from argparse import ArgumentParser
+from typing import List
+import nats
+from nats.errors import TimeoutError
+
+# Measures how quickly a worker answers `request-worker` probes - first while idle, then while it is generating an image.
+# Talks to the worker directly (no server needed): start a NATs server and a single worker, then run this script.
+
+async def main(cli_args):
+    nc = await nats.connect(cli_args.nats_server_address)
+
+    # Idle baseline
+    idle = await probe_repeatedly(nc, cli_args.num_probes, cli_args.probe_interval, cli_args.probe_timeout)
+    report("idle", idle)
+
+    # Pick the worker and hand it a job directly, replying to our own inbox
+    # (the idle probes reserved slots too, so wait for a probe that wins a lease)
+    probe = await nc.request('request-worker', b'', timeout = cli_args.probe_timeout)
+    while probe.headers.get('willing') != 'true':
+        await asyncio.sleep(cli_args.probe_interval)
+        probe = await nc.request('request-worker', b'', timeout = cli_args.probe_timeout)
+    worker_id = probe.headers['workerId']
+    image_inbox = nc.new_inbox()
+    image_done = asyncio.Event()
+    async def on_image(msg):
+        image_done.set()
+    await nc.subscribe(image_inbox, cb = on_image, max_msgs = 1)
+    request = dict(prompt = cli_args.prompt, seed = 0, numSteps = cli_args.num_steps, height = cli_args.height, width = cli_args.width)
+    start = time.perf_counter()
+    await nc.publish(worker_id, json.dumps(request).encode(), reply = image_inbox, headers = dict(leaseId = probe.headers['leaseId']))
+    await nc.flush()
+
+    # Probe for as long as the job runs
+    busy = []
+    while not image_done.is_set():
+        busy.extend(await probe_repeatedly(nc, 1, cli_args.probe_interval, cli_args.probe_timeout))
+    print(f"{cli_args.width}x{cli_args.height} job finished in {time.perf_counter() - start:.2f}s")
+    report(f"during {cli_args.width}x{cli_args.height} job", busy)
+
+    await nc.drain()
+
+
+async def probe_repeatedly(nc, num_probes : int, interval : float, timeout : float) -> List[float]:
+    latencies = []
+    for _ in range(num_probes):
+        start = time.perf_counter()
+        try:
+            await nc.request('request-worker', b'', timeout = timeout)
+            latencies.append(time.perf_counter() - start)
+        except TimeoutError:
+            latencies.append(float('inf'))
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def report(label : str, latencies : List[float]):
+    answered = sorted(latency * 1000 for latency in latencies if latency != float('inf'))
+    timeouts = len(latencies) - len(answered)
+    if not answered:
+        print(f"{label}: {timeouts} probes, all timed out")
+        return
+    quantiles = statistics.quantiles(answered, n = 100) if len(answered) > 1 else [answered[0]] * 99
+    print(f"{label}: {len(latencies)} probes, {timeouts} timeouts, "
+          f"p50={quantiles[49]:.1f}ms p95={quantiles[94]:.1f}ms p99={quantiles[98]:.1f}ms max={answered[-1]:.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--prompt", type = str, default = "a lighthouse on a cliff at sunset")
+    parser.add_argument("--height", type = int, default = 1024)
+    parser.add_argument("--width", type = int, default = 1024)
+    parser.add_argument("--num_steps", type = int, default = 4)
+    parser.add_argument("--num_probes", type = int, default = 50, help = "Number of probes for the idle baseline")
+    parser.add_argument("--probe_interval", type = float, default = 0.05, help = "Seconds between probes")
+    parser.add_argument("--probe_timeout", type = float, default = 2.0)
+    cli_args = parser.parse_args()
+    asyncio.run(main(cli_args))
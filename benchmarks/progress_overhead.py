@@ -0,0 +1,67 @@
+import asyncio, os, statistics, sys, time
+from argparse import ArgumentParser
+import nats
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'worker'))
+from progress import ProgressPublisher
+
+# Measures how much time reporting progress adds to each denoise step, as seen by the step loop.
+# "before" is the original publish + flush per step, "after" is the throttled ProgressPublisher.
+# Only needs a NATs server - the denoise step itself is simulated with a sleep.
+
+async def main(cli_args):
+    nc = await nats.connect(cli_args.nats_server_address)
+    subject = f"{nc.new_inbox()}.worker-progress"
+    received = 0
+    async def on_progress(msg):
+        nonlocal received
+        received += 1
+    await nc.subscribe(subject, cb = on_progress)
+
+    async def publish_and_flush(step, total):
+        await nc.publish(subject, str(100 * step / total).encode())
+        await nc.flush()
+
+    before = await run_steps(cli_args, publish_and_flush)
+    await nc.flush()
+    report("before (publish + flush per step)", before, received)
+
+    received = 0
+    publisher = ProgressPublisher(nc, subject, min_interval = cli_args.min_interval)
+    async def publish_throttled(step, total):
+        publisher.update(step, total)
+    after = await run_steps(cli_args, publish_throttled)
+    await publisher.close()
+    await nc.flush()
+    report(f"after (ProgressPublisher, min_interval={cli_args.min_interval}s)", after, received)
+
+    await nc.drain()
+
+
+async def run_steps(cli_args, progress_cb):
+    overheads = []
+    for step in range(1, cli_args.num_steps + 1):
+        # Stand-in for the transformer forward pass - this is where the loop would be busy
+        time.sleep(cli_args.step_seconds)
+        start = time.perf_counter()
+        await progress_cb(step, cli_args.num_steps)
+        overheads.append(time.perf_counter() - start)
+        # Let other coroutines run, as a compute thread would
+        await asyncio.sleep(0)
+    return overheads
+
+
+def report(label, overheads, received):
+    micros = [o * 1e6 for o in overheads]
+    print(f"{label}: mean={statistics.mean(micros):.1f}us p99={statistics.quantiles(micros, n = 100)[98]:.1f}us "
+          f"max={max(micros):.1f}us messages={received}/{len(overheads)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--num_steps", type = int, default = 200)
+    parser.add_argument("--step_seconds", type = float, default = 0.01, help = "Simulated duration of one denoise step")
+    parser.add_argument("--min_interval", type = float, default = 0.25)
+    cli_args = parser.parse_args()
+    asyncio.run(main(cli_args))
@@ -0,0 +1,54 @@
+import os, signal, subprocess, sys, time
+from argparse import ArgumentParser, REMAINDER
+
+# Starts a pool of simulated workers (worker.py --backend simulated) on this host, to load test the server and NATs
+# without any weights. Arguments after `--` are passed to every worker, e.g.:
+#   python benchmarks/simulated_pool.py --workers 200 -- --sim_seconds_per_megapixel_step 1.0 --slots 2
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'worker', 'worker.py')
+
+def main(cli_args):
+    os.makedirs(cli_args.log_dir, exist_ok = True)
+    # Being terminated stops the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    extra_args = [arg for arg in cli_args.worker_args if arg != '--']
+    processes = []
+    for i in range(cli_args.workers):
+        worker_id = f"{cli_args.worker_id_prefix}-{i}"
+        log = open(os.path.join(cli_args.log_dir, f"{worker_id}.log"), 'w')
+        processes.append(subprocess.Popen(
+            [sys.executable, '-u', WORKER,
+             '--backend', 'simulated',
+             '--worker_id', worker_id,
+             '--nats_server_address', cli_args.nats_server_address,
+             *extra_args],
+            stdin = subprocess.DEVNULL, stdout = log, stderr = subprocess.STDOUT))
+        # Don't have every worker connect (and warm up) at the same instant
+        time.sleep(cli_args.stagger)
+    print(f"Started {len(processes)} simulated workers (logs in {cli_args.log_dir}). Ctrl-C to stop them.")
+    try:
+        while True:
+            time.sleep(1)
+            exited = [p for p in processes if p.poll() is not None]
+            if exited:
+                print(f"{len(exited)} worker(s) exited - see their logs")
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.wait()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--workers", type = int, default = 10)
+    parser.add_argument("--worker_id_prefix", type = str, default = "simulated")
+    parser.add_argument("--stagger", type = float, default = 0.05, help = "Seconds between starting workers")
+    parser.add_argument("--log_dir", type = str, default = "simulated-workers")
+    parser.add_argument("worker_args", nargs = REMAINDER)
+    cli_args = parser.parse_args()
+    main(cli_args)
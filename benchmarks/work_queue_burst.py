@@ -0,0 +1,78 @@
+import asyncio, json, os, statistics, sys, time, uuid
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'worker'))
+import nats
+from work_queue import WORK_QUEUE_SUBJECT, ensure_work_queue
+
+# Publishes a burst of requests to the JetStream work queue, as the server does in its work-queue dispatch mode,
+# and waits for every image. With more requests than free slots, the extra requests wait in the stream instead of failing.
+# Needs only a nats-server with JetStream and some workers pulling from the queue, e.g.:
+#   python benchmarks/simulated_pool.py --workers 4 -- --work_queue
+#   python benchmarks/work_queue_burst.py --requests 40
+
+async def main(cli_args):
+    nc = await nats.connect(cli_args.nats_server_address)
+    js = nc.jetstream()
+    await ensure_work_queue(js)
+
+    prefix = nc.new_inbox()
+    sent_at = {}
+    assigned = {}
+    finished = {}
+    outcomes = {}
+    all_done = asyncio.Event()
+
+    # Images from the simulated backend fit in one chunk, so the first message on an imageInbox finishes it
+    async def on_message(msg):
+        request_id, _, kind = msg.subject[len(prefix) + 1:].partition('.')
+        if kind == 'worker-assigned':
+            assigned.setdefault(request_id, (time.perf_counter(), msg.data.decode()))
+        elif kind == '' and request_id not in finished:
+            finished[request_id] = time.perf_counter()
+            outcomes[request_id] = 'success' if (msg.headers or {}).get('success') == 'true' else msg.data.decode(errors = 'replace')
+            if len(finished) == cli_args.requests:
+                all_done.set()
+    await nc.subscribe(f"{prefix}.>", cb = on_message)
+
+    start = time.perf_counter()
+    for i in range(cli_args.requests):
+        request_id = uuid.uuid4().hex
+        image_inbox = f"{prefix}.{request_id}"
+        request = dict(prompt = f"burst {i}", seed = i, numSteps = cli_args.num_steps, height = cli_args.height, width = cli_args.width)
+        sent_at[request_id] = time.perf_counter()
+        await js.publish(WORK_QUEUE_SUBJECT, json.dumps(request).encode(), headers = { 'imageInbox': image_inbox, 'Nats-Msg-Id': image_inbox })
+    print(f"Queued {cli_args.requests} requests in {time.perf_counter() - start:.2f}s")
+
+    try:
+        await asyncio.wait_for(all_done.wait(), timeout = cli_args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    succeeded = [request_id for request_id, outcome in outcomes.items() if outcome == 'success']
+    waits = sorted(assigned[request_id][0] - sent_at[request_id] for request_id in assigned)
+    latencies = sorted(finished[request_id] - sent_at[request_id] for request_id in succeeded)
+    workers = {}
+    for _, worker_id in assigned.values():
+        workers[worker_id] = workers.get(worker_id, 0) + 1
+    print(f"{len(succeeded)}/{cli_args.requests} succeeded, {len(finished) - len(succeeded)} failed, "
+          f"{cli_args.requests - len(finished)} unfinished after {elapsed:.1f}s ({len(succeeded) / elapsed:.2f} images/s)")
+    for label, values in (("wait for a worker", waits), ("time to image", latencies)):
+        if len(values) > 1:
+            q = statistics.quantiles(values, n = 100, method = 'inclusive')
+            print(f"{label}: p50={q[49]:.2f}s p95={q[94]:.2f}s p99={q[98]:.2f}s max={values[-1]:.2f}s")
+    print(f"Requests per worker: {dict(sorted(workers.items()))}")
+    await nc.drain()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--requests", type = int, default = 40)
+    parser.add_argument("--num_steps", type = int, default = 4)
+    parser.add_argument("--height", type = int, default = 256)
+    parser.add_argument("--width", type = int, default = 256)
+    parser.add_argument("--timeout", type = float, default = 120.0, help = "Seconds to wait for every image")
+    cli_args = parser.parse_args()
+    asyncio.run(main(cli_args))
@@ -0,0 +1,194 @@
+import asyncio, json, struct, time, uuid
+from typing import AsyncIterator, Dict, NamedTuple, Optional, Union
+import nats
+from nats.aio.client import Client as NATS
+from nats.aio.msg import Msg
+from nats.errors import Error as NatsError
+from image_reassembler import ImageReassembler, ReceivedImage, TransferError
+
+# Progress messages from the worker: step (uint16), total steps (uint16), elapsed milliseconds (uint32)
+PROGRESS_FORMAT = struct.Struct("!HHI")
+
+
+class Progress(NamedTuple):
+    step : int
+    total : int
+    elapsed_ms : int
+
+
+class Preview(NamedTuple):
+    step : int
+    total : int
+    jpeg : bytes
+
+
+class GenerationFailed(Exception):
+    """The server or worker replied that the image could not be generated."""
+
+    def __init__(self, reason : str, headers : Dict[str,str]):
+        super().__init__(reason)
+        self.reason = reason
+        self.headers = headers
+
+    @property
+    def cancelled(self) -> bool:
+        return self.headers.get('cancelled') == 'true'
+
+    @property
+    def expired(self) -> bool:
+        return self.headers.get('expired') == 'true'
+
+
+class Generation:
+    """
+    One image being generated. Await it (or `wait`) for the ReceivedImage - a failure raises GenerationFailed.
+    `progress()` iterates over Progress (and Preview) updates until the image arrives.
+    The timestamps (time.perf_counter) say when the request was sent, assigned a worker, first progressed and finished.
+    Once it has finished (image, failure, cancellation or timeout) the client stops routing messages to it.
+    """
+
+    def __init__(self, client : "Client", generation_id : str):
+        loop = asyncio.get_running_loop()
+        self.client = client
+        self.generation_id = generation_id
+        self.image_inbox = f"{client.prefix}.{generation_id}"
+        self.worker_id : Optional[str] = None
+        self.sent_at : Optional[float] = None
+        self.assigned_at : Optional[float] = None
+        self.first_progress_at : Optional[float] = None
+        self.finished_at : Optional[float] = None
+        self._result = loop.create_future()
+        self._assigned = loop.create_future()
+        self._updates : asyncio.Queue = asyncio.Queue()
+
+    def __await__(self):
+        return asyncio.shield(self._result).__await__()
+
+    def done(self) -> bool:
+        return self._result.done()
+
+    # Raises asyncio.TimeoutError (having asked the worker to stop) if the image takes longer than `timeout` seconds
+    async def wait(self, timeout : Optional[float] = None) -> ReceivedImage:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._result), timeout = timeout)
+        except asyncio.TimeoutError:
+            await self.cancel()
+            raise
+
+    async def worker_assigned(self) -> str:
+        return await asyncio.shield(self._assigned)
+
+    async def progress(self) -> AsyncIterator[Union[Progress, Preview]]:
+        while True:
+            update = await self._updates.get()
+            if update is None:
+                return
+            yield update
+
+    # The worker stops at its next step. The generation fails straight away, without waiting for the worker's reply.
+    async def cancel(self):
+        self._finish(GenerationFailed('Image generation was cancelled.', dict(success = 'false', cancelled = 'true')))
+        await self.client.nc.publish(f"{self.image_inbox}.cancel", b'')
+
+    def _on_assigned(self, worker_id : str):
+        self.assigned_at = time.perf_counter()
+        self.worker_id = worker_id
+        if not self._assigned.done():
+            self._assigned.set_result(worker_id)
+
+    def _on_progress(self, update : Union[Progress, Preview]):
+        if self.first_progress_at is None:
+            self.first_progress_at = time.perf_counter()
+        self._updates.put_nowait(update)
+
+    def _finish(self, received : Union[ReceivedImage, Exception]):
+        if self._result.done():
+            return
+        self.client._generations.pop(self.generation_id, None)
+        self.finished_at = time.perf_counter()
+        if isinstance(received, Exception):
+            self._result.set_exception(received)
+        elif received.headers.get('success') == 'true':
+            self._result.set_result(received)
+        else:
+            self._result.set_exception(GenerationFailed(received.data.decode(errors = 'replace'), received.headers))
+        # Marks the outcome as retrieved - a failure nobody awaits is not worth a warning
+        self._result.exception()
+        self._updates.put_nowait(None)
+
+
+class Client:
+    """
+    A connection to the image generation cluster that any number of generations share.
+
+    Every imageInbox is `{prefix}.{id}` under one inbox prefix, so the image, `.worker-assigned` and `.worker-progress`
+    messages of all generations arrive on a single `{prefix}.>` subscription and are routed to their Generation by id.
+    Nothing is subscribed or unsubscribed per request.
+    """
+
+    def __init__(self, nc : NATS):
+        self.nc = nc
+        self.requester_id = str(uuid.uuid4())
+        self.prefix = nc.new_inbox()
+        self._reassembler = ImageReassembler(nc)
+        # id -> generation still waiting for its image (see Generation._finish)
+        self._generations : Dict[str, Generation] = {}
+        self._sub = None
+        self._tasks = set()
+
+    @staticmethod
+    async def connect(nats_server_address : str, **kwargs) -> "Client":
+        client = Client(await nats.connect(nats_server_address, **kwargs))
+        await client.start()
+        return client
+
+    async def start(self):
+        self._sub = await self.nc.subscribe(f"{self.prefix}.>", cb = self._route)
+
+    # `timeout` (seconds) becomes the request's deadline, so that a queued request is dropped rather than generated too late
+    async def generate(self, request : Dict[str,any], timeout : Optional[float] = None, priority : Optional[int] = None) -> Generation:
+        generation_id = uuid.uuid4().hex
+        generation = Generation(self, generation_id)
+        self._generations[generation_id] = generation
+        headers = dict(imageInbox = generation.image_inbox)
+        if timeout is not None:
+            headers.update(deadline = str(int((time.time() + timeout) * 1000)))
+        if priority is not None:
+            headers.update(priority = str(priority))
+        generation.sent_at = time.perf_counter()
+        await self.nc.publish('img-gen', json.dumps(request).encode(), reply = self.requester_id, headers = headers)
+        return generation
+
+    async def close(self):
+        if self._sub is not None:
+            await self._sub.unsubscribe()
+        await self.nc.drain()
+
+    async def _route(self, msg : Msg):
+        generation_id, _, kind = msg.subject[len(self.prefix) + 1:].partition('.')
+        generation = self._generations.get(generation_id)
+        if generation is None:
+            return
+        if kind == '':
+            # Fetching an object store reference takes a while - don't hold up the messages of other generations meanwhile
+            task = asyncio.create_task(self._receive_image(generation, msg))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif kind == 'worker-assigned':
+            generation._on_assigned(msg.data.decode())
+        elif kind == 'worker-progress':
+            if (msg.headers or {}).get('kind') == 'preview':
+                generation._on_progress(Preview(int(msg.headers['step']), int(msg.headers['total']), msg.data))
+            else:
+                generation._on_progress(Progress(*PROGRESS_FORMAT.unpack(msg.data)))
+
+    async def _receive_image(self, generation : Generation, msg : Msg):
+        try:
+            received = await self._reassembler.receive(msg)
+        except (KeyError, ValueError) as e:
+            received = TransferError(f"The image's headers are missing or malformed ({e!r})")
+        except (TransferError, NatsError) as e:
+            received = e
+        if received is None:
+            return
+        generation._finish(received)
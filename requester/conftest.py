@@ -0,0 +1,4 @@
+import os, sys
+
+# The requester runs as a script with flat imports (`from image_reassembler import ...`), so its tests import it the same way
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,66 @@
+import asyncio, hashlib
+from typing import Dict, List, NamedTuple, Optional
+from nats.aio.client import Client as NATS
+from nats.aio.msg import Msg
+
+
+class TransferError(Exception):
+    """The image arrived, but could not be reassembled or did not match its checksum."""
+
+
+class ReceivedImage(NamedTuple):
+    data : bytes
+    headers : Dict[str,str]
+
+
+class ImageReassembler:
+    """
+    The receiving half of the worker's ImageSender.
+
+    Feed every message that arrives on an imageInbox to `receive`. It returns None while a chunked transfer is incomplete,
+    and the full image (checksum verified, on a thread so that large images don't block the event loop) once it is.
+    Object-store references are fetched from JetStream.
+    Messages without a `transfer` header (such as failures) are passed through as-is.
+    """
+
+    def __init__(self, nc : NATS):
+        self.nc = nc
+        # transferId -> chunks received so far
+        self._chunks : Dict[str, List[Optional[bytes]]] = {}
+
+    async def receive(self, msg : Msg) -> Optional[ReceivedImage]:
+        headers = msg.headers or {}
+        transfer = headers.get('transfer')
+        if transfer == 'chunked':
+            data = self._receive_chunk(msg, headers)
+        elif transfer == 'object-store':
+            data = await self._receive_reference(headers)
+        else:
+            return ReceivedImage(msg.data, headers)
+        if data is None:
+            return None
+        return await asyncio.to_thread(ImageReassembler._verify, data, headers)
+
+    def _receive_chunk(self, msg : Msg, headers : Dict[str,str]) -> Optional[bytes]:
+        transfer_id = headers['transferId']
+        chunk_count = int(headers['chunkCount'])
+        chunks = self._chunks.setdefault(transfer_id, [None] * chunk_count)
+        chunks[int(headers['chunkIndex'])] = msg.data
+        if any(chunk is None for chunk in chunks):
+            return None
+        del self._chunks[transfer_id]
+        return b''.join(chunks)
+
+    async def _receive_reference(self, headers : Dict[str,str]) -> bytes:
+        js = self.nc.jetstream()
+        object_store = await js.object_store(headers['bucket'])
+        result = await object_store.get(headers['objectName'])
+        return result.data
+
+    @staticmethod
+    def _verify(data : bytes, headers : Dict[str,str]) -> ReceivedImage:
+        if len(data) != int(headers['totalBytes']):
+            raise TransferError(f"Expected {headers['totalBytes']} bytes but received {len(data)}")
+        if hashlib.sha256(data).hexdigest() != headers['sha256']:
+            raise TransferError("Checksum of the received image does not match")
+        return ReceivedImage(data, headers)
@@ -0,0 +1,140 @@
+import asyncio, json, random, statistics, sys, time
+from argparse import ArgumentParser
+from typing import Dict, List, Optional
+from nats.errors import Error as NatsError
+from client import Client, Generation, GenerationFailed
+from image_reassembler import TransferError
+
+# Drives the cluster through the same client as requester.py, but with many requests at once, and reports latencies as JSON.
+#
+#   open loop:   requests arrive as a Poisson process at --rate per second, however long the earlier ones take
+#   closed loop: --users simulated users each submit a request, wait for the image, and immediately submit the next
+#
+# Latencies are measured from publishing the request: to the worker being assigned, to the first progress message,
+# and to the (complete, verified) image.
+
+
+class RequestTiming:
+    def __init__(self, generation : Generation):
+        self.sent = generation.sent_at
+        self.assigned = generation.assigned_at
+        self.first_progress = generation.first_progress_at
+        self.finished = generation.finished_at
+        self.success = False
+        self.error : Optional[str] = None
+
+
+async def generate_one(client : Client, payload : Dict[str,any], timeout : float) -> RequestTiming:
+    generation = await client.generate(payload)
+    success, error = False, None
+    try:
+        await generation.wait(timeout)
+        success = True
+    except asyncio.TimeoutError:
+        error = "timeout"
+    except (GenerationFailed, TransferError, NatsError) as e:
+        error = str(e)
+    timing = RequestTiming(generation)
+    timing.success, timing.error = success, error
+    return timing
+
+
+def make_payload(cli_args, prompts : List[str], i : int) -> Dict[str,any]:
+    payload = dict(prompt = prompts[i % len(prompts)], numSteps = cli_args.num_steps, height = cli_args.height, width = cli_args.width, format = cli_args.format)
+    if cli_args.seed is not None:
+        payload.update(seed = cli_args.seed)
+    return payload
+
+
+async def open_loop(client, cli_args, prompts) -> List[RequestTiming]:
+    tasks = []
+    for i in range(cli_args.requests):
+        tasks.append(asyncio.create_task(generate_one(client, make_payload(cli_args, prompts, i), cli_args.timeout)))
+        # Exponential gaps between arrivals make a Poisson process
+        await asyncio.sleep(random.expovariate(cli_args.rate))
+    return await asyncio.gather(*tasks)
+
+
+async def closed_loop(client, cli_args, prompts) -> List[RequestTiming]:
+    timings = []
+    counter = iter(range(cli_args.requests))
+    async def user():
+        for i in counter:
+            timings.append(await generate_one(client, make_payload(cli_args, prompts, i), cli_args.timeout))
+    await asyncio.gather(*(user() for _ in range(cli_args.users)))
+    return timings
+
+
+def percentiles(values : List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return dict(p50 = round(values[0], 4), p95 = round(values[0], 4), p99 = round(values[0], 4), count = 1)
+    q = statistics.quantiles(values, n = 100, method = 'inclusive')
+    return dict(p50 = round(q[49], 4), p95 = round(q[94], 4), p99 = round(q[98], 4), count = len(values))
+
+
+def report(cli_args, timings : List[RequestTiming], wall_seconds : float) -> Dict[str, any]:
+    succeeded = [t for t in timings if t.success]
+    errors = {}
+    for t in timings:
+        if not t.success:
+            errors[t.error] = errors.get(t.error, 0) + 1
+    return dict(
+        mode = cli_args.mode,
+        rate = cli_args.rate if cli_args.mode == "open" else None,
+        users = cli_args.users if cli_args.mode == "closed" else None,
+        requests = len(timings),
+        succeeded = len(succeeded),
+        failure_rate = round(1 - len(succeeded) / len(timings), 4) if timings else None,
+        errors = errors,
+        wall_seconds = round(wall_seconds, 3),
+        throughput_per_second = round(len(succeeded) / wall_seconds, 4) if wall_seconds > 0 else None,
+        time_to_assignment = percentiles([t.assigned - t.sent for t in timings if t.assigned is not None]),
+        time_to_first_progress = percentiles([t.first_progress - t.sent for t in timings if t.first_progress is not None]),
+        time_to_image = percentiles([t.finished - t.sent for t in succeeded]),
+    )
+
+
+async def main(cli_args):
+    client = await Client.connect(cli_args.nats_server_address)
+    prompts = [cli_args.prompt]
+    if cli_args.prompts_file is not None:
+        with open(cli_args.prompts_file) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    if cli_args.mode == "open":
+        timings = await open_loop(client, cli_args, prompts)
+    else:
+        timings = await closed_loop(client, cli_args, prompts)
+    results = report(cli_args, timings, time.perf_counter() - start)
+    await client.close()
+
+    output = json.dumps(results, indent = 2)
+    if cli_args.output is not None:
+        with open(cli_args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--mode", type = str, default = "closed", choices = ["open", "closed"])
+    parser.add_argument("--rate", type = float, default = 1.0, help = "Open loop: requests per second (Poisson arrivals)")
+    parser.add_argument("--users", type = int, default = 4, help = "Closed loop: concurrent users, each with one request in flight")
+    parser.add_argument("--requests", type = int, default = 50, help = "Total requests to send")
+    parser.add_argument("--timeout", type = float, default = 120.0, help = "Seconds before a request counts as failed (and is cancelled)")
+    parser.add_argument("--prompt", type = str, default = "a photo of a cat")
+    parser.add_argument("--prompts_file", type = str, default = None, help = "Cycle through the prompts in this file (one per line)")
+    parser.add_argument("--num_steps", type = int, default = 4)
+    parser.add_argument("--height", type = int, default = 128)
+    parser.add_argument("--width", type = int, default = 128)
+    parser.add_argument("--format", type = str, default = "png", choices = ["png", "webp", "jpeg", "raw"])
+    parser.add_argument("--seed", type = int, default = None, help = "Fix the seed (honoured only by a server with ALLOW_CLIENT_SEEDS=true) - repeat requests can then be served from the result cache")
+    parser.add_argument("--output", type = str, default = None, help = "Also write the JSON report to this file")
+    cli_args = parser.parse_args()
+    if cli_args.mode == "open" and cli_args.rate <= 0:
+        sys.exit("--rate must be positive")
+    asyncio.run(main(cli_args))
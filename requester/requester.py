@@ -1,23 +1,23 @@
-import asyncio, json, uuid, os
-from argparse import ArgumentParser
-from io import BytesIO
-from typing import Dict
-from PIL import Image
-import nats
-import nats.aio
-from nats.aio.msg import Msg
-from nats.errors import ConnectionClosedError, NoServersError
-from nats.aio.subscription import Subscription
-from typing import Dict
+import asyncio, json, os, time
+from argparse import ArgumentParser, ArgumentTypeError
+from typing import Dict, List
+from nats.errors import Error as NatsError
+from image_reassembler import ReceivedImage, TransferError
+from client import Client, Generation, GenerationFailed, Preview
+
+# Images requested in the `raw` format are tightly packed 8-bit RGB rows
+RAW_MIMETYPE = 'application/x-rgb8'
+
+# Images are saved exactly as they were sent - the extension comes from the mimetype
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/jpeg': 'jpg',
+    RAW_MIMETYPE: 'ppm',
+}
 
 async def main(cli_args):
 
-    # This would be tied to machine identity in a real system
-    requester_id = str(uuid.uuid4())
-
-    # In a real system this would be a list of potential servers for redundancy/rollback
-    nc = await nats.connect(cli_args.nats_server_address)
-
     # Helpful to know
     async def disconnected_cb():
         print("Got disconnected...")
@@ -26,85 +26,148 @@ async def main(cli_args):
     async def reconnected_cb():
         print("Got reconnected...")
 
-    # Connect to the NATs server
-    nc = await nats.connect(cli_args.nats_server_address, 
-                            reconnected_cb=reconnected_cb,
-                            disconnected_cb=disconnected_cb,
-                            max_reconnect_attempts=-1)
-    print(f"Worker {requester_id} is connected to NATs")    
+    # Connect to the NATs server (in a real system this would be a list of potential servers for redundancy/rollback)
+    client = await Client.connect(cli_args.nats_server_address,
+                                  reconnected_cb=reconnected_cb,
+                                  disconnected_cb=disconnected_cb,
+                                  max_reconnect_attempts=-1)
+    print(f"Requester {client.requester_id} is connected to NATs")
+    os.makedirs("./generated", exist_ok = True)
+
+    # Non-interactive: generate everything in the prompts file and stop
+    if cli_args.bulk is not None:
+        await bulk_generate(client, cli_args)
+        await client.close()
+        return
 
     # Until the user doesn't want to anymore
     while True:
 
-        # (callback) This receives the bytes of the generated image
-        img_gen_future = asyncio.Future()
-        async def receive_generated_image(msg : Msg):
-            # We are awaiting this future before we allow the user to enter another prompt
-            nonlocal img_gen_future
-            # This is the imageInbox that the image was sent to
-            imageInbox = msg.subject
-            # But was it successful?
-            success = msg.headers['success']
-            if success == 'true':
-                # If it was, decode it and save it
-                bytes_io = BytesIO(msg.data)
-                img = Image.open(bytes_io)
-                img_fpath = f"./generated/{imageInbox}.png"
-                img.save(img_fpath)
-                print(f"Image saved to {img_fpath} (file://{os.path.abspath(img_fpath)})")
-            else:
-                # If it wasn't, display the reason why it wasn't.
-                reason = msg.data.decode()
-                print(f"Image generation failed - {reason}" )
-            img_gen_future.set_result(True)
-
-        # (callback) This displays when the server has assigned a worker to generate the image
-        worker_assigned_future = asyncio.Future()
-        async def notify_assigned_worker(msg : Msg):
-            nonlocal worker_assigned_future
-            worker_id = msg.data.decode()
-            print(f"Server assigned worker ID '{worker_id}' to process image generation request")
-            worker_assigned_future.set_result(True)
-
-        # (callback) This displays when the worker posts an update on the image generation progress
-        async def notify_worker_progress(msg: Msg):
-            progress = float(msg.data.decode())
-            print(f"{progress:.0f}% complete")
-        
         # Ask the user for the prompt, early-out if no response
         prompt = input("Enter prompt (Empty prompt will exit program): ").strip()
         if (prompt == ''):
             break
 
-        # Construct a one-shot inbox that receives the generated image (handled by `receive_generated_image`)
-        image_inbox = nc.new_inbox()
-        await nc.subscribe(image_inbox, cb = receive_generated_image, max_msgs=1)
-
-        # Construct a one-shot inbox that displays a notification when the server assigns a worker
-        worker_assigned = f"{image_inbox}.worker-assigned"
-        await nc.subscribe(worker_assigned, cb = notify_assigned_worker, max_msgs=1)
-
-        # Subscribe to when a worker posts progress on image generation
-        worker_progress = f"{image_inbox}.worker-progress"
-        await nc.subscribe(worker_progress, cb = notify_worker_progress, max_msgs=4)
-
         # Ask the user some questions and then construct the img-gen request
         height = typed_input("Enter height (blank for default of 128): ", AtLeast32PxImageDimension, 128)
         width  = typed_input("Enter width (blank for default of 128): ", AtLeast32PxImageDimension, 128)
-        image_gen_opts = dict(prompt = prompt, numSteps = 4, height = height, width = width)
-        payload_string = json.dumps(image_gen_opts)
-        payload_bytes = payload_string.encode()
-        headers = dict(imageInbox = image_inbox)
-
-        # Send it off and do not proceed until the future completes (indicating we got a response back)
+        image_gen_opts = dict(prompt = prompt, numSteps = 4, height = height, width = width, format = cli_args.format)
+        if cli_args.quality is not None:
+            image_gen_opts.update(quality = cli_args.quality)
+        if cli_args.seed is not None:
+            image_gen_opts.update(seed = cli_args.seed)
+        if cli_args.preview:
+            image_gen_opts.update(preview = True)
+
+        # Send it off and do not proceed until we get a response back
+        generation = await client.generate(image_gen_opts, timeout = cli_args.timeout, priority = cli_args.priority)
+        notifications = asyncio.create_task(print_notifications(generation))
         try:
-            await nc.publish('img-gen', payload_bytes, reply = requester_id, headers = headers)
-            await asyncio.wait_for(img_gen_future, timeout=None)
+            received = await generation.wait(cli_args.timeout)
+            img_fpath = await save_image(received, generation.image_inbox)
+            cached = " (from the result cache)" if received.headers.get('cached') == 'true' else ""
+            print(f"Image saved to {img_fpath}{cached} (file://{os.path.abspath(img_fpath)})")
+        except asyncio.TimeoutError:
+            # Give up on the image - the worker stops at its next step and replies that the image was cancelled
+            print(f"No image after {cli_args.timeout}s, cancelling.")
+            try:
+                await generation
+            except GenerationFailed as e:
+                print(f"Image generation failed - {e.reason}")
+        except GenerationFailed as e:
+            # Display the reason why it wasn't successful
+            print(f"Image generation failed - {e.reason}")
         except Exception as e:
-            print(str(e))
-        
+            print(f"Image generation failed - {e}")
+        await notifications
+
     # Wind down
-    await nc.drain()
+    await client.close()
+
+# Displays when the server assigns a worker, and the worker's progress (and previews, if asked for) until the image arrives
+async def print_notifications(generation : Generation):
+    async def assigned():
+        worker_id = await generation.worker_assigned()
+        print(f"Server assigned worker ID '{worker_id}' to process image generation request")
+    assigned_task = asyncio.create_task(assigned())
+    async for update in generation.progress():
+        if isinstance(update, Preview):
+            preview_fpath = f"./generated/{generation.image_inbox}.preview.jpg"
+            await asyncio.to_thread(write_file, preview_fpath, [update.jpeg])
+            print(f"Preview of step {update.step}/{update.total} saved to {preview_fpath}")
+        else:
+            print(f"{100 * update.step / update.total:.0f}% complete (step {update.step}/{update.total}, {update.elapsed_ms / 1000:.1f}s)")
+    # Failed requests may never have been assigned a worker
+    assigned_task.cancel()
+
+# Reads a JSONL file of requests ({"prompt": ..., "height": ..., "width": ..., "numSteps": ...} - all but the prompt optional)
+# and keeps up to --concurrency of them in flight at once, saving each image as it arrives.
+async def bulk_generate(client : Client, cli_args):
+    with open(cli_args.bulk) as f:
+        specs = [json.loads(line) for line in f if line.strip()]
+    results = open(cli_args.bulk_results, 'w') if cli_args.bulk_results is not None else None
+    window = asyncio.Semaphore(cli_args.concurrency)
+    succeeded = 0
+    finished = 0
+    start = time.perf_counter()
+
+    async def generate(index : int, spec : Dict[str,any]):
+        nonlocal succeeded, finished
+        payload = dict(prompt = spec["prompt"],
+                       numSteps = spec.get("numSteps", spec.get("steps", 4)),
+                       height = spec.get("height", 128),
+                       width = spec.get("width", 128),
+                       format = spec.get("format", cli_args.format))
+        payload.update({ field: spec[field] for field in ("seed", "quality", "guidance") if field in spec })
+        request_start = time.perf_counter()
+        result = dict(index = index, prompt = spec["prompt"])
+        try:
+            generation = await client.generate(payload, timeout = cli_args.timeout, priority = cli_args.priority)
+            received = await generation.wait(cli_args.timeout)
+            result.update(success = True, path = await save_image(received, generation.image_inbox))
+        except asyncio.TimeoutError:
+            result.update(success = False, error = "timeout")
+        except (GenerationFailed, TransferError, NatsError, OSError) as e:
+            result.update(success = False, error = str(e))
+        finally:
+            window.release()
+
+        result.update(seconds = round(time.perf_counter() - request_start, 3))
+        finished += 1
+        succeeded += int(result["success"])
+        print(f"[{finished}/{len(specs)}] " + (f"saved {result['path']}" if result["success"] else f"failed - {result['error']}"))
+        if results is not None:
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+
+    # Only submit the next request once one of the in-flight ones is done
+    tasks = []
+    for index, spec in enumerate(specs):
+        await window.acquire()
+        tasks.append(asyncio.create_task(generate(index, spec)))
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - start
+    print(f"{succeeded}/{len(specs)} images in {elapsed:.1f}s ({succeeded / elapsed:.2f} images/s, concurrency {cli_args.concurrency})")
+    if results is not None:
+        results.close()
+
+# The image was already checked against its sha256 header when it arrived, so it is written out without decoding it.
+# Writing happens on a thread, so a large image doesn't hold up the messages of other requests.
+async def save_image(received : ReceivedImage, image_inbox : str) -> str:
+    mimetype = received.headers.get('mimetype')
+    parts = [received.data]
+    if mimetype == RAW_MIMETYPE:
+        # A binary PPM is just a short header in front of the same packed RGB rows
+        parts.insert(0, f"P6\n{received.headers['width']} {received.headers['height']}\n255\n".encode())
+    img_fpath = f"./generated/{image_inbox}.{EXTENSIONS.get(mimetype, 'bin')}"
+    await asyncio.to_thread(write_file, img_fpath, parts)
+    return img_fpath
+
+def write_file(fpath : str, parts : List[bytes]):
+    with open(fpath, 'wb') as f:
+        for part in parts:
+            f.write(part)
 
 def typed_input(user_prompt, klass, default):
     while True:
@@ -121,10 +184,26 @@ def AtLeast32PxImageDimension(x : str):
     if parsed < 32:
         raise Exception()
     return parsed
+
+# For argparse: a semaphore of 0 would never let a request through (and a negative one can't be made)
+def AtLeastOne(x : str):
+    parsed = int(x)
+    if parsed < 1:
+        raise ArgumentTypeError(f"must be at least 1, not {parsed}")
+    return parsed
     
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
+    parser.add_argument("--format", type = str, default = "png", choices = ["png", "webp", "jpeg", "raw"], help = "Format the worker sends the image in")
+    parser.add_argument("--priority", type = int, default = None, help = "Higher priority images are generated first by a worker with a queue")
+    parser.add_argument("--timeout", type = float, default = None, help = "Seconds to wait for an image before cancelling it")
+    parser.add_argument("--seed", type = int, default = None, help = "Fix the seed (honoured only by a server with ALLOW_CLIENT_SEEDS=true, which picks one otherwise) - repeat requests with a fixed seed can be served from the result cache")
+    parser.add_argument("--preview", action = "store_true", help = "Ask the worker for low resolution previews of the image as it is denoised")
+    parser.add_argument("--bulk", type = str, default = None, help = "Generate every request in this JSONL file (prompt, and optionally height, width, numSteps, seed...) without prompting")
+    parser.add_argument("--concurrency", type = AtLeastOne, default = 4, help = "Bulk mode: how many requests to keep in flight at once")
+    parser.add_argument("--bulk_results", type = str, default = None, help = "Bulk mode: write a JSON line per finished request to this file")
+    parser.add_argument("--quality", type = int, default = None, help = "PNG compression level (0-9), or JPEG/WebP quality (1-100)")
     cli_args = parser.parse_args()
     asyncio.run(main(cli_args))
\ No newline at end of file
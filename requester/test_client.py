@@ -0,0 +1,123 @@
+import asyncio, hashlib
+from types import SimpleNamespace
+import pytest
+from client import PROGRESS_FORMAT, Client, GenerationFailed, Preview, Progress
+from image_reassembler import TransferError
+
+
+class FakeNats:
+    def __init__(self):
+        self.published = []
+        self.routes = None
+
+    def new_inbox(self):
+        return "_INBOX.requester"
+
+    async def subscribe(self, subject, cb):
+        self.routes = cb
+        return SimpleNamespace(unsubscribe = lambda: None)
+
+    async def publish(self, subject, payload, reply = None, headers = None):
+        self.published.append((subject, payload, headers))
+
+    # Delivers a message as the `{prefix}.>` subscription would
+    async def deliver(self, subject, data = b'', headers = None):
+        await self.routes(SimpleNamespace(subject = subject, data = data, headers = headers))
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+
+def image_headers(data, **extra):
+    return dict(success = 'true', transfer = 'chunked', transferId = 't', chunkIndex = '0', chunkCount = '1',
+                totalBytes = str(len(data)), sha256 = hashlib.sha256(data).hexdigest(), mimetype = 'image/png', **extra)
+
+
+def run(test):
+    async def main():
+        nc = FakeNats()
+        client = Client(nc)
+        await client.start()
+        return await test(nc, client)
+    return asyncio.run(main())
+
+
+def test_messages_are_routed_to_their_generation():
+    async def test(nc, client):
+        first = await client.generate(dict(prompt = "a"))
+        second = await client.generate(dict(prompt = "b"))
+        await nc.deliver(f"{first.image_inbox}.worker-assigned", b"worker-1")
+        await nc.deliver(f"{first.image_inbox}.worker-progress", PROGRESS_FORMAT.pack(1, 4, 250))
+        await nc.deliver(f"{first.image_inbox}.worker-progress", b"jpeg", dict(kind = 'preview', step = '1', total = '4'))
+        await nc.deliver(first.image_inbox, b"image", image_headers(b"image"))
+        received = await first.wait(1)
+        updates = [update async for update in first.progress()]
+        return first, second, received, updates, dict(client._generations)
+    first, second, received, updates, remaining = run(test)
+    assert first.worker_id == "worker-1"
+    assert received.data == b"image"
+    assert updates == [Progress(1, 4, 250), Preview(1, 4, b"jpeg")]
+    assert not second.done() and second.worker_id is None
+    # Only the generation still waiting for its image is routed to
+    assert remaining == { second.generation_id: second }
+
+def test_a_failure_reply_fails_and_forgets_the_generation():
+    async def test(nc, client):
+        generation = await client.generate(dict(prompt = "a"))
+        await nc.deliver(generation.image_inbox, b"There was a problem generating the image.", dict(success = 'false'))
+        with pytest.raises(GenerationFailed) as failure:
+            await generation
+        return failure.value, dict(client._generations)
+    failure, remaining = run(test)
+    assert failure.reason == "There was a problem generating the image."
+    assert remaining == {}
+
+def test_a_damaged_image_fails_and_forgets_the_generation():
+    async def test(nc, client):
+        damaged = await client.generate(dict(prompt = "a"))
+        malformed = await client.generate(dict(prompt = "b"))
+        await nc.deliver(damaged.image_inbox, b"imagf", image_headers(b"image"))
+        await nc.deliver(malformed.image_inbox, b"image", dict(image_headers(b"image"), chunkCount = 'one'))
+        for generation in (damaged, malformed):
+            with pytest.raises(TransferError):
+                await generation
+        return dict(client._generations)
+    assert run(test) == {}
+
+def test_a_timeout_cancels_and_forgets_the_generation():
+    async def test(nc, client):
+        generation = await client.generate(dict(prompt = "a"))
+        with pytest.raises(asyncio.TimeoutError):
+            await generation.wait(0.01)
+        with pytest.raises(GenerationFailed) as failure:
+            await generation
+        # Whatever the worker still sends is dropped
+        await nc.deliver(generation.image_inbox, b"image", image_headers(b"image"))
+        return generation, failure.value, dict(client._generations)
+    generation, failure, remaining = run(test)
+    assert failure.cancelled
+    assert remaining == {}
+    assert (f"{generation.image_inbox}.cancel", b"", None) in generation.client.nc.published
+
+def test_cancelling_forgets_the_generation():
+    async def test(nc, client):
+        generation = await client.generate(dict(prompt = "a"))
+        await generation.cancel()
+        await nc.deliver(f"{generation.image_inbox}.worker-progress", PROGRESS_FORMAT.pack(1, 4, 250))
+        updates = [update async for update in generation.progress()]
+        with pytest.raises(GenerationFailed) as failure:
+            await generation
+        return updates, failure.value, dict(client._generations)
+    updates, failure, remaining = run(test)
+    assert updates == []
+    assert failure.cancelled
+    assert remaining == {}
+
+def test_requests_carry_their_inbox_deadline_and_priority():
+    async def test(nc, client):
+        generation = await client.generate(dict(prompt = "a"), timeout = 30, priority = 2)
+        return generation, nc.published
+    generation, published = run(test)
+    (subject, _, headers), = published
+    assert subject == 'img-gen'
+    assert headers["imageInbox"] == generation.image_inbox == f"_INBOX.requester.{generation.generation_id}"
+    assert headers["priority"] == '2' and int(headers["deadline"]) > 0
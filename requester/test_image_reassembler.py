@@ -0,0 +1,52 @@
+import asyncio, hashlib, random
+from types import SimpleNamespace
+import pytest
+from image_reassembler import ImageReassembler, TransferError
+
+IMAGE = bytes(random.Random(0).randrange(256) for _ in range(1000))
+
+
+# Messages as the worker's ImageSender sends them in chunked mode
+def chunk_messages(data : bytes, chunk_size : int, transfer_id : str = "t1", sha256 : str = None):
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    return [SimpleNamespace(data = chunk,
+                            headers = dict(success = 'true', transfer = 'chunked', transferId = transfer_id, mimetype = 'image/png',
+                                           chunkIndex = str(i), chunkCount = str(len(chunks)), totalBytes = str(len(data)),
+                                           sha256 = sha256 or hashlib.sha256(data).hexdigest()))
+            for i, chunk in enumerate(chunks)]
+
+def receive_all(reassembler : ImageReassembler, messages):
+    async def main():
+        return [await reassembler.receive(msg) for msg in messages]
+    return asyncio.run(main())
+
+
+def test_chunks_are_reassembled_in_any_order():
+    messages = chunk_messages(IMAGE, 300)
+    random.Random(1).shuffle(messages)
+    results = receive_all(ImageReassembler(nc = None), messages)
+    assert results[:-1] == [None] * (len(messages) - 1)
+    assert results[-1].data == IMAGE
+    assert results[-1].headers['mimetype'] == 'image/png'
+
+def test_interleaved_transfers_are_kept_apart():
+    first, second = chunk_messages(IMAGE, 400, "a"), chunk_messages(IMAGE[::-1], 400, "b")
+    results = receive_all(ImageReassembler(nc = None), [m for pair in zip(first, second) for m in pair])
+    assert [r.data for r in results if r is not None] == [IMAGE, IMAGE[::-1]]
+
+def test_a_bad_checksum_is_rejected():
+    messages = chunk_messages(IMAGE, 300, sha256 = "0" * 64)
+    with pytest.raises(TransferError):
+        receive_all(ImageReassembler(nc = None), messages)
+
+def test_a_wrong_length_is_rejected():
+    messages = chunk_messages(IMAGE, 300)
+    for msg in messages:
+        msg.headers['totalBytes'] = str(len(IMAGE) + 1)
+    with pytest.raises(TransferError):
+        receive_all(ImageReassembler(nc = None), messages)
+
+def test_messages_without_a_transfer_are_passed_through():
+    failure = SimpleNamespace(data = b'There was a problem generating the image.', headers = dict(success = 'false'))
+    [result] = receive_all(ImageReassembler(nc = None), [failure])
+    assert result.data == failure.data and result.headers == failure.headers
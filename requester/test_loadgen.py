@@ -0,0 +1,83 @@
+import asyncio
+from argparse import Namespace
+from types import SimpleNamespace
+import pytest
+from client import GenerationFailed
+from image_reassembler import TransferError
+import loadgen
+from loadgen import percentiles, report
+
+
+def timing(sent = 0.0, assigned = None, first_progress = None, finished = None, success = True, error = None):
+    return SimpleNamespace(sent = sent, assigned = assigned, first_progress = first_progress, finished = finished, success = success, error = error)
+
+
+def test_percentiles():
+    assert percentiles([]) is None
+    assert percentiles([0.5]) == dict(p50 = 0.5, p95 = 0.5, p99 = 0.5, count = 1)
+    summary = percentiles([float(i) for i in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["p50"] == pytest.approx(50.5)
+    assert summary["p95"] == pytest.approx(95.05)
+    assert summary["p99"] == pytest.approx(99.01)
+
+def test_report():
+    cli_args = Namespace(mode = "open", rate = 2.0, users = 4)
+    timings = [timing(sent = 1.0, assigned = 1.1, first_progress = 1.5, finished = 3.0),
+               timing(sent = 2.0, assigned = 2.2, first_progress = 2.5, finished = 5.0),
+               timing(sent = 3.0, assigned = 3.1, success = False, error = "timeout"),
+               timing(sent = 4.0, success = False, error = "timeout"),
+               timing(sent = 5.0, success = False, error = "No workers available")]
+    results = report(cli_args, timings, wall_seconds = 10.0)
+    assert results["mode"] == "open" and results["rate"] == 2.0 and results["users"] is None
+    assert (results["requests"], results["succeeded"]) == (5, 2)
+    assert results["failure_rate"] == 0.6
+    assert results["errors"] == { "timeout": 2, "No workers available": 1 }
+    assert results["throughput_per_second"] == 0.2
+    # Only requests that got that far count towards each latency
+    assert results["time_to_assignment"]["count"] == 3
+    assert results["time_to_first_progress"] == percentiles([0.5, 0.5])
+    assert results["time_to_image"] == percentiles([2.0, 3.0])
+
+def test_report_without_requests():
+    results = report(Namespace(mode = "closed", rate = 1.0, users = 4), [], wall_seconds = 0.0)
+    assert results["users"] == 4 and results["rate"] is None
+    assert results["failure_rate"] is None and results["throughput_per_second"] is None
+    assert results["time_to_image"] is None
+
+
+class FakeGeneration:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.sent_at, self.assigned_at, self.first_progress_at, self.finished_at = 0.0, None, None, None
+
+    async def wait(self, timeout):
+        await asyncio.sleep(0)
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        self.finished_at = 1.0
+
+
+class FakeClient:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.payloads = []
+
+    async def generate(self, payload):
+        self.payloads.append(payload)
+        return FakeGeneration(self.outcomes.pop(0))
+
+
+def test_failures_are_recorded_by_reason():
+    outcomes = [None, asyncio.TimeoutError(), GenerationFailed("No workers available", {}), TransferError("Checksum of the received image does not match")]
+    client = FakeClient(outcomes)
+    timings = [asyncio.run(loadgen.generate_one(client, {}, timeout = 1)) for _ in outcomes]
+    assert [(t.success, t.error) for t in timings] == [(True, None), (False, "timeout"), (False, "No workers available"),
+                                                        (False, "Checksum of the received image does not match")]
+
+def test_closed_loop_sends_every_request_once():
+    cli_args = Namespace(requests = 10, users = 3, num_steps = 4, height = 128, width = 128, format = "png", seed = None, timeout = 1)
+    client = FakeClient([None] * 10)
+    timings = asyncio.run(loadgen.closed_loop(client, cli_args, ["a", "b"]))
+    assert len(timings) == 10 and all(t.success for t in timings)
+    assert [payload["prompt"] for payload in client.payloads] == ["a", "b"] * 5
@@ -0,0 +1,22 @@
+import importlib.util, os
+from argparse import ArgumentParser
+import pytest
+
+# `requester` is also the name of this directory's package, so the script is loaded from its path
+spec = importlib.util.spec_from_file_location("requester_script", os.path.join(os.path.dirname(__file__), "requester.py"))
+requester_script = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(requester_script)
+AtLeastOne = requester_script.AtLeastOne
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "two"])
+def test_concurrency_below_one_is_refused(value, capsys):
+    parser = ArgumentParser()
+    parser.add_argument("--concurrency", type = AtLeastOne, default = 4)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--concurrency", value])
+    assert "--concurrency" in capsys.readouterr().err
+
+def test_concurrency_of_at_least_one():
+    assert AtLeastOne("1") == 1
+    assert AtLeastOne("16") == 16
@@ -0,0 +1,62 @@
+import pytest
+import worker_registry
+from worker_registry import WorkerRegistry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1000.0
+    monkeypatch.setattr(worker_registry.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def heartbeat(worker_id, free_slots = 1, interval = 2.0):
+    return dict(workerId = worker_id, timestamp = 0, intervalSeconds = interval, freeSlots = free_slots, totalSlots = 2,
+                running = 0, loadedModels = [], queueDepth = 0, recentStepSeconds = None)
+
+
+def test_picks_only_free_workers(clock):
+    registry = WorkerRegistry(nc = None)
+    registry.record(heartbeat("busy", free_slots = 0))
+    registry.record(heartbeat("free", free_slots = 1))
+    assert registry.pick_free_worker() == "free"
+    # The pick is assumed to take its only free slot
+    assert registry.pick_free_worker() is None
+    assert registry.workers()["free"]["freeSlots"] == 0
+
+def test_picks_rotate_between_free_workers(clock):
+    registry = WorkerRegistry(nc = None)
+    registry.record(heartbeat("a", free_slots = 2))
+    registry.record(heartbeat("b", free_slots = 2))
+    assert [registry.pick_free_worker() for _ in range(5)] == ["a", "b", "a", "b", None]
+
+def test_a_heartbeat_replaces_the_assumed_state(clock):
+    registry = WorkerRegistry(nc = None)
+    registry.record(heartbeat("a", free_slots = 1))
+    assert registry.pick_free_worker() == "a"
+    registry.record(heartbeat("a", free_slots = 1))
+    assert registry.pick_free_worker() == "a"
+    registry.record(heartbeat("a", free_slots = 0))
+    assert registry.pick_free_worker() is None
+
+def test_workers_are_forgotten_after_three_missed_heartbeats(clock):
+    registry = WorkerRegistry(nc = None)
+    registry.record(heartbeat("fast", interval = 1.0))
+    registry.record(heartbeat("slow", interval = 5.0))
+    clock.now += 3.0
+    assert set(registry.workers()) == { "fast", "slow" }
+    clock.now += 0.5
+    assert set(registry.workers()) == { "slow" }
+    clock.now += 12.0
+    assert registry.workers() == {}
+
+def test_stale_free_workers_are_never_picked(clock):
+    registry = WorkerRegistry(nc = None)
+    registry.record(heartbeat("gone", interval = 1.0))
+    clock.now += 1.0
+    registry.record(heartbeat("alive", interval = 1.0))
+    clock.now += 2.5
+    assert registry.pick_free_worker() == "alive"
+    assert registry.pick_free_worker() is None
+    assert set(registry.workers()) == { "alive" }
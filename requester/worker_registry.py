@@ -0,0 +1,76 @@
+import json, time
+from typing import Dict, Optional
+from nats.aio.client import Client as NATS
+from nats.aio.msg import Msg
+
+
+class WorkerRegistry:
+    """
+    Keeps the latest heartbeat of every worker (from `worker-heartbeat.*`), so that tools can see the state of the pool
+    and pick a free worker without probing it.
+
+    A worker that misses `missed_heartbeats` heartbeats in a row (going by the interval it advertises) is evicted.
+    The free workers are kept in an ordered dict used as an ordered set: `pick_free_worker` takes the first one
+    and moves it to the back, so picks are O(1) and rotate between the free workers.
+    """
+
+    def __init__(self, nc : NATS, missed_heartbeats : int = 3):
+        self.nc = nc
+        self.missed_heartbeats = missed_heartbeats
+        # worker ID -> (latest heartbeat, time.monotonic it was received)
+        self._workers : Dict[str, tuple] = {}
+        self._free : Dict[str, None] = {}
+        self._sub = None
+
+    async def start(self):
+        self._sub = await self.nc.subscribe("worker-heartbeat.*", cb = self._on_heartbeat)
+
+    async def stop(self):
+        if self._sub is not None:
+            await self._sub.unsubscribe()
+
+    async def _on_heartbeat(self, msg : Msg):
+        self.record(json.loads(msg.data.decode()))
+
+    def record(self, heartbeat : Dict[str, any]):
+        worker_id = heartbeat["workerId"]
+        self._workers[worker_id] = (heartbeat, time.monotonic())
+        if heartbeat.get("freeSlots", 0) > 0:
+            self._free.setdefault(worker_id, None)
+        else:
+            self._free.pop(worker_id, None)
+
+    def pick_free_worker(self) -> Optional[str]:
+        while self._free:
+            worker_id = next(iter(self._free))
+            del self._free[worker_id]
+            if self._is_stale(worker_id):
+                self._evict(worker_id)
+                continue
+            # Assume the pick takes a slot until the worker's next heartbeat says otherwise
+            heartbeat, received_at = self._workers[worker_id]
+            heartbeat = dict(heartbeat, freeSlots = heartbeat["freeSlots"] - 1)
+            self._workers[worker_id] = (heartbeat, received_at)
+            if heartbeat["freeSlots"] > 0:
+                self._free[worker_id] = None
+            return worker_id
+        return None
+
+    def evict_stale(self) -> int:
+        stale = [worker_id for worker_id in self._workers if self._is_stale(worker_id)]
+        for worker_id in stale:
+            self._evict(worker_id)
+        return len(stale)
+
+    def workers(self) -> Dict[str, Dict[str, any]]:
+        self.evict_stale()
+        return { worker_id: heartbeat for worker_id, (heartbeat, _) in self._workers.items() }
+
+    def _is_stale(self, worker_id : str) -> bool:
+        heartbeat, received_at = self._workers[worker_id]
+        interval = heartbeat.get("intervalSeconds") or 2.0
+        return time.monotonic() - received_at > self.missed_heartbeats * interval
+
+    def _evict(self, worker_id : str):
+        self._workers.pop(worker_id, None)
+        self._free.pop(worker_id, None)
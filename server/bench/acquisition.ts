@@ -0,0 +1,110 @@
+import { connect, headers, type Msg, type NatsConnection } from "nats";
+import { WorkerRegistry } from "../workerRegistry";
+import { WorkerAcquisition, type AcquisitionMode } from "../workerAcquisition";
+
+// Acquisition latency percentiles for sequential and scatter acquisition, with different fractions of the pool busy.
+// Only needs a NATs server - the workers are simulated in-process:
+//   bun run bench/acquisition.ts
+//
+// Before every acquisition a new random set of workers is made busy, and the registry is fed the heartbeats of the
+// previous set, so what it believes is always one step out of date (as heartbeats are between beats).
+
+const NATS_URL = process.env.NATS_SERVER_URL || 'nats://localhost:4223';
+const POOL_SIZE = Number(process.env.POOL_SIZE || 50);
+const ACQUISITIONS = Number(process.env.ACQUISITIONS || 300);
+const FANOUT = Number(process.env.SCATTER_FANOUT || 4);
+const BUSY_RATIOS = [0, 0.5, 0.8, 0.9, 0.95];
+const MODES : AcquisitionMode[] = ['sequential', 'scatter'];
+// How long a worker takes to answer a probe
+const PROBE_DELAY_MS = 2;
+
+type FakeWorker = { id : string, busy : boolean };
+
+function startFakeWorkers(nc : NatsConnection, count : number) : FakeWorker[] {
+    const workers : FakeWorker[] = [];
+    for (let i = 0; i < count; i++) {
+        const worker = { id: `bench-worker-${i}`, busy: false };
+        const answer = (err : any, m : Msg) => {
+            setTimeout(() => {
+                const h = headers();
+                h.set('willing', String(!worker.busy));
+                h.set('workerId', worker.id);
+                h.set('freeSlots', '0');
+                h.set('totalSlots', '1');
+                if (!worker.busy) {
+                    h.set('leaseId', crypto.randomUUID());
+                }
+                m.respond("", { headers: h, reply: worker.id });
+            }, PROBE_DELAY_MS);
+        };
+        nc.subscribe('request-worker', { queue: 'bench-workers', callback: answer });
+        nc.subscribe(`request-worker.${worker.id}`, { callback: answer });
+        workers.push(worker);
+    }
+    return workers;
+}
+
+function heartbeatsOf(registry : WorkerRegistry, workers : FakeWorker[]) {
+    for (const worker of workers) {
+        registry.record({
+            workerId: worker.id,
+            timestamp: Date.now(),
+            intervalSeconds: 2,
+            freeSlots: worker.busy ? 0 : 1,
+            totalSlots: 1,
+            running: worker.busy ? 1 : 0,
+            loadedModels: [],
+            queueDepth: 0,
+            recentStepSeconds: null
+        });
+    }
+}
+
+function makeBusy(workers : FakeWorker[], ratio : number) {
+    const shuffled = [...workers].sort(() => Math.random() - 0.5);
+    shuffled.forEach((worker, i) => worker.busy = i < Math.round(ratio * workers.length));
+}
+
+function percentile(sorted : number[], p : number) : number {
+    return sorted[Math.min(sorted.length - 1, Math.floor(p / 100 * sorted.length))];
+}
+
+const workerConnection = await connect({ servers: NATS_URL });
+const serverConnection = await connect({ servers: NATS_URL });
+const workers = startFakeWorkers(workerConnection, POOL_SIZE);
+let releases = 0;
+workerConnection.subscribe('release-worker.*', { callback: () => { releases += 1; } });
+await workerConnection.flush();
+
+console.log(`${POOL_SIZE} workers, ${ACQUISITIONS} acquisitions per row, scatter fanout ${FANOUT}, ${PROBE_DELAY_MS}ms to answer a probe`);
+console.log(`mode        busy    p50 ms   p95 ms   p99 ms   failed   released`);
+for (const busyRatio of BUSY_RATIOS) {
+    for (const mode of MODES) {
+        const registry = new WorkerRegistry();
+        const acquisition = new WorkerAcquisition(serverConnection, registry, () => true,
+                                                  { mode, maxAttempts: 10, fanout: FANOUT, probeTimeoutMs: 1000 });
+        const latencies : number[] = [];
+        let failed = 0;
+        releases = 0;
+        makeBusy(workers, busyRatio);
+        for (let i = 0; i < ACQUISITIONS; i++) {
+            heartbeatsOf(registry, workers);
+            makeBusy(workers, busyRatio);
+            const start = performance.now();
+            const worker = await acquisition.acquire();
+            latencies.push(performance.now() - start);
+            if (worker == null) {
+                failed += 1;
+            }
+        }
+        await serverConnection.flush();
+        await workerConnection.flush();
+        latencies.sort((a, b) => a - b);
+        console.log(`${mode.padEnd(12)}${busyRatio.toFixed(2).padEnd(8)}` +
+                    `${percentile(latencies, 50).toFixed(1).padStart(6)}   ${percentile(latencies, 95).toFixed(1).padStart(6)}   ` +
+                    `${percentile(latencies, 99).toFixed(1).padStart(6)}   ${String(failed).padStart(6)}   ${String(releases).padStart(8)}`);
+    }
+}
+
+await serverConnection.drain();
+await workerConnection.drain();
@@ -0,0 +1,42 @@
+import { getBlacklistVersion, loadBlacklistedWorkerIDs } from "./db";
+
+// How often to ask the database whether the blacklist changed
+const VERSION_CHECK_INTERVAL_MS = 5000;
+// Reload regardless this often, which also picks up a blacklisted workerID edited in place (the version can't see that)
+const FULL_RELOAD_INTERVAL_MS = 60000;
+
+// The BlacklistedWorker table, held in memory so that vetting a worker never waits on the database.
+// Every few seconds a cheap version check (row count and highest id) decides whether the set needs reloading.
+// If the database can't be reached, the last loaded blacklist stays in force.
+export class WorkerBlacklist {
+    private blacklisted = new Set<string>();
+    private version : string|null = null;
+    private loadedAt = 0;
+
+    async start() {
+        await this.refresh();
+        setInterval(() => this.refresh(), VERSION_CHECK_INTERVAL_MS);
+    }
+
+    isTrustworthy(workerId : string) : boolean {
+        return !this.blacklisted.has(workerId);
+    }
+
+    async refresh() {
+        try {
+            const version = await getBlacklistVersion();
+            if (version === this.version && Date.now() - this.loadedAt < FULL_RELOAD_INTERVAL_MS) {
+                return;
+            }
+            this.blacklisted = new Set(await loadBlacklistedWorkerIDs());
+            this.version = version;
+            this.loadedAt = Date.now();
+            console.log(`Loaded ${this.blacklisted.size} blacklisted worker(s)`);
+        }
+        catch (e) {
+            console.log(`Could not refresh the worker blacklist: ${e}`);
+        }
+    }
+}
+
+export const workerBlacklist = new WorkerBlacklist();
@@ -4,4 +4,11 @@ export type GenImgRequest = {
     numSteps : number 
     height : number 
     width : number
+    format? : string // png (default), webp, jpeg or raw
+    quality? : number // compression level for png, quality for jpeg and webp
+    guidance? : number
+    model? : string // the worker's default model if not given (workers reject models and LoRAs they don't allow)
+    quantize? : number
+    loraPaths? : string[]
+    loraScales? : number[]
 };
@@ -0,0 +1,238 @@
+import { JSONCodec, type Msg, type NatsConnection } from "nats";
+import type { WorkerHeartbeat } from "./workerRegistry";
+
+// Seconds of history kept for the time series (one sample a second)
+const HISTORY_SECONDS = 300;
+// Latency samples kept per histogram
+const LATENCY_SAMPLES = 1000;
+// Requests followed from arrival to completion at once - the oldest are forgotten beyond this
+const MAX_TRACKED_REQUESTS = 10000;
+// Heartbeat samples kept per worker for its rolling utilisation
+const UTILISATION_SAMPLES = 60;
+const WORKER_STALE_MS = 10000;
+// Upper bounds of the latency histogram buckets, in seconds
+const LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60];
+
+// A fixed-size buffer that overwrites its oldest value once full
+export class RingBuffer<T> {
+    private items : T[] = [];
+    private next = 0;
+
+    constructor(readonly capacity : number) {}
+
+    push(item : T) {
+        if (this.items.length < this.capacity) {
+            this.items.push(item);
+        }
+        else {
+            this.items[this.next] = item;
+        }
+        this.next = (this.next + 1) % this.capacity;
+    }
+
+    // Oldest first
+    values() : T[] {
+        return this.items.length < this.capacity ? [...this.items] : [...this.items.slice(this.next), ...this.items.slice(0, this.next)];
+    }
+}
+
+type Tracked = { receivedAt : number, assignedAt? : number, firstProgressAt? : number, lastProgress? : { step : number, elapsedMs : number } };
+type Tick = { timestamp : number, requests : number, completed : number, failed : number, queueDepth : number, running : number, slots : number };
+type WorkerEntry = { heartbeat : WorkerHeartbeat, receivedAt : number, utilisation : RingBuffer<number> };
+
+// Aggregates what flows over NATs into rolling throughput, queue depth, per-worker utilisation and latency histograms,
+// for the /dashboard page. Heartbeats, worker assignments and progress are subscribed to; the request handler reports
+// arrivals and completions (it already listens for those). Everything is in fixed-size ring buffers - nothing touches Postgres.
+export class DashboardAggregator {
+    private tracked = new Map<string, Tracked>();
+    private workers = new Map<string, WorkerEntry>();
+    private history = new RingBuffer<Tick>(HISTORY_SECONDS);
+    private latencies = {
+        timeToAssignment: new RingBuffer<number>(LATENCY_SAMPLES),
+        timeToFirstProgress: new RingBuffer<number>(LATENCY_SAMPLES),
+        timeToImage: new RingBuffer<number>(LATENCY_SAMPLES),
+        stepSeconds: new RingBuffer<number>(LATENCY_SAMPLES)
+    };
+    // Counts since the last tick
+    private current = { requests: 0, completed: 0, failed: 0 };
+    private totals = { requests: 0, completed: 0, failed: 0 };
+
+    start(nc : NatsConnection) {
+        const jc = JSONCodec<WorkerHeartbeat>();
+        this.consume(nc, 'worker-heartbeat.*', m => this.recordHeartbeat(jc.decode(m.data)));
+        // Inboxes are _INBOX.{id} (or _INBOX.{prefix}.{id} for the Python client, which shares one prefix between requests)
+        for (const inbox of ['_INBOX.*', '_INBOX.*.*']) {
+            this.consume(nc, `${inbox}.worker-assigned`, m => this.recordAssigned(imageInboxOf(m.subject)));
+            this.consume(nc, `${inbox}.worker-progress`, m => {
+                if (m.headers?.get('kind') !== 'preview') {
+                    this.recordProgress(imageInboxOf(m.subject), m.data);
+                }
+            });
+        }
+        setInterval(() => this.tick(), 1000);
+    }
+
+    recordRequest(imageInbox : string) {
+        this.current.requests += 1;
+        this.totals.requests += 1;
+        this.tracked.set(imageInbox, { receivedAt: Date.now() });
+        if (this.tracked.size > MAX_TRACKED_REQUESTS) {
+            // Maps iterate in insertion order, so this is the oldest
+            this.tracked.delete(this.tracked.keys().next().value!!);
+        }
+    }
+
+    recordCompletion(imageInbox : string, successful : boolean) {
+        const key = successful ? 'completed' : 'failed';
+        this.current[key] += 1;
+        this.totals[key] += 1;
+        const tracked = this.tracked.get(imageInbox);
+        if (tracked != null) {
+            this.tracked.delete(imageInbox);
+            if (successful) {
+                this.latencies.timeToImage.push((Date.now() - tracked.receivedAt) / 1000);
+            }
+        }
+    }
+
+    snapshot() {
+        const now = Date.now();
+        const workers = [...this.workers.values()]
+            .filter(entry => now - entry.receivedAt <= WORKER_STALE_MS)
+            .map(({ heartbeat, utilisation }) => ({
+                workerId: heartbeat.workerId,
+                running: heartbeat.running,
+                freeSlots: heartbeat.freeSlots,
+                totalSlots: heartbeat.totalSlots,
+                queueDepth: heartbeat.queueDepth,
+                utilisation: round(mean(utilisation.values())),
+                recentStepSeconds: heartbeat.recentStepSeconds,
+                loadedModels: heartbeat.loadedModels
+            }));
+        const history = this.history.values();
+        const lastMinute = history.slice(-60);
+        return {
+            timestamp: now,
+            totals: this.totals,
+            inFlight: this.tracked.size,
+            throughputPerSecond: {
+                lastMinute: round(sum(lastMinute.map(tick => tick.completed)) / Math.max(1, lastMinute.length)),
+                lastFiveMinutes: round(sum(history.map(tick => tick.completed)) / Math.max(1, history.length))
+            },
+            queueDepth: history.length > 0 ? history[history.length - 1].queueDepth : 0,
+            utilisation: round(sum(workers.map(w => w.running)) / Math.max(1, sum(workers.map(w => w.totalSlots)))),
+            workers,
+            latencies: Object.fromEntries(Object.entries(this.latencies).map(([name, samples]) => [name, histogram(samples.values())])),
+            history
+        };
+    }
+
+    private recordHeartbeat(heartbeat : WorkerHeartbeat) {
+        let entry = this.workers.get(heartbeat.workerId);
+        if (entry == null) {
+            entry = { heartbeat, receivedAt: Date.now(), utilisation: new RingBuffer<number>(UTILISATION_SAMPLES) };
+            this.workers.set(heartbeat.workerId, entry);
+        }
+        entry.heartbeat = heartbeat;
+        entry.receivedAt = Date.now();
+    }
+
+    private recordAssigned(imageInbox : string) {
+        const tracked = this.tracked.get(imageInbox);
+        if (tracked != null && tracked.assignedAt == null) {
+            tracked.assignedAt = Date.now();
+            this.latencies.timeToAssignment.push((tracked.assignedAt - tracked.receivedAt) / 1000);
+        }
+    }
+
+    // Progress is step (uint16), total steps (uint16), elapsed milliseconds (uint32), big-endian
+    private recordProgress(imageInbox : string, data : Uint8Array) {
+        if (data.length < 8) {
+            return;
+        }
+        const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+        const step = view.getUint16(0);
+        const elapsedMs = view.getUint32(4);
+        const tracked = this.tracked.get(imageInbox);
+        if (tracked == null) {
+            return;
+        }
+        if (tracked.firstProgressAt == null) {
+            tracked.firstProgressAt = Date.now();
+            this.latencies.timeToFirstProgress.push((tracked.firstProgressAt - tracked.receivedAt) / 1000);
+        }
+        // The time up to the first step also covers waiting in the worker's queue and loading the model, so step times are
+        // only taken between consecutive progress messages - which can be several steps apart, as the worker coalesces them
+        const last = tracked.lastProgress;
+        if (last != null && step > last.step) {
+            this.latencies.stepSeconds.push((elapsedMs - last.elapsedMs) / (step - last.step) / 1000);
+        }
+        tracked.lastProgress = { step, elapsedMs };
+    }
+
+    private tick() {
+        const now = Date.now();
+        let queueDepth = 0, running = 0, slots = 0;
+        for (const [workerId, entry] of this.workers) {
+            if (now - entry.receivedAt > WORKER_STALE_MS) {
+                this.workers.delete(workerId);
+                continue;
+            }
+            const { heartbeat } = entry;
+            queueDepth += heartbeat.queueDepth;
+            running += heartbeat.running;
+            slots += heartbeat.totalSlots;
+            entry.utilisation.push(heartbeat.running / Math.max(1, heartbeat.totalSlots));
+        }
+        this.history.push({ timestamp: now, ...this.current, queueDepth, running, slots });
+        this.current = { requests: 0, completed: 0, failed: 0 };
+    }
+
+    private consume(nc : NatsConnection, subject : string, handle : (m : Msg) => void) {
+        const sub = nc.subscribe(subject);
+        (async () => {
+            for await (const m of sub) {
+                try {
+                    handle(m);
+                }
+                catch (e) {
+                    console.log(`Dashboard ignoring malformed message on ${m.subject}`);
+                }
+            }
+        })();
+    }
+}
+
+function imageInboxOf(subject : string) : string {
+    return subject.slice(0, subject.lastIndexOf('.'));
+}
+
+function histogram(samples : number[]) {
+    const sorted = [...samples].sort((a, b) => a - b);
+    const quantile = (q : number) => sorted.length > 0 ? round(sorted[Math.min(sorted.length - 1, Math.floor(q * sorted.length))]) : null;
+    return {
+        count: sorted.length,
+        p50: quantile(0.5),
+        p95: quantile(0.95),
+        p99: quantile(0.99),
+        // Cumulative, like Prometheus buckets
+        buckets: [...LATENCY_BUCKETS, Infinity].map(le => ({
+            le: Number.isFinite(le) ? le : '+Inf',
+            count: sorted.filter(s => s <= le).length
+        }))
+    };
+}
+
+function sum(values : number[]) : number {
+    return values.reduce((a, b) => a + b, 0);
+}
+
+function mean(values : number[]) : number {
+    return values.length > 0 ? sum(values) / values.length : 0;
+}
+
+function round(x : number) : number {
+    return Math.round(x * 1000) / 1000;
+}
+
+export const dashboardAggregator = new DashboardAggregator();
@@ -0,0 +1,76 @@
+// The live dashboard: a single page that polls /dashboard.json every second. No build step, no dependencies.
+export const DASHBOARD_HTML = `<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>distr_mflux dashboard</title>
+<style>
+  body { font-family: system-ui, sans-serif; margin: 2em; color: #222; }
+  h1 { font-size: 1.3em; }
+  h2 { font-size: 1.05em; margin-top: 1.5em; }
+  .tiles { display: flex; gap: 1em; flex-wrap: wrap; }
+  .tile { border: 1px solid #ddd; border-radius: 6px; padding: 0.6em 1em; min-width: 9em; }
+  .tile .value { font-size: 1.6em; font-weight: 600; }
+  .tile .label { color: #777; font-size: 0.85em; }
+  table { border-collapse: collapse; }
+  th, td { text-align: right; padding: 0.25em 0.8em; border-bottom: 1px solid #eee; }
+  th:first-child, td:first-child { text-align: left; }
+  svg { border: 1px solid #eee; }
+</style>
+</head>
+<body>
+<h1>distr_mflux</h1>
+<div class="tiles" id="tiles"></div>
+<h2>Completed per second / queue depth (last 5 minutes)</h2>
+<svg id="throughput" width="600" height="80"></svg>
+<svg id="queue" width="600" height="80"></svg>
+<h2>Latency (seconds)</h2>
+<table id="latencies"></table>
+<h2>Workers</h2>
+<table id="workers"></table>
+<script>
+// Worker IDs and model names come from heartbeats, which any NATS client can publish - so nothing is inserted unescaped
+function escapeHtml(value) {
+  return String(value).replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' })[c]);
+}
+function tile(label, value) {
+  return '<div class="tile"><div class="value">' + escapeHtml(value) + '</div><div class="label">' + escapeHtml(label) + '</div></div>';
+}
+function sparkline(svg, values, color) {
+  const width = svg.width.baseVal.value, height = svg.height.baseVal.value;
+  const max = Math.max(1, ...values);
+  const points = values.map((v, i) => (i * width / Math.max(1, values.length - 1)).toFixed(1) + ',' + (height - 4 - v / max * (height - 8)).toFixed(1));
+  svg.innerHTML = '<polyline fill="none" stroke="' + color + '" stroke-width="1.5" points="' + points.join(' ') + '"/>' +
+                  '<text x="4" y="12" font-size="10" fill="#777">max ' + escapeHtml(max) + '</text>';
+}
+function row(cells, tag) {
+  return '<tr>' + cells.map(c => '<' + tag + '>' + escapeHtml(c ?? '-') + '</' + tag + '>').join('') + '</tr>';
+}
+async function refresh() {
+  try {
+    const d = await (await fetch('dashboard.json')).json();
+    document.getElementById('tiles').innerHTML =
+      tile('images/s (1 min)', d.throughputPerSecond.lastMinute) +
+      tile('images/s (5 min)', d.throughputPerSecond.lastFiveMinutes) +
+      tile('in flight', d.inFlight) +
+      tile('queue depth', d.queueDepth) +
+      tile('utilisation', Math.round(100 * d.utilisation) + '%') +
+      tile('workers', d.workers.length) +
+      tile('completed / failed', d.totals.completed + ' / ' + d.totals.failed);
+    sparkline(document.getElementById('throughput'), d.history.map(t => t.completed), '#2a7');
+    sparkline(document.getElementById('queue'), d.history.map(t => t.queueDepth), '#c60');
+    document.getElementById('latencies').innerHTML = row(['', 'count', 'p50', 'p95', 'p99'], 'th') +
+      Object.entries(d.latencies).map(([name, h]) => row([name, h.count, h.p50, h.p95, h.p99], 'td')).join('');
+    document.getElementById('workers').innerHTML = row(['worker', 'running', 'slots', 'queued', 'utilisation', 'step s', 'models'], 'th') +
+      d.workers.map(w => row([w.workerId, w.running, w.totalSlots, w.queueDepth, Math.round(100 * w.utilisation) + '%',
+                              w.recentStepSeconds?.toFixed(3), w.loadedModels.join(', ')], 'td')).join('');
+  }
+  catch (e) {
+    console.log(e);
+  }
+}
+refresh();
+setInterval(refresh, 1000);
+</script>
+</body>
+</html>`;
@@ -5,35 +5,61 @@ import type { GenImgRequest } from "./coms";
 
 const DB = new PrismaClient();
 
-export async function recordImgGenRequest(imageInbox : string, imgGenRequest : GenImgRequest) : Promise<number> {
-    const dbRec = await DB.imgGenRequest.create({
-        data: {
-            imageInbox,
-            ...imgGenRequest
-        }
-    });
-    return dbRec.id;
-}
+// What happens to a request after it is recorded. Only set fields are written.
+export type ImgGenRequestUpdate = {
+    workerId? : string
+    start? : Date
+    end? : Date
+    successful? : boolean
+    passesVerification? : boolean
+};
+
+export type ImgGenRequestRow = { imageInbox : string, created : Date } & Pick<GenImgRequest, 'prompt'|'seed'|'numSteps'|'height'|'width'> & ImgGenRequestUpdate;
 
-export async function updateImgGenRequestRecord(dbID : number, props : Prisma.ImgGenRequestUpdateInput) {
-    await DB.imgGenRequest.update({
-        where: {
-            id: dbID
-        },
-        data: props
+// One multi-row INSERT
+export async function insertImgGenRequests(rows : ImgGenRequestRow[]) {
+    await DB.imgGenRequest.createMany({
+        data: rows.map(({ imageInbox, created, prompt, seed, numSteps, height, width, workerId, start, end, successful, passesVerification }) =>
+            ({ imageInbox, created, updated: created, prompt, seed, numSteps, height, width, workerId, start, end, successful, passesVerification })),
+        skipDuplicates: true
     });
 }
 
+// One multi-row UPDATE ... FROM (VALUES ...), matched on the imageInbox. Fields left unset in an update keep their value.
+export async function updateImgGenRequests(updates : [string, ImgGenRequestUpdate][]) {
+    const values = updates.map(([imageInbox, u]) => Prisma.sql`(
+        ${imageInbox}::text,
+        ${u.workerId ?? null}::text,
+        ${u.start ?? null}::timestamp(3),
+        ${u.end ?? null}::timestamp(3),
+        ${u.successful ?? null}::boolean,
+        ${u.passesVerification ?? null}::boolean)`);
+    await DB.$executeRaw`
+        UPDATE "ImgGenRequest" AS r SET
+            "workerId" = COALESCE(v."workerId", r."workerId"),
+            "start" = COALESCE(v."start", r."start"),
+            "end" = COALESCE(v."end", r."end"),
+            "successful" = COALESCE(v."successful", r."successful"),
+            "passesVerification" = COALESCE(v."passesVerification", r."passesVerification"),
+            "updated" = CURRENT_TIMESTAMP
+        FROM (VALUES ${Prisma.join(values)}) AS v("imageInbox", "workerId", "start", "end", "successful", "passesVerification")
+        WHERE r."imageInbox" = v."imageInbox"`;
+}
 
-export async function isTrustworthyWorker(workerID : string) : Promise<boolean> {
-    console.log(`Checking if worker ${workerID} is trustworthy`);
-    const record = await DB.blacklistedWorker.findFirst({
-        where: {
-            workerID: workerID
-        },
+export async function loadBlacklistedWorkerIDs() : Promise<string[]> {
+    const records = await DB.blacklistedWorker.findMany({
         select: {
             workerID: true
         }
     });
-    return record == null;
+    return records.map(record => record.workerID);
+}
+
+// Changes whenever a worker is added to or removed from the blacklist (a single aggregate query - no rows are fetched)
+export async function getBlacklistVersion() : Promise<string> {
+    const { _count, _max } = await DB.blacklistedWorker.aggregate({
+        _count: { _all: true },
+        _max: { id: true }
+    });
+    return `${_count._all}:${_max.id ?? 0}`;
 }
\ No newline at end of file
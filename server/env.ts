@@ -1,4 +1,13 @@
+import type { AcquisitionMode } from "./workerAcquisition";
+
 export const env = {
     PORT: Number(process.env.PORT),
-    NATS_SERVER_URL: (process.env.NATS_SERVER_URL || '').trim()
-};
\ No newline at end of file
+    NATS_SERVER_URL: (process.env.NATS_SERVER_URL || '').trim(),
+    ACQUISITION_MODE: (process.env.ACQUISITION_MODE === 'scatter' ? 'scatter' : 'sequential') as AcquisitionMode,
+    SCATTER_FANOUT: Number(process.env.SCATTER_FANOUT || 4),
+    // 'probe' (default): acquire a worker and send it the request. 'work-queue': queue the request on JetStream for workers to pull
+    DISPATCH_MODE: (process.env.DISPATCH_MODE === 'work-queue' ? 'work-queue' : 'probe') as 'probe'|'work-queue',
+    // Off by default: the server picks every seed, so that a requester can't choose the images used to verify workers.
+    // When on, a requester may fix the seed, which makes the request deterministic - and so cacheable
+    ALLOW_CLIENT_SEEDS: process.env.ALLOW_CLIENT_SEEDS === 'true'
+};
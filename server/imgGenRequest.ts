@@ -1,9 +1,10 @@
 import { MsgHdrsImpl, NatsError, StringCodec, type Msg } from "nats";
 import { type GenImgRequest } from "./coms";
 
-export function deserializeImageGenRequest(m : Msg) : Omit<GenImgRequest,'seed'> {
+// The seed is optional - the server picks one unless the requester fixed it
+export function deserializeImageGenRequest(m : Msg) : Omit<GenImgRequest,'seed'> & { seed? : number } {
     const sc = StringCodec();
-    const genImgRequest = JSON.parse(sc.decode(m.data)) as Omit<GenImgRequest,'seed'>;
+    const genImgRequest = JSON.parse(sc.decode(m.data)) as Omit<GenImgRequest,'seed'> & { seed? : number };
     return genImgRequest;
 }
 
@@ -17,11 +18,17 @@ export function wasImageGenerationSuccessful(err : NatsError | null, msg : Msg)
     if (err != null) {
         return false;
     }
-    const success = !!(msg.headers?.get('success'));
-    if (!success) {
-        return false;
+    // Failed, cancelled, expired and busy replies all carry success='false'
+    return msg.headers?.get('success') === 'true';
+}
+
+// Images are delivered in chunks - only the last chunk (or a single unchunked message) completes the generation
+export function isFinalImageMessage(msg : Msg) : boolean {
+    const h = msg.headers;
+    if (h == null || h.get('transfer') !== 'chunked') {
+        return true;
     }
-    return true;
+    return Number(h.get('chunkIndex')) === Number(h.get('chunkCount')) - 1;
 }
 
 export function getImageInbox(m : Msg) : string {
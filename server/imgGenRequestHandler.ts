@@ -1,106 +1,155 @@
-import { headers, NatsError, type Msg } from "nats";
-import { isTrustworthyWorker, recordImgGenRequest as recordImgGenRequest, updateImgGenRequestRecord } from "./db";
+import { headers, NatsError, type Msg, type MsgHdrs } from "nats";
+import { imgGenRequestWriter } from "./imgGenRequestWriter";
 import { nc } from "./nats";
-import { deserializeImageGenRequest, getImageInbox as getImageInboxFromMsgHeader, serializeImageGenRequest, wasImageGenerationSuccessful } from "./imgGenRequest";
+import { workerRegistry } from "./workerRegistry";
+import { workerBlacklist } from "./blacklist";
+import { WorkerAcquisition, getLeaseId } from "./workerAcquisition";
+import { env } from "./env";
+import { lookupCachedResult, resultCacheKey } from "./resultCache";
+import { enqueueImgGenRequest } from "./workQueue";
+import { dashboardAggregator } from "./dashboard";
+import { deserializeImageGenRequest, getImageInbox as getImageInboxFromMsgHeader, isFinalImageMessage, serializeImageGenRequest, wasImageGenerationSuccessful } from "./imgGenRequest";
 
 const MAX_ACQUIRE_WORKER_ATTEMPTS = 10;
+const FORWARDED_HEADERS = ['priority', 'deadline'];
+
+// Workers are vetted against the in-memory blacklist
+const workerAcquisition = new WorkerAcquisition(nc, workerRegistry, workerId => workerBlacklist.isTrustworthy(workerId), {
+    mode: env.ACQUISITION_MODE,
+    maxAttempts: MAX_ACQUIRE_WORKER_ATTEMPTS,
+    fanout: env.SCATTER_FANOUT,
+    probeTimeoutMs: 1000
+});
 
 export async function handleImgGenRequest(m : Msg) {
     
     // This is where the worker will eventually send the image to - the requester is sub'd to this imageInbox
     const requester_id = m.reply;
     const imageInbox = getImageInboxFromMsgHeader(m);  
+    dashboardAggregator.recordRequest(imageInbox);
 
     // Deserialize the image generation request and pick a random seed (server chooses the seed to avoid sybils during verification)
-    const seed = Math.floor(Math.random() * (Math.pow(2,16)-1));
-    const imgGenRequest = { ...deserializeImageGenRequest(m), seed };
+    // Only if the server allows it (ALLOW_CLIENT_SEEDS) can a requester fix the seed instead, which makes the request cacheable
+    const requested = deserializeImageGenRequest(m);
+    const clientSeed = env.ALLOW_CLIENT_SEEDS ? requested.seed : undefined;
+    const seed = clientSeed ?? Math.floor(Math.random() * (Math.pow(2,16)-1));
+    const imgGenRequest = { ...requested, seed };
+
+    // Persist the image generation request (buffered, and written along with other requests in the background)
+    await imgGenRequestWriter.record(imageInbox, imgGenRequest);
+
+    // If the same image was generated before, point the requester at it and don't bother a worker at all
+    // (with a seed picked just now, it can't have been)
+    if (clientSeed != null) {
+        const cachedResult = await lookupCachedResult(resultCacheKey(imgGenRequest));
+        if (cachedResult != null) {
+            console.info(`Serving imageInbox ${imageInbox} from the result cache`);
+            nc.publish(imageInbox, "", { headers: cachedResult });
+            imgGenRequestWriter.update(imageInbox, { successful: true, start: new Date(Date.now()), end: new Date(Date.now()) });
+            dashboardAggregator.recordCompletion(imageInbox, true);
+            return;
+        }
+    }
 
-    // Persist the image generation request
-    const dbID = await recordImgGenRequest(imageInbox, imgGenRequest);
+    // In work-queue mode the request waits in a JetStream stream until a worker with a free slot pulls it - nobody is probed,
+    // and a burst of requests queues up instead of failing. The worker announces itself on {imageInbox}.worker-assigned.
+    if (env.DISPATCH_MODE === 'work-queue') {
+        nc.subscribe(`${imageInbox}.worker-assigned`, {
+            max: 1,
+            callback: (err, msg) => {
+                if (err == null) {
+                    imgGenRequestWriter.update(imageInbox, { workerId: msg.string() });
+                }
+            }
+        });
+        subscribeToImageGenerationCompletion(imageInbox);
+        try {
+            await enqueueImgGenRequest(imageInbox, imgGenRequest, forwardedHeaders(m));
+            console.info(`Queued imageInbox ${imageInbox} on the work queue`);
+        }
+        catch (e) {
+            console.log(`Could not queue imageInbox ${imageInbox}: ${e}`);
+            await sendFailedImgGen(imageInbox, "The request could not be queued");
+        }
+        return;
+    }
 
     // Acquire a non-busy ("willing") worker from the pool
     console.info(`Acquiring a willing worker from the pool`);
-    const willingWorker : Msg|null = await getAWillingWorker();
+    const willingWorker : Msg|null = await workerAcquisition.acquire();
     
     // If we failed to acquire a willing worker, notify the consumer and early-out
     if (willingWorker == null) {
         console.info(`Notifying requester at imageInbox ${imageInbox} that no workers are available`);
         await sendFailedImgGen(imageInbox, "There are no workers available");
-        await updateImgGenRequestRecord(dbID, { successful: false });
+        imgGenRequestWriter.update(imageInbox, { successful: false });
+        dashboardAggregator.recordCompletion(imageInbox, false);
         return;
     }
 
     // Otherwise, update - indicating a worker has been selected
     const workerId = willingWorker.reply!!;
     console.info(`Worker ${workerId} selected for imageInbox ${imageInbox}`);
-    await updateImgGenRequestRecord(dbID, { workerId });
+    imgGenRequestWriter.update(imageInbox, { workerId });
     await nc.publish(`${imageInbox}.worker-assigned`, workerId)
 
     // As the server we will subscribe to the image generation being completed so we can update records (see callback implementation)
-    console.info(`Subscribing to imageInbox ${imageInbox}`);
-    nc.subscribe(imageInbox, {
-        callback: async (err,msg) => postImageGenerationCallback(dbID,err,msg)
-    });
+    subscribeToImageGenerationCompletion(imageInbox);
     
     // Fire off the image generation request to the selected worker, with the reply pointing to the imageInbox
+    // The lease the worker handed out when it volunteered is passed back to claim the slot it reserved for us
     console.info(`Publishing image gen request to ${workerId}`);
+    const h = forwardedHeaders(m);
+    const leaseId = getLeaseId(willingWorker);
+    if (leaseId != null) {
+        h.append('leaseId', leaseId);
+    }
     nc.publish(workerId, serializeImageGenRequest(imgGenRequest), {
-        reply: imageInbox
+        reply: imageInbox,
+        headers: h
     });
 
     // When the worker completes the image, it will send it to the reply (imageInbox), 
     // and therefore the requester will get the image.
 }
 
-async function sendFailedImgGen(imageInbox : string, errorMessage: string) { 
+// The worker orders its queue by these, and drops the request if the deadline passes before its turn
+function forwardedHeaders(m : Msg) : MsgHdrs {
     const h = headers();
-    h.append('success', 'false');
-    nc.publish(imageInbox, errorMessage, {
-        headers: h
-    });
-    return;
-}
-
-async function getAWillingWorker() : Promise<Msg|null> {
-    // Keep asking for a worker until you get one that is willing to accept the work and one that's not blacklisted
-    let attempts = 0;
-    while (attempts < MAX_ACQUIRE_WORKER_ATTEMPTS) {
-        attempts += 1;
-        const worker = await nc.request('request-worker', "").catch(r => transformWorkerError(r));
-        if (isWorker(worker) && isWilling(worker) && (await isTrustworthy(worker))) {
-            return worker;
+    for (const name of FORWARDED_HEADERS) {
+        const value = m.headers?.get(name);
+        if (value) {
+            h.append(name, value);
         }
     }
-    return null;
+    return h;
 }
 
-function transformWorkerError(r : any) {
-    if (r instanceof NatsError) {
-        if (r.code === '503') {
-            return 'no-workers-available';
-        }
-        else if (r.name === 'TIMEOUT') {
-            return 'timeout';
+// The image may arrive in several chunks, so wait for the last one and then stop listening
+function subscribeToImageGenerationCompletion(imageInbox : string) {
+    console.info(`Subscribing to imageInbox ${imageInbox}`);
+    const imageSub = nc.subscribe(imageInbox, {
+        callback: async (err,msg) => {
+            if (err == null && !isFinalImageMessage(msg)) {
+                return;
+            }
+            imageSub.unsubscribe();
+            postImageGenerationCallback(imageInbox,err,msg);
         }
-    }
-    console.log(r);
-    return 'other-error';
-}
-
-function isWorker(x : Msg|string) : x is Msg {
-    return typeof x !== 'string';
-}
-
-function isWilling(x : Msg) : boolean {
-    return x.headers?.get('willing') === 'true';
+    });
 }
 
-async function isTrustworthy(x : Msg) : Promise<boolean> {
-    const workerId = x.headers?.get("workerId")!!;
-    return await isTrustworthyWorker(workerId);
+async function sendFailedImgGen(imageInbox : string, errorMessage: string) { 
+    const h = headers();
+    h.append('success', 'false');
+    nc.publish(imageInbox, errorMessage, {
+        headers: h
+    });
+    return;
 }
 
-async function postImageGenerationCallback(dbID : number, err : NatsError | null, msg : Msg) {
+function postImageGenerationCallback(imageInbox : string, err : NatsError | null, msg : Msg) {
     const successful = wasImageGenerationSuccessful(err,msg);
-    await updateImgGenRequestRecord(dbID, { successful, end: new Date(Date.now()) });
+    imgGenRequestWriter.update(imageInbox, { successful, end: new Date(Date.now()) });
+    dashboardAggregator.recordCompletion(imageInbox, successful);
 }
\ No newline at end of file
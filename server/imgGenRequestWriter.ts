@@ -0,0 +1,133 @@
+import type { GenImgRequest } from "./coms";
+import { insertImgGenRequests, updateImgGenRequests, type ImgGenRequestRow, type ImgGenRequestUpdate } from "./db";
+
+// Flush once this many rows are waiting...
+const FLUSH_ROWS = 500;
+// ...or this long after the first one arrived
+const FLUSH_INTERVAL_MS = 250;
+// Recording waits for a flush beyond this many buffered rows. Rows past it are dropped while the database is unreachable.
+const MAX_BUFFERED_ROWS = 20000;
+
+// Write-behind persistence of ImgGenRequest records, keyed by imageInbox, so handling a request never waits on the database.
+// Inserts and updates are buffered and written in (at most) two statements per flush: a multi-row INSERT and a multi-row UPDATE.
+// An update to a request whose insert hasn't been flushed yet is folded into the insert, and updates to the same request
+// are merged, so a request that starts and finishes between two flushes costs a single row of a single INSERT.
+// Flushes run one at a time, so a row is always inserted before anything updates it.
+export class ImgGenRequestWriter {
+    private inserts = new Map<string, ImgGenRequestRow>();
+    private updates = new Map<string, ImgGenRequestUpdate>();
+    private timer : ReturnType<typeof setTimeout>|null = null;
+    private flushing : Promise<void> = Promise.resolve();
+    // After a failed write, wait for the timer rather than retrying on every new row
+    private retryAfter = 0;
+
+    get buffered() : number {
+        return this.inserts.size + this.updates.size;
+    }
+
+    async record(imageInbox : string, imgGenRequest : GenImgRequest) {
+        if (this.buffered >= MAX_BUFFERED_ROWS) {
+            // The database is falling behind - push back on whoever is recording instead of growing without bound
+            // (after a failed write, by waiting for the flush in progress rather than trying the database again straight away)
+            await (Date.now() >= this.retryAfter ? this.flush() : this.flushing);
+            if (this.buffered >= MAX_BUFFERED_ROWS) {
+                console.log(`Dropping the record of ${imageInbox} - the write-behind buffer is full`);
+                return;
+            }
+        }
+        const { prompt, seed, numSteps, height, width } = imgGenRequest;
+        this.inserts.set(imageInbox, { imageInbox, created: new Date(Date.now()), prompt, seed, numSteps, height, width });
+        this.scheduleFlush();
+    }
+
+    update(imageInbox : string, props : ImgGenRequestUpdate) {
+        const pendingInsert = this.inserts.get(imageInbox);
+        if (pendingInsert != null) {
+            Object.assign(pendingInsert, props);
+        }
+        else {
+            this.updates.set(imageInbox, { ...this.updates.get(imageInbox), ...props });
+        }
+        this.scheduleFlush();
+    }
+
+    // Resolves once everything recorded so far is written (or given up on)
+    flush() : Promise<void> {
+        if (this.timer != null) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        }
+        this.flushing = this.flushing.then(() => this.write());
+        return this.flushing;
+    }
+
+    private scheduleFlush() {
+        if (this.buffered >= FLUSH_ROWS && Date.now() >= this.retryAfter) {
+            this.flush();
+        }
+        else if (this.timer == null) {
+            this.timer = setTimeout(() => { this.timer = null; this.flush(); }, FLUSH_INTERVAL_MS);
+        }
+    }
+
+    private async write() {
+        const inserts = this.inserts;
+        const updates = this.updates;
+        if (inserts.size === 0 && updates.size === 0) {
+            return;
+        }
+        this.inserts = new Map();
+        this.updates = new Map();
+        if (inserts.size > 0) {
+            try {
+                await insertImgGenRequests([...inserts.values()]);
+            }
+            catch (e) {
+                console.log(`Failed to write ${inserts.size} request record(s): ${e}`);
+                this.requeue(inserts, this.inserts);
+                // Their updates can't be applied before the rows exist
+                this.requeue(updates, this.updates);
+                return;
+            }
+        }
+        if (updates.size > 0) {
+            try {
+                await updateImgGenRequests([...updates.entries()]);
+            }
+            catch (e) {
+                console.log(`Failed to write ${updates.size} request update(s): ${e}`);
+                this.requeue(updates, this.updates);
+            }
+        }
+    }
+
+    // Puts rows from a failed write back in front of anything buffered since, dropping what doesn't fit
+    private requeue<T extends object>(failed : Map<string, T>, buffer : Map<string, T>) {
+        const room = MAX_BUFFERED_ROWS - this.buffered;
+        if (failed.size > room) {
+            console.log(`Dropping ${failed.size - Math.max(0, room)} request record(s) - the write-behind buffer is full`);
+        }
+        const merged = new Map<string, T>();
+        let kept = 0;
+        for (const [imageInbox, row] of failed) {
+            if (kept >= room) {
+                break;
+            }
+            merged.set(imageInbox, { ...row, ...buffer.get(imageInbox) });
+            kept += 1;
+        }
+        for (const [imageInbox, row] of buffer) {
+            if (!merged.has(imageInbox)) {
+                merged.set(imageInbox, row);
+            }
+        }
+        buffer.clear();
+        for (const [imageInbox, row] of merged) {
+            buffer.set(imageInbox, row);
+        }
+        this.retryAfter = Date.now() + FLUSH_INTERVAL_MS;
+        this.scheduleFlush();
+    }
+}
+
+export const imgGenRequestWriter = new ImgGenRequestWriter();
@@ -0,0 +1,40 @@
+import { headers, nanos, type MsgHdrs, type ObjectStore } from "nats";
+import { nc } from "./nats";
+
+export { resultCacheKey } from "./resultCacheKey";
+
+// Must match worker/result_cache.py
+export const RESULT_CACHE_BUCKET = "result-cache";
+// Used if the server is first to open the bucket (the same as the workers' defaults)
+const RESULT_CACHE_TTL_MS = 24 * 3600 * 1000;
+const RESULT_CACHE_MAX_BYTES = 1024 ** 3;
+
+let resultCache : ObjectStore|null = null;
+
+// Returns the headers of a reference to the cached image (which the requester fetches itself), or null on a miss.
+export async function lookupCachedResult(key : string) : Promise<MsgHdrs|null> {
+    try {
+        resultCache ??= await nc.jetstream().views.os(RESULT_CACHE_BUCKET, {
+            ttl: nanos(RESULT_CACHE_TTL_MS),
+            max_bytes: RESULT_CACHE_MAX_BYTES
+        });
+        const info = await resultCache.info(key);
+        if (info == null || info.deleted) {
+            return null;
+        }
+        const h = headers();
+        for (const name of info.headers?.keys() ?? []) {
+            h.set(name, info.headers!!.get(name));
+        }
+        h.set('success', 'true');
+        h.set('transfer', 'object-store');
+        h.set('bucket', RESULT_CACHE_BUCKET);
+        h.set('objectName', key);
+        h.set('cached', 'true');
+        return h;
+    }
+    catch (e) {
+        console.log(`Result cache lookup failed: ${e}`);
+        return null;
+    }
+}
@@ -0,0 +1,43 @@
+import { createHash } from "node:crypto";
+import type { GenImgRequest } from "./coms";
+
+// Kept apart from resultCache.ts (which connects to NATs when imported) so that it can be tested on its own.
+// Must match result_cache_key in worker/result_cache.py
+const RESULT_CACHE_KEY_VERSION = "v1";
+const DEFAULT_GUIDANCE = 4.0;
+
+// What a worker generates with when the request doesn't say (the worker's --model and --quantize defaults).
+// A worker started with other defaults caches its images under other keys, so it can never produce a wrong hit - only a miss.
+const DEFAULT_MODEL = "schnell";
+const DEFAULT_QUANTIZE = 8;
+
+// Floats (LoRA scales, guidance) are keyed in thousandths so the same value always serializes the same way.
+// Halves round up, as in worker/result_cache.py (spelled out there, since Python's round() rounds them to even)
+function thousandths(value : number) : number {
+    return Math.floor(value * 1000 + 0.5);
+}
+
+// The SHA-256 of everything that determines the bytes of a generated image, in a fixed order
+// (the same as result_cache_key in worker/result_cache.py - the two must be kept in step)
+export function resultCacheKey(req : GenImgRequest) : string {
+    const loraPaths = req.loraPaths ?? [];
+    const loraScales = req.loraScales ?? loraPaths.map(() => 1.0);
+    const loras = loraPaths
+        .map((path, i) => [path, thousandths(loraScales[i])] as [string, number])
+        .sort(([pathA, scaleA], [pathB, scaleB]) => pathA < pathB ? -1 : pathA > pathB ? 1 : scaleA - scaleB);
+    const fields = [
+        RESULT_CACHE_KEY_VERSION,
+        req.model ?? DEFAULT_MODEL,
+        req.quantize ?? DEFAULT_QUANTIZE,
+        loras,
+        req.prompt,
+        req.seed,
+        req.numSteps,
+        req.height,
+        req.width,
+        thousandths(req.guidance ?? DEFAULT_GUIDANCE),
+        req.format ?? "png",
+        req.quality ?? null
+    ];
+    return createHash("sha256").update(JSON.stringify(fields)).digest("hex");
+}
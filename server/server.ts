@@ -2,6 +2,26 @@ import { Hono } from "hono";
 import { env } from "./env";
 import { nc } from './nats';
 import { handleImgGenRequest } from './imgGenRequestHandler';
+import { workerRegistry } from './workerRegistry';
+import { workerBlacklist } from './blacklist';
+import { imgGenRequestWriter } from './imgGenRequestWriter';
+import { ensureWorkQueue } from './workQueue';
+import { dashboardAggregator } from './dashboard';
+import { DASHBOARD_HTML } from './dashboardPage';
+
+// Keep track of which workers are free from their heartbeats
+workerRegistry.start(nc);
+
+// Throughput, queue depth, utilisation and latencies for the dashboard, from what goes over NATs
+dashboardAggregator.start(nc);
+
+// Vet workers against an in-memory copy of the blacklist (loaded before any request is handled)
+await workerBlacklist.start();
+
+// Requests are queued on JetStream for workers to pull, rather than sent to a worker that was probed
+if (env.DISPATCH_MODE === 'work-queue') {
+    await ensureWorkQueue();
+}
 
 // Subscribe to img-gen pubs from consumers
 const sub = nc.subscribe('img-gen');
@@ -16,13 +36,26 @@ const sub = nc.subscribe('img-gen');
     console.log("subscription closed");
 })();
 
+// Request records are written behind - stop taking requests and write out what is still buffered before exiting
+for (const signal of ['SIGINT', 'SIGTERM']) {
+    process.on(signal, async () => {
+        await sub.drain();
+        await imgGenRequestWriter.flush();
+        process.exit(0);
+    });
+}
+
 // Make a Hono API for a dashboard
 const app = new Hono();
 
-// Status of client
+// A live page, polling the JSON below
 app.get('/dashboard', async (c) => {
-  // applesauce
-  return c.text("TODO")
+  return c.html(DASHBOARD_HTML);
+});
+
+// Rolling metrics, all held in memory (the database isn't queried)
+app.get('/dashboard.json', async (c) => {
+  return c.json(dashboardAggregator.snapshot());
 });
 
 console.log(`Starting Hono server on port ${env.PORT} (visit http://localhost:${env.PORT}/dashboard)`);
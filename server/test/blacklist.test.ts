@@ -0,0 +1,96 @@
+import { afterEach, beforeEach, expect, mock, setSystemTime, test } from "bun:test";
+
+// Stands in for the BlacklistedWorker table
+let rows : string[] = [];
+let version = "0:0";
+let unreachable = false;
+let loads = 0;
+
+mock.module("../db", () => ({
+    getBlacklistVersion: async () => {
+        if (unreachable) {
+            throw new Error("database unreachable");
+        }
+        return version;
+    },
+    loadBlacklistedWorkerIDs: async () => {
+        if (unreachable) {
+            throw new Error("database unreachable");
+        }
+        loads += 1;
+        return [...rows];
+    }
+}));
+
+// Imported after the database is mocked
+const { WorkerBlacklist } = await import("../blacklist");
+
+const START = new Date("2024-01-01T00:00:00Z").getTime();
+
+function blacklist(workerIds : string[]) {
+    rows = workerIds;
+    // The same row count and highest id as the table would have
+    version = `${workerIds.length}:${workerIds.length}`;
+}
+
+beforeEach(() => {
+    setSystemTime(new Date(START));
+    blacklist([]);
+    unreachable = false;
+    loads = 0;
+});
+
+afterEach(() => {
+    setSystemTime();
+});
+
+test("blacklisted workers are not trustworthy", async () => {
+    blacklist(["bad"]);
+    const workerBlacklist = new WorkerBlacklist();
+    await workerBlacklist.refresh();
+    expect(workerBlacklist.isTrustworthy("bad")).toBe(false);
+    expect(workerBlacklist.isTrustworthy("good")).toBe(true);
+});
+
+test("the blacklist is only reloaded when its version changes", async () => {
+    blacklist(["bad"]);
+    const workerBlacklist = new WorkerBlacklist();
+    await workerBlacklist.refresh();
+    await workerBlacklist.refresh();
+    await workerBlacklist.refresh();
+    expect(loads).toBe(1);
+
+    blacklist(["bad", "worse"]);
+    await workerBlacklist.refresh();
+    expect(loads).toBe(2);
+    expect(workerBlacklist.isTrustworthy("worse")).toBe(false);
+});
+
+test("the blacklist is reloaded every minute even if its version is the same", async () => {
+    blacklist(["bad"]);
+    const workerBlacklist = new WorkerBlacklist();
+    await workerBlacklist.refresh();
+    // A workerID edited in place keeps the row count and highest id
+    rows = ["edited"];
+    setSystemTime(new Date(START + 59_000));
+    await workerBlacklist.refresh();
+    expect(workerBlacklist.isTrustworthy("edited")).toBe(true);
+    setSystemTime(new Date(START + 61_000));
+    await workerBlacklist.refresh();
+    expect(workerBlacklist.isTrustworthy("edited")).toBe(false);
+    expect(workerBlacklist.isTrustworthy("bad")).toBe(true);
+});
+
+test("the last loaded blacklist stays in force while the database is unreachable", async () => {
+    blacklist(["bad"]);
+    const workerBlacklist = new WorkerBlacklist();
+    await workerBlacklist.refresh();
+    unreachable = true;
+    await workerBlacklist.refresh();
+    expect(workerBlacklist.isTrustworthy("bad")).toBe(false);
+    // And it is reloaded once the database is back
+    unreachable = false;
+    blacklist([]);
+    await workerBlacklist.refresh();
+    expect(workerBlacklist.isTrustworthy("bad")).toBe(true);
+});
@@ -0,0 +1,74 @@
+import { afterEach, beforeEach, expect, setSystemTime, test } from "bun:test";
+import { DashboardAggregator } from "../dashboard";
+import { DASHBOARD_HTML } from "../dashboardPage";
+
+const START = new Date("2024-01-01T00:00:00Z").getTime();
+
+beforeEach(() => {
+    setSystemTime(new Date(START));
+});
+
+afterEach(() => {
+    setSystemTime();
+});
+
+// Packed as the worker sends it: step (uint16), total steps (uint16), elapsed milliseconds (uint32), big-endian
+function progress(step : number, total : number, elapsedMs : number) : Uint8Array {
+    const data = new Uint8Array(8);
+    const view = new DataView(data.buffer);
+    view.setUint16(0, step);
+    view.setUint16(2, total);
+    view.setUint32(4, elapsedMs);
+    return data;
+}
+
+function receiveProgress(aggregator : DashboardAggregator, imageInbox : string, data : Uint8Array) {
+    aggregator["recordProgress"](imageInbox, data);
+}
+
+test("step seconds leave out the wait before the first step", () => {
+    const aggregator = new DashboardAggregator();
+    aggregator.recordRequest("_INBOX.a");
+    // 5 seconds in the worker's queue and loading the model, then half a second a step
+    receiveProgress(aggregator, "_INBOX.a", progress(1, 4, 5500));
+    receiveProgress(aggregator, "_INBOX.a", progress(2, 4, 6000));
+    // Coalesced by the worker, so two steps apart
+    receiveProgress(aggregator, "_INBOX.a", progress(4, 4, 7000));
+    const { stepSeconds, timeToFirstProgress } = aggregator.snapshot().latencies;
+    expect(stepSeconds.count).toBe(2);
+    expect([stepSeconds.p50, stepSeconds.p99]).toEqual([0.5, 0.5]);
+    expect(timeToFirstProgress.count).toBe(1);
+});
+
+test("progress of a request that isn't tracked is ignored", () => {
+    const aggregator = new DashboardAggregator();
+    receiveProgress(aggregator, "_INBOX.unknown", progress(1, 4, 500));
+    receiveProgress(aggregator, "_INBOX.unknown", progress(2, 4, 1000));
+    receiveProgress(aggregator, "_INBOX.short", new Uint8Array(4));
+    expect(aggregator.snapshot().latencies.stepSeconds.count).toBe(0);
+});
+
+test("step times are per request", () => {
+    const aggregator = new DashboardAggregator();
+    aggregator.recordRequest("_INBOX.a");
+    aggregator.recordRequest("_INBOX.b");
+    receiveProgress(aggregator, "_INBOX.a", progress(1, 4, 1000));
+    receiveProgress(aggregator, "_INBOX.b", progress(1, 4, 9000));
+    receiveProgress(aggregator, "_INBOX.a", progress(2, 4, 1250));
+    receiveProgress(aggregator, "_INBOX.b", progress(2, 4, 10000));
+    const { stepSeconds } = aggregator.snapshot().latencies;
+    expect(stepSeconds.count).toBe(2);
+    expect([stepSeconds.p50, stepSeconds.p99]).toEqual([1, 1]);
+    expect(stepSeconds.buckets.find(bucket => bucket.le === 0.25)?.count).toBe(1);
+});
+
+test("the page escapes what it shows", () => {
+    // Run the page's own escaping function
+    const source = DASHBOARD_HTML.match(/function escapeHtml[\s\S]*?\n}/)![0];
+    const escapeHtml = new Function(`${source}; return escapeHtml;`)();
+    expect(escapeHtml(`<img src=x onerror="alert('x')">&`)).toBe("&lt;img src=x onerror=&quot;alert(&#39;x&#39;)&quot;&gt;&amp;");
+    expect(escapeHtml(0.5)).toBe("0.5");
+    // Every value inserted into the page goes through it
+    expect(DASHBOARD_HTML).toContain("escapeHtml(value)");
+    expect(DASHBOARD_HTML).toContain("escapeHtml(c ?? '-')");
+});
@@ -0,0 +1,23 @@
+import { expect, test } from "bun:test";
+import { headers, type Msg } from "nats";
+import { wasImageGenerationSuccessful } from "../imgGenRequest";
+
+function reply(success? : string) : Msg {
+    const h = headers();
+    if (success != null) {
+        h.set('success', success);
+    }
+    return { headers: h } as unknown as Msg;
+}
+
+test("a success='true' reply is a success", () => {
+    expect(wasImageGenerationSuccessful(null, reply('true'))).toBe(true);
+});
+
+test("a success='false' reply is a failure", () => {
+    expect(wasImageGenerationSuccessful(null, reply('false'))).toBe(false);
+});
+
+test("a reply without a success header is a failure", () => {
+    expect(wasImageGenerationSuccessful(null, reply())).toBe(false);
+});
@@ -0,0 +1,103 @@
+import { beforeEach, expect, mock, test } from "bun:test";
+import type { ImgGenRequestRow, ImgGenRequestUpdate } from "../db";
+
+// Stands in for the database: records every statement, and fails them while `failing` is set
+let inserts : ImgGenRequestRow[][] = [];
+let updates : [string, ImgGenRequestUpdate][][] = [];
+let failing = false;
+
+mock.module("../db", () => ({
+    insertImgGenRequests: async (rows : ImgGenRequestRow[]) => {
+        if (failing) {
+            throw new Error("database unreachable");
+        }
+        inserts.push(rows);
+    },
+    updateImgGenRequests: async (rows : [string, ImgGenRequestUpdate][]) => {
+        if (failing) {
+            throw new Error("database unreachable");
+        }
+        updates.push(rows);
+    }
+}));
+
+// Imported after the database is mocked
+const { ImgGenRequestWriter } = await import("../imgGenRequestWriter");
+
+const REQUEST = { prompt: "a lighthouse", seed: 1, numSteps: 4, height: 128, width: 128 };
+
+beforeEach(() => {
+    inserts = [];
+    updates = [];
+    failing = false;
+});
+
+test("updates to a request that isn't written yet are folded into its insert", async () => {
+    const writer = new ImgGenRequestWriter();
+    await writer.record("inbox-1", REQUEST);
+    writer.update("inbox-1", { workerId: "worker-1" });
+    writer.update("inbox-1", { successful: true });
+    await writer.flush();
+    expect(inserts).toHaveLength(1);
+    expect(inserts[0]).toHaveLength(1);
+    expect(inserts[0][0]).toEqual({ imageInbox: "inbox-1", created: inserts[0][0].created, ...REQUEST, workerId: "worker-1", successful: true });
+    expect(updates).toEqual([]);
+});
+
+test("updates to a written request are merged into one row of one update", async () => {
+    const writer = new ImgGenRequestWriter();
+    await writer.record("inbox-1", REQUEST);
+    await writer.record("inbox-2", REQUEST);
+    await writer.flush();
+    writer.update("inbox-1", { workerId: "worker-1" });
+    writer.update("inbox-1", { successful: true });
+    writer.update("inbox-2", { successful: false });
+    await writer.flush();
+    expect(inserts).toHaveLength(1);
+    expect(inserts[0].map(row => row.imageInbox)).toEqual(["inbox-1", "inbox-2"]);
+    expect(updates).toEqual([[["inbox-1", { workerId: "worker-1", successful: true }], ["inbox-2", { successful: false }]]]);
+    expect(writer.buffered).toBe(0);
+});
+
+test("a failed write is retried, and later updates are still folded into it", async () => {
+    const writer = new ImgGenRequestWriter();
+    await writer.record("inbox-1", REQUEST);
+    failing = true;
+    await writer.flush();
+    expect(writer.buffered).toBe(1);
+    writer.update("inbox-1", { successful: true });
+    failing = false;
+    await writer.flush();
+    expect(inserts.map(rows => rows.map(row => [row.imageInbox, row.successful]))).toEqual([[["inbox-1", true]]]);
+    expect(updates).toEqual([]);
+    expect(writer.buffered).toBe(0);
+});
+
+test("updates whose insert failed are applied after it is retried", async () => {
+    const writer = new ImgGenRequestWriter();
+    await writer.record("inbox-1", REQUEST);
+    writer.update("inbox-2", { successful: true });
+    failing = true;
+    await writer.flush();
+    expect(writer.buffered).toBe(2);
+    failing = false;
+    await writer.flush();
+    expect(inserts.map(rows => rows.map(row => row.imageInbox))).toEqual([["inbox-1"]]);
+    expect(updates).toEqual([[["inbox-2", { successful: true }]]]);
+});
+
+test("the buffer stays bounded while the database is unreachable", async () => {
+    const writer = new ImgGenRequestWriter();
+    failing = true;
+    let mostBuffered = 0;
+    for (let i = 0; i < 25000; i++) {
+        await writer.record(`inbox-${i}`, REQUEST);
+        mostBuffered = Math.max(mostBuffered, writer.buffered);
+    }
+    expect(mostBuffered).toBe(20000);
+    // What was kept is written once the database is back
+    failing = false;
+    await writer.flush();
+    expect(inserts.flat()).toHaveLength(20000);
+    expect(writer.buffered).toBe(0);
+});
@@ -0,0 +1,24 @@
+import { expect, test } from "bun:test";
+import { resultCacheKey } from "../resultCacheKey";
+
+// The same keys are pinned in worker/test_result_cache.py, so the server's cache lookups and the workers' cache writes agree
+test("keys match the workers' for a request with the defaults", () => {
+    expect(resultCacheKey({ prompt: "a lighthouse at dusk", seed: 42, numSteps: 4, height: 512, width: 768 }))
+        .toBe("f68416c89c7c7fece3e3b1d5c69261d69f8b022d2cff64aed2621b553355b19f");
+});
+
+test("keys match the workers' for a request with a model, LoRAs and encoding options", () => {
+    expect(resultCacheKey({
+        prompt: "café ☕ über alles", seed: 7, numSteps: 20, height: 1024, width: 1024,
+        model: "dev", quantize: 4, loraPaths: ["b.safetensors", "a.safetensors"], loraScales: [0.5, 1.25],
+        guidance: 3.5, format: "webp", quality: 80
+    })).toBe("878fad5c5a7ef541037bfea96c0471a2a18ee29331b424b99efc6d631efbf3cd");
+});
+
+// Exactly half a thousandth, where Python's round() and Math.round would disagree
+test("keys match the workers' when a float is half a thousandth", () => {
+    expect(resultCacheKey({
+        prompt: "halves", seed: 3, numSteps: 4, height: 256, width: 256,
+        loraPaths: ["tie.safetensors"], loraScales: [2.0625], guidance: 0.0625
+    })).toBe("8d67e2c282da85a57f03b2d1a95a59470d5dbe6bedf172ae42e2e9b7e027e081");
+});
@@ -0,0 +1,133 @@
+import { afterEach, expect, test } from "bun:test";
+import { headers, type Msg, type NatsConnection } from "nats";
+import { WorkerAcquisition } from "../workerAcquisition";
+import { WorkerRegistry, type WorkerHeartbeat } from "../workerRegistry";
+
+const realRandom = Math.random;
+
+afterEach(() => {
+    Math.random = realRandom;
+});
+
+// Math.random returns these, in turn
+function randomSequence(values : number[]) {
+    let i = 0;
+    Math.random = () => values[i++ % values.length];
+}
+
+function heartbeat(workerId : string, freeSlots : number, totalSlots = 2, queueDepth = 0) : WorkerHeartbeat {
+    return { workerId, timestamp: 0, intervalSeconds: 2, freeSlots, totalSlots, running: totalSlots - freeSlots, loadedModels: [], queueDepth, recentStepSeconds: null };
+}
+
+function reply(workerId : string, willing : boolean, leaseId? : string) : Msg {
+    const h = headers();
+    h.set('workerId', workerId);
+    h.set('willing', willing ? 'true' : 'false');
+    if (leaseId != null) {
+        h.set('leaseId', leaseId);
+    }
+    return { headers: h } as unknown as Msg;
+}
+
+// Answers `request-worker.{workerId}` probes as scripted (after `delayMs`), and `request-worker` probes from a queue
+class FakeNats {
+    published : [string, string][] = [];
+    probed : string[] = [];
+
+    constructor(private workers : Record<string, { willing : boolean, delayMs? : number }>, private queueGroup : string[] = []) {}
+
+    async request(subject : string) : Promise<Msg> {
+        this.probed.push(subject);
+        const workerId = subject === 'request-worker' ? this.queueGroup.shift() : subject.slice('request-worker.'.length);
+        if (workerId == null) {
+            throw new Error("no workers");
+        }
+        const { willing, delayMs } = this.workers[workerId];
+        await new Promise(resolve => setTimeout(resolve, delayMs ?? 0));
+        return reply(workerId, willing, willing ? `lease-${workerId}` : undefined);
+    }
+
+    publish(subject : string, data : string) {
+        this.published.push([subject, data]);
+    }
+}
+
+function acquisition(nc : FakeNats, registry : WorkerRegistry, untrusted : string[] = [], mode : 'sequential'|'scatter' = 'scatter') {
+    return new WorkerAcquisition(nc as unknown as NatsConnection, registry, workerId => !untrusted.includes(workerId),
+                                 { mode, maxAttempts: 6, fanout: 3, probeTimeoutMs: 1000 });
+}
+
+const settle = () => new Promise(resolve => setTimeout(resolve, 50));
+
+test("two choices keep the less loaded of the pair", () => {
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("busy", 0, 2, 4));
+    registry.record(heartbeat("idle", 2));
+    // Samples "busy" then "idle" - and the other way around
+    randomSequence([0.1, 0.9]);
+    expect(registry.pickByTwoChoices(1)).toEqual(["idle"]);
+    randomSequence([0.9, 0.1]);
+    expect(registry.pickByTwoChoices(1)).toEqual(["idle"]);
+});
+
+test("two choices pick distinct workers and assume each probe takes a slot", () => {
+    const registry = new WorkerRegistry();
+    for (const workerId of ["a", "b", "c"]) {
+        registry.record(heartbeat(workerId, 1));
+    }
+    const picked = registry.pickByTwoChoices(3);
+    expect([...picked].sort()).toEqual(["a", "b", "c"]);
+    expect(registry.snapshot().map(h => h.freeSlots)).toEqual([0, 0, 0]);
+    // None of them is known to be free any more
+    expect(registry.pickFreeWorker()).toBeNull();
+});
+
+test("two choices never pick more workers than are known", () => {
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("only", 2));
+    expect(registry.pickByTwoChoices(4)).toEqual(["only"]);
+    expect(new WorkerRegistry().pickByTwoChoices(4)).toEqual([]);
+});
+
+test("scatter takes the first willing worker and releases the leases of the others", async () => {
+    const registry = new WorkerRegistry();
+    for (const workerId of ["fast", "slow", "slower"]) {
+        registry.record(heartbeat(workerId, 1));
+    }
+    const nc = new FakeNats({ fast: { willing: true }, slow: { willing: true, delayMs: 10 }, slower: { willing: true, delayMs: 20 } });
+    const worker = await acquisition(nc, registry).acquire();
+    expect(worker?.headers?.get('workerId')).toBe("fast");
+    await settle();
+    expect(nc.published.sort()).toEqual([["release-worker.slow", "lease-slow"], ["release-worker.slower", "lease-slower"]]);
+});
+
+test("scatter releases willing but untrusted workers and tops up with queue group probes", async () => {
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("blacklisted", 1));
+    registry.record(heartbeat("trusted", 1));
+    const nc = new FakeNats({ blacklisted: { willing: true }, trusted: { willing: true, delayMs: 10 }, queued: { willing: false } },
+                            ["blacklisted", "queued"]);
+    const worker = await acquisition(nc, registry, ["blacklisted"]).acquire();
+    expect(worker?.headers?.get('workerId')).toBe("trusted");
+    await settle();
+    // The blacklisted worker is never probed directly, but can still answer a queue group probe
+    expect(nc.probed.filter(subject => subject === 'request-worker.blacklisted')).toEqual([]);
+    expect(nc.probed.filter(subject => subject === 'request-worker')).toHaveLength(2);
+    expect(nc.published).toEqual([["release-worker.blacklisted", "lease-blacklisted"]]);
+});
+
+test("scatter gives up after its attempts when nobody is willing", async () => {
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("busy", 1));
+    const nc = new FakeNats({ busy: { willing: false } }, ["busy", "busy", "busy", "busy", "busy"]);
+    expect(await acquisition(nc, registry).acquire()).toBeNull();
+    expect(nc.probed).toHaveLength(6);
+    expect(nc.published).toEqual([]);
+});
+
+test("sequential acquisition releases a willing worker that isn't trusted", async () => {
+    const nc = new FakeNats({ blacklisted: { willing: true }, trusted: { willing: true } }, ["blacklisted", "trusted"]);
+    const worker = await acquisition(nc, new WorkerRegistry(), ["blacklisted"], 'sequential').acquire();
+    expect(worker?.headers?.get('workerId')).toBe("trusted");
+    expect(nc.published).toEqual([["release-worker.blacklisted", "lease-blacklisted"]]);
+});
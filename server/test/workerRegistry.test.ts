@@ -0,0 +1,72 @@
+import { afterEach, expect, setSystemTime, test } from "bun:test";
+import { WorkerRegistry, type WorkerHeartbeat } from "../workerRegistry";
+
+const START = new Date("2024-01-01T00:00:00Z").getTime();
+
+function heartbeat(workerId : string, freeSlots = 1, intervalSeconds = 2) : WorkerHeartbeat {
+    return { workerId, timestamp: 0, intervalSeconds, freeSlots, totalSlots: 2, running: 0, loadedModels: [], queueDepth: 0, recentStepSeconds: null };
+}
+
+function at(msAfterStart : number) {
+    setSystemTime(new Date(START + msAfterStart));
+}
+
+afterEach(() => {
+    setSystemTime();
+});
+
+test("only workers with a free slot are picked", () => {
+    at(0);
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("busy", 0));
+    registry.record(heartbeat("free", 1));
+    expect(registry.pickFreeWorker()).toBe("free");
+    // The pick is assumed to take its only free slot
+    expect(registry.pickFreeWorker()).toBeNull();
+});
+
+test("picks rotate between free workers", () => {
+    at(0);
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("a", 2));
+    registry.record(heartbeat("b", 2));
+    expect([1, 2, 3, 4, 5].map(() => registry.pickFreeWorker())).toEqual(["a", "b", "a", "b", null]);
+});
+
+test("a worker marked unavailable is not picked until its next heartbeat", () => {
+    at(0);
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("a", 2));
+    registry.markUnavailable("a");
+    expect(registry.pickFreeWorker()).toBeNull();
+    registry.record(heartbeat("a", 2));
+    expect(registry.pickFreeWorker()).toBe("a");
+});
+
+test("workers are forgotten after three missed heartbeats", () => {
+    at(0);
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("fast", 1, 1));
+    registry.record(heartbeat("slow", 1, 5));
+    at(3000);
+    registry.evictStale();
+    expect(registry.snapshot().map(h => h.workerId).sort()).toEqual(["fast", "slow"]);
+    at(3500);
+    registry.evictStale();
+    expect(registry.snapshot().map(h => h.workerId)).toEqual(["slow"]);
+    at(15500);
+    registry.evictStale();
+    expect(registry.snapshot()).toEqual([]);
+});
+
+test("stale free workers are never picked", () => {
+    at(0);
+    const registry = new WorkerRegistry();
+    registry.record(heartbeat("gone", 1, 1));
+    at(1000);
+    registry.record(heartbeat("alive", 1, 1));
+    at(3500);
+    expect(registry.pickFreeWorker()).toBe("alive");
+    expect(registry.pickFreeWorker()).toBeNull();
+    expect(registry.snapshot().map(h => h.workerId)).toEqual(["alive"]);
+});
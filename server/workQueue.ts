@@ -0,0 +1,36 @@
+import { nanos, RetentionPolicy, StorageType, type MsgHdrs } from "nats";
+import { nc } from "./nats";
+import { serializeImageGenRequest } from "./imgGenRequest";
+import type { GenImgRequest } from "./coms";
+
+// The JetStream work queue that workers started with --work_queue pull requests from (see worker/work_queue.py)
+export const WORK_QUEUE_STREAM = "IMG_GEN_WORK";
+export const WORK_QUEUE_SUBJECT = "img-gen-work";
+const WORK_QUEUE_MAX_AGE_MS = 60 * 60 * 1000;
+const WORK_QUEUE_DUPLICATE_WINDOW_MS = 2 * 60 * 1000;
+
+export async function ensureWorkQueue() {
+    const jsm = await nc.jetstreamManager();
+    try {
+        await jsm.streams.info(WORK_QUEUE_STREAM);
+    }
+    catch (e) {
+        await jsm.streams.add({
+            name: WORK_QUEUE_STREAM,
+            subjects: [WORK_QUEUE_SUBJECT],
+            retention: RetentionPolicy.Workqueue,
+            storage: StorageType.File,
+            max_age: nanos(WORK_QUEUE_MAX_AGE_MS),
+            duplicate_window: nanos(WORK_QUEUE_DUPLICATE_WINDOW_MS)
+        });
+    }
+}
+
+// Resolves once JetStream has stored the request. The imageInbox is the message ID, so publishing it twice queues it once.
+export async function enqueueImgGenRequest(imageInbox : string, imgGenRequest : GenImgRequest, h : MsgHdrs) {
+    h.set('imageInbox', imageInbox);
+    await nc.jetstream().publish(WORK_QUEUE_SUBJECT, serializeImageGenRequest(imgGenRequest), {
+        msgID: imageInbox,
+        headers: h
+    });
+}
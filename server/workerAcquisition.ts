@@ -0,0 +1,180 @@
+import { NatsError, type Msg, type NatsConnection } from "nats";
+import type { WorkerRegistry } from "./workerRegistry";
+
+export const ACQUISITION_MODES = ['sequential', 'scatter'] as const;
+export type AcquisitionMode = typeof ACQUISITION_MODES[number];
+
+// Decides whether a worker may be given work (i.e. it isn't blacklisted)
+export type TrustPredicate = (workerId : string) => boolean;
+
+export type AcquisitionOptions = {
+    mode : AcquisitionMode
+    // Probes (in total) before giving up
+    maxAttempts : number
+    // Scatter mode: how many workers are probed at once
+    fanout : number
+    probeTimeoutMs : number
+};
+
+export const DEFAULT_ACQUISITION_OPTIONS : AcquisitionOptions = {
+    mode: 'sequential',
+    maxAttempts: 10,
+    fanout: 4,
+    probeTimeoutMs: 1000
+};
+
+// Finds a willing (it reserved a slot for us) and trusted worker.
+//
+//   sequential: ask a worker the registry knows to be free, then probe the `request-worker` queue group, one probe at a time
+//   scatter:    probe `fanout` workers at once - picked from the registry by power-of-two-choices on their advertised load,
+//               topped up with queue group probes - and take the first willing, trusted reply.
+//               The slots the other willing workers reserved are handed back on `release-worker.{workerId}`.
+//
+// Sequential acquisition takes a round-trip per busy worker it runs into; scatter takes about one round-trip per `fanout` of them.
+export class WorkerAcquisition {
+    constructor(private nc : NatsConnection,
+                private registry : WorkerRegistry,
+                private isTrustworthy : TrustPredicate,
+                private options : AcquisitionOptions = DEFAULT_ACQUISITION_OPTIONS) {}
+
+    async acquire() : Promise<Msg|null> {
+        if (this.options.mode === 'scatter') {
+            return await this.scatter();
+        }
+        return await this.sequential();
+    }
+
+    // The worker won't be sent the job it reserved a slot for
+    release(worker : Msg) {
+        const leaseId = getLeaseId(worker);
+        if (leaseId != null) {
+            this.nc.publish(`release-worker.${getWorkerId(worker)}`, leaseId);
+        }
+    }
+
+    private async sequential() : Promise<Msg|null> {
+        // First try the workers whose heartbeats say they have a free slot - ask one directly to reserve it.
+        // That is a single round-trip, and unlike a probe of the queue group it can't land on a busy worker while an idle one waits.
+        const knownFreeWorker = await this.getAKnownFreeWorker();
+        if (knownFreeWorker != null) {
+            return knownFreeWorker;
+        }
+
+        // Otherwise (no heartbeats yet, or they were all wrong) fall back to probing the pool.
+        // Keep asking for a worker until you get one that is willing to accept the work and one that's not blacklisted
+        let attempts = 0;
+        while (attempts < this.options.maxAttempts) {
+            attempts += 1;
+            const worker = await this.probe('request-worker');
+            if (isWorker(worker) && isWilling(worker)) {
+                if (this.isTrustworthy(getWorkerId(worker))) {
+                    return worker;
+                }
+                this.release(worker);
+            }
+        }
+        return null;
+    }
+
+    private async getAKnownFreeWorker() : Promise<Msg|null> {
+        let attempts = 0;
+        while (attempts < this.options.maxAttempts) {
+            attempts += 1;
+            const workerId = this.registry.pickFreeWorker();
+            if (workerId == null) {
+                return null;
+            }
+            if (!this.isTrustworthy(workerId)) {
+                this.registry.markUnavailable(workerId);
+                continue;
+            }
+            const worker = await this.probe(`request-worker.${workerId}`);
+            if (isWorker(worker) && isWilling(worker)) {
+                return worker;
+            }
+            this.registry.markUnavailable(workerId);
+        }
+        return null;
+    }
+
+    private async scatter() : Promise<Msg|null> {
+        let attempts = 0;
+        while (attempts < this.options.maxAttempts) {
+            const fanout = Math.min(this.options.fanout, this.options.maxAttempts - attempts);
+            const subjects = this.registry.pickByTwoChoices(fanout)
+                .filter(workerId => this.isTrustworthy(workerId))
+                .map(workerId => `request-worker.${workerId}`);
+            while (subjects.length < fanout) {
+                subjects.push('request-worker');
+            }
+            attempts += fanout;
+            const worker = await this.firstWilling(subjects);
+            if (worker != null) {
+                return worker;
+            }
+        }
+        return null;
+    }
+
+    // Probes every subject at once. Resolves with the first willing, trusted reply (releasing any that are willing but lost),
+    // or with null once every probe has been answered without one.
+    private firstWilling(subjects : string[]) : Promise<Msg|null> {
+        return new Promise(resolve => {
+            let winner : Msg|null = null;
+            let outstanding = subjects.length;
+            for (const subject of subjects) {
+                this.probe(subject).then(worker => {
+                    if (isWorker(worker) && isWilling(worker)) {
+                        if (winner == null && this.isTrustworthy(getWorkerId(worker))) {
+                            winner = worker;
+                            resolve(worker);
+                        }
+                        else {
+                            this.release(worker);
+                        }
+                    }
+                    else if (isWorker(worker)) {
+                        this.registry.markUnavailable(getWorkerId(worker));
+                    }
+                    outstanding -= 1;
+                    if (outstanding === 0 && winner == null) {
+                        resolve(null);
+                    }
+                });
+            }
+        });
+    }
+
+    private async probe(subject : string) : Promise<Msg|string> {
+        return await this.nc.request(subject, "", { timeout: this.options.probeTimeoutMs }).catch(r => transformWorkerError(r));
+    }
+}
+
+function transformWorkerError(r : any) {
+    if (r instanceof NatsError) {
+        if (r.code === '503') {
+            return 'no-workers-available';
+        }
+        else if (r.name === 'TIMEOUT') {
+            return 'timeout';
+        }
+    }
+    console.log(r);
+    return 'other-error';
+}
+
+function isWorker(x : Msg|string) : x is Msg {
+    return typeof x !== 'string';
+}
+
+function isWilling(x : Msg) : boolean {
+    return x.headers?.get('willing') === 'true';
+}
+
+function getWorkerId(x : Msg) : string {
+    return x.headers?.get("workerId")!!;
+}
+
+export function getLeaseId(x : Msg) : string|null {
+    return x.headers?.get('leaseId') || null;
+}
@@ -0,0 +1,162 @@
+import { JSONCodec, type NatsConnection } from "nats";
+
+// What a worker publishes to worker-heartbeat.{workerId}
+export type WorkerHeartbeat = {
+    workerId : string
+    timestamp : number
+    intervalSeconds : number
+    freeSlots : number
+    totalSlots : number
+    running : number
+    loadedModels : string[]
+    queueDepth : number
+    recentStepSeconds : number|null
+};
+
+// A worker that misses this many heartbeats in a row is forgotten
+const MISSED_HEARTBEATS_BEFORE_STALE = 3;
+const EVICTION_INTERVAL_MS = 1000;
+
+type Entry = { heartbeat : WorkerHeartbeat, receivedAt : number };
+
+// Tracks the latest heartbeat of every worker so that a known-free worker can be picked without probing the pool.
+// Free workers are kept in a Set (which iterates in insertion order): a pick takes the first one and re-adds it at the back,
+// so picks are O(1) and rotate between free workers.
+// All known workers are also kept in an array (with their positions) so that random samples for power-of-two-choices are O(1).
+export class WorkerRegistry {
+    private workers = new Map<string, Entry>();
+    private freeWorkers = new Set<string>();
+    private workerIds : string[] = [];
+    private positions = new Map<string, number>();
+
+    start(nc : NatsConnection) {
+        const jc = JSONCodec<WorkerHeartbeat>();
+        const sub = nc.subscribe('worker-heartbeat.*');
+        (async () => {
+            for await (const m of sub) {
+                try {
+                    this.record(jc.decode(m.data));
+                }
+                catch (e) {
+                    console.log(`Ignoring malformed heartbeat on ${m.subject}`);
+                }
+            }
+        })();
+        setInterval(() => this.evictStale(), EVICTION_INTERVAL_MS);
+    }
+
+    record(heartbeat : WorkerHeartbeat) {
+        if (!this.positions.has(heartbeat.workerId)) {
+            this.positions.set(heartbeat.workerId, this.workerIds.length);
+            this.workerIds.push(heartbeat.workerId);
+        }
+        this.workers.set(heartbeat.workerId, { heartbeat, receivedAt: Date.now() });
+        if (heartbeat.freeSlots > 0) {
+            this.freeWorkers.add(heartbeat.workerId);
+        }
+        else {
+            this.freeWorkers.delete(heartbeat.workerId);
+        }
+    }
+
+    // Returns a worker whose last heartbeat said it had a free slot (or null if there are none)
+    pickFreeWorker() : string|null {
+        for (const workerId of this.freeWorkers) {
+            this.freeWorkers.delete(workerId);
+            const entry = this.workers.get(workerId);
+            if (entry == null || this.isStale(entry)) {
+                this.forget(workerId);
+                continue;
+            }
+            // Assume the pick takes a slot until the worker's next heartbeat says otherwise
+            entry.heartbeat = { ...entry.heartbeat, freeSlots: entry.heartbeat.freeSlots - 1 };
+            if (entry.heartbeat.freeSlots > 0) {
+                this.freeWorkers.add(workerId);
+            }
+            return workerId;
+        }
+        return null;
+    }
+
+    // Power of two choices: for each of (up to) `count` distinct workers, sample two known workers at random and keep the less loaded.
+    // That spreads probes over the pool while still steering them away from the busiest workers, without having to rank them all.
+    pickByTwoChoices(count : number) : string[] {
+        const picked = new Set<string>();
+        let samples = 0;
+        while (picked.size < count && picked.size < this.workerIds.length && samples < 4 * count) {
+            samples += 1;
+            const a = this.sample(picked);
+            const b = this.sample(picked);
+            const choice = (a == null || (b != null && this.load(b) < this.load(a))) ? b : a;
+            if (choice == null) {
+                continue;
+            }
+            picked.add(choice);
+            // Assume the probe takes a slot until the worker's next heartbeat says otherwise
+            const entry = this.workers.get(choice)!!;
+            if (entry.heartbeat.freeSlots > 0) {
+                entry.heartbeat = { ...entry.heartbeat, freeSlots: entry.heartbeat.freeSlots - 1 };
+                if (entry.heartbeat.freeSlots === 0) {
+                    this.freeWorkers.delete(choice);
+                }
+            }
+        }
+        return [...picked];
+    }
+
+    // The worker turned out to be busy (or untrustworthy) - don't pick it again until it sends another heartbeat
+    markUnavailable(workerId : string) {
+        this.freeWorkers.delete(workerId);
+    }
+
+    snapshot() : WorkerHeartbeat[] {
+        return [...this.workers.values()].map(entry => entry.heartbeat);
+    }
+
+    evictStale() {
+        for (const [workerId, entry] of this.workers) {
+            if (this.isStale(entry)) {
+                this.forget(workerId);
+            }
+        }
+    }
+
+    // A random live worker that hasn't been picked already (or null if the sample missed)
+    private sample(exclude : Set<string>) : string|null {
+        const workerId = this.workerIds[Math.floor(Math.random() * this.workerIds.length)];
+        const entry = this.workers.get(workerId);
+        if (entry == null || this.isStale(entry)) {
+            this.forget(workerId);
+            return null;
+        }
+        return exclude.has(workerId) ? null : workerId;
+    }
+
+    // Busy and queued work per slot, as of the last heartbeat
+    private load(workerId : string) : number {
+        const { totalSlots, freeSlots, queueDepth } = this.workers.get(workerId)!!.heartbeat;
+        return (totalSlots - freeSlots + queueDepth) / Math.max(1, totalSlots);
+    }
+
+    private forget(workerId : string) {
+        this.workers.delete(workerId);
+        this.freeWorkers.delete(workerId);
+        // Swap the last worker into its place in the array
+        const position = this.positions.get(workerId);
+        if (position != null) {
+            const last = this.workerIds.pop()!!;
+            if (last !== workerId) {
+                this.workerIds[position] = last;
+                this.positions.set(last, position);
+            }
+            this.positions.delete(workerId);
+        }
+    }
+
+    private isStale(entry : Entry) : boolean {
+        const intervalMs = (entry.heartbeat.intervalSeconds || 2) * 1000;
+        return Date.now() - entry.receivedAt > MISSED_HEARTBEATS_BEFORE_STALE * intervalMs;
+    }
+}
+
+export const workerRegistry = new WorkerRegistry();
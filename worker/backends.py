@@ -0,0 +1,179 @@
+import io, random, threading, time, zlib
+from typing import Callable, Dict, NamedTuple, Optional
+import numpy as np
+from PIL import Image
+from mflux.error.exceptions import StopImageGenerationException
+from model_pool import ModelKey
+
+BACKENDS = ["mflux", "simulated"]
+
+
+class MfluxBackend:
+    """
+    Generates images with mflux (MLX).
+    mflux - and with it MLX, torch and transformers - is only imported once this backend is created.
+    """
+
+    name = "mflux"
+
+    def __init__(self):
+        # Imported here rather than at the top of the module so that the simulated backend never pays for it
+        import mflux.flux.flux  # noqa: F401
+
+    def load(self, key : ModelKey):
+        from mflux import Flux1, ModelConfig
+        return Flux1(
+            model_config = ModelConfig.from_alias(key.alias),
+            quantize = key.quantize,
+            local_path = key.local_path,
+            lora_paths = [path for path, _ in key.loras] or None,
+            lora_scales = [scale for _, scale in key.loras] or None
+        )
+
+    def config_for_request(self, request : Dict[str,any]):
+        from mflux import Config
+        return Config(
+            num_inference_steps=request["numSteps"],
+            height=request["height"],
+            width=request["width"],
+            guidance=request.get("guidance", 4.0)
+        )
+
+    def runtime_config(self, config, model):
+        from mflux.config.runtime_config import RuntimeConfig
+        return RuntimeConfig(config, model.model_config)
+
+    def preview_jpeg(self, latents, height : int, width : int) -> bytes:
+        from mflux.post_processing.latent_preview import LatentPreview
+        return LatentPreview.to_jpeg(latents, height, width)
+
+
+class LatencyModel(NamedTuple):
+    """How long the simulated model takes. Each denoise step takes step_overhead + seconds_per_megapixel_step * megapixels."""
+    seconds_per_megapixel_step : float = 0.5
+    step_overhead : float = 0.02
+    encode_seconds : float = 0.05
+    seconds_per_megapixel_decode : float = 0.3
+    load_seconds : float = 0.0
+    # Standard deviation of the multiplicative noise on every duration, as a fraction of it
+    jitter : float = 0.1
+
+    def step_seconds(self, height : int, width : int) -> float:
+        return self.step_overhead + self.seconds_per_megapixel_step * height * width / 1e6
+
+    def decode_seconds(self, height : int, width : int) -> float:
+        return self.seconds_per_megapixel_decode * height * width / 1e6
+
+
+class SimulatedConfig(NamedTuple):
+    num_inference_steps : int
+    height : int
+    width : int
+    guidance : float
+
+
+class SimulatedImage(NamedTuple):
+    image : Image.Image
+
+
+class SimulatedFlux:
+    """
+    Stands in for Flux1 without any weights: every phase sleeps for as long as the latency model says
+    (on the compute thread, which it keeps busy just like the real thing), and the "image" is a synthetic gradient
+    determined by the seed and prompt. Progress, previews, cancellation and phase timings behave as they do with Flux1.
+    """
+
+    def __init__(self, key : ModelKey, latency : LatencyModel):
+        self.key = key
+        self.latency = latency
+        self._random = random.Random()
+        self._random_lock = threading.Lock()
+        start = time.perf_counter()
+        time.sleep(latency.load_seconds)
+        self.load_timings = { "tokenizers": 0.0, "weights": time.perf_counter() - start, "quantize": 0.0 }
+
+    async def generate_image(self, seed, prompt, config, stepwise_output_dir = None, progress_cb = None, cancel_event = None, phase_cb = None, preview_cb = None) -> SimulatedImage:
+        prompt_embeds, pooled_prompt_embeds = self.encode_prompt(prompt, phase_cb = phase_cb)
+        latents, generation_time = await self.denoise(seed, prompt, config, prompt_embeds, pooled_prompt_embeds,
+                                                      progress_cb = progress_cb, cancel_event = cancel_event, phase_cb = phase_cb, preview_cb = preview_cb)
+        return self.decode(latents, seed, prompt, config, generation_time, phase_cb = phase_cb)
+
+    def encode_prompt(self, prompt, phase_cb = None):
+        self._spend("t5_encode", self.latency.encode_seconds, phase_cb)
+        return prompt, None
+
+    async def denoise(self, seed, prompt, config, prompt_embeds, pooled_prompt_embeds, stepwise_output_dir = None,
+                      progress_cb = None, cancel_event = None, phase_cb = None, preview_cb = None):
+        start = time.perf_counter()
+        total = config.num_inference_steps
+        for step in range(1, total + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise StopImageGenerationException(f"Image generation cancelled at step {step}/{total}")
+            self._spend("denoise_step", self.latency.step_seconds(config.height, config.width), phase_cb)
+            # The "latents" are just how far along the image is
+            if preview_cb is not None:
+                preview_cb(step, total, step / total)
+            if progress_cb is not None:
+                await progress_cb(step, total)
+        if cancel_event is not None and cancel_event.is_set():
+            raise StopImageGenerationException("Image generation cancelled before decoding")
+        return 1.0, time.perf_counter() - start
+
+    def decode(self, latents, seed, prompt, config, generation_time, phase_cb = None) -> SimulatedImage:
+        self._spend("vae_decode", self.latency.decode_seconds(config.height, config.width), phase_cb)
+        return SimulatedImage(synthetic_image(seed, prompt, config.height, config.width))
+
+    def _spend(self, phase : str, seconds : float, phase_cb : Optional[Callable[[str, float], None]]):
+        with self._random_lock:
+            factor = max(0.0, self._random.gauss(1.0, self.latency.jitter))
+        start = time.perf_counter()
+        time.sleep(seconds * factor)
+        if phase_cb is not None:
+            phase_cb(phase, time.perf_counter() - start)
+
+
+class SimulatedBackend:
+    """For load testing the scheduling and messaging without weights (or MLX) - see SimulatedFlux."""
+
+    name = "simulated"
+
+    def __init__(self, latency : LatencyModel = LatencyModel()):
+        self.latency = latency
+
+    def load(self, key : ModelKey) -> SimulatedFlux:
+        return SimulatedFlux(key, self.latency)
+
+    def config_for_request(self, request : Dict[str,any]) -> SimulatedConfig:
+        return SimulatedConfig(num_inference_steps = request["numSteps"],
+                               height = 16 * (request["height"] // 16),
+                               width = 16 * (request["width"] // 16),
+                               guidance = request.get("guidance", 4.0))
+
+    def runtime_config(self, config : SimulatedConfig, model : SimulatedFlux) -> SimulatedConfig:
+        return config
+
+    def preview_jpeg(self, latents : float, height : int, width : int) -> bytes:
+        # Fades from grey to a gradient as the "latents" (the fraction of steps done) approach 1
+        image = np.full((height // 8, width // 8, 3), 128, dtype = np.float32)
+        image[..., 0] += 127 * latents * np.linspace(-1, 1, width // 8)[None, :]
+        image[..., 2] += 127 * latents * np.linspace(-1, 1, height // 8)[:, None]
+        buffer = io.BytesIO()
+        Image.fromarray(image.astype(np.uint8), mode = "RGB").save(buffer, format = "JPEG", quality = 70)
+        return buffer.getvalue()
+
+
+def synthetic_image(seed : int, prompt : str, height : int, width : int) -> Image.Image:
+    # The same seed and prompt always give the same image, so the result cache and checksums behave as with a real model
+    rng = np.random.default_rng([seed, zlib.crc32(prompt.encode())])
+    start, end = rng.integers(0, 256, size = (2, 3))
+    t = (np.linspace(0, 1, width)[None, :, None] + np.linspace(0, 1, height)[:, None, None]) / 2
+    pixels = start * (1 - t) + end * t
+    return Image.fromarray(pixels.astype(np.uint8), mode = "RGB")
+
+
+def create_backend(name : str, latency : LatencyModel = LatencyModel()):
+    if name == "mflux":
+        return MfluxBackend()
+    elif name == "simulated":
+        return SimulatedBackend(latency)
+    raise ValueError(f"Unknown backend '{name}' (expected one of {BACKENDS})")
@@ -0,0 +1,65 @@
+import time, uuid
+from typing import Dict, Optional
+
+
+class CapacityManager:
+    """
+    Tracks how many generation slots the worker has free.
+
+    When the server probes the worker, a slot is reserved with a short-lived lease rather than just answering "willing".
+    The payload that follows must present the lease ID to claim the slot - a payload without a live lease is refused,
+    even if a slot happens to be free, since that slot may be about to be promised to a probe. Leases that are never claimed
+    (say, because the server decided the worker was blacklisted) expire after `lease_ttl` seconds and the slot is freed,
+    unless the server hands them back sooner with `cancel` (as it does with the losers when it probes several workers at once).
+    Because reserved slots are not counted as free, two probes can no longer both be told there is room for one job.
+
+    Only used from the event loop, so there is no locking.
+    """
+
+    def __init__(self, slots : int = 1, lease_ttl : float = 5.0):
+        if slots < 1:
+            raise ValueError("A worker needs at least one slot")
+        self.slots = slots
+        self.lease_ttl = lease_ttl
+        self.running = 0
+        # lease ID -> expiry (time.monotonic)
+        self._leases : Dict[str, float] = {}
+        self.expired_leases = 0
+
+    @property
+    def reserved(self) -> int:
+        self._expire_leases()
+        return len(self._leases)
+
+    @property
+    def free_slots(self) -> int:
+        return max(0, self.slots - self.running - self.reserved)
+
+    def reserve(self) -> Optional[str]:
+        if self.free_slots == 0:
+            return None
+        lease_id = uuid.uuid4().hex
+        self._leases[lease_id] = time.monotonic() + self.lease_ttl
+        return lease_id
+
+    def claim(self, lease_id : Optional[str]) -> bool:
+        self._expire_leases()
+        if lease_id is None or self._leases.pop(lease_id, None) is None:
+            return False
+        self.running += 1
+        return True
+
+    # Frees the slot of a lease the server won't be claiming. Returns False if it was already claimed or expired.
+    def cancel(self, lease_id : str) -> bool:
+        self._expire_leases()
+        return self._leases.pop(lease_id, None) is not None
+
+    def release(self):
+        self.running = max(0, self.running - 1)
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        expired = [lease_id for lease_id, expiry in self._leases.items() if expiry <= now]
+        for lease_id in expired:
+            del self._leases[lease_id]
+        self.expired_leases += len(expired)
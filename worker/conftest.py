@@ -0,0 +1,4 @@
+import os, sys
+
+# The worker runs as a script with flat imports (`from capacity import ...`), so its tests import it the same way
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
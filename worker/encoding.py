@@ -0,0 +1,100 @@
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Union
+from PIL import Image
+
+# Raw images are tightly packed 8-bit RGB rows, with the dimensions in the `width` and `height` headers
+RAW_MIMETYPE = 'application/x-rgb8'
+
+MIMETYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'raw': RAW_MIMETYPE,
+}
+
+OUTPUT_FORMATS = list(MIMETYPES.keys())
+
+# The allowed `quality` for each format (raw ignores it)
+QUALITY_RANGES = {
+    'png': (0, 9),
+    'webp': (1, 100),
+    'jpeg': (1, 100),
+}
+
+
+class EncodedImage(NamedTuple):
+    data : Union[bytes, memoryview]
+    mimetype : str
+    headers : Dict[str,str]
+    seconds : float
+
+
+class ImageEncoder:
+    """
+    Encodes generated images on a small thread pool (PIL releases the GIL while compressing), keeping it off of the event loop
+    and off of the compute threads. The encoded bytes are returned as a view on the encoder's buffer, so publishing them doesn't copy.
+
+    `quality` is the compression level for PNG (0-9) and the quality for JPEG and WebP (1-100).
+    Encode time and output size are tracked per format.
+    """
+
+    def __init__(self, max_workers : int = 2):
+        self._executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "encode")
+        self._stats : Dict[str, Dict[str, float]] = {}
+
+    async def encode(self, image : Image.Image, format : str = 'png', quality : Optional[int] = None) -> EncodedImage:
+        ImageEncoder.validate(format, quality)
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(self._executor, ImageEncoder._encode, image, format, quality)
+        self._record(format, encoded)
+        return encoded
+
+    # Raises ValueError for a format or quality that can't be encoded - cheap, so requests are checked before they are generated
+    @staticmethod
+    def validate(format : str, quality : Optional[int]):
+        if format not in MIMETYPES:
+            raise ValueError(f"Unknown output format '{format}' (expected one of {OUTPUT_FORMATS})")
+        if quality is None or format not in QUALITY_RANGES:
+            return
+        low, high = QUALITY_RANGES[format]
+        if not isinstance(quality, int) or isinstance(quality, bool) or not low <= quality <= high:
+            raise ValueError(f"The quality for {format} must be a whole number from {low} to {high}, not {quality!r}")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            format: dict(count = int(s['count']),
+                         mean_ms = round(1000 * s['seconds'] / s['count'], 1),
+                         mean_bytes = int(s['bytes'] / s['count']))
+            for format, s in self._stats.items()
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait = True)
+
+    def _record(self, format : str, encoded : EncodedImage):
+        s = self._stats.setdefault(format, dict(count = 0, seconds = 0.0, bytes = 0))
+        s['count'] += 1
+        s['seconds'] += encoded.seconds
+        s['bytes'] += len(encoded.data)
+
+    # Runs on an encoder thread
+    @staticmethod
+    def _encode(image : Image.Image, format : str, quality : Optional[int]) -> EncodedImage:
+        start = time.perf_counter()
+        image = image.convert('RGB')
+        headers = {}
+        if format == 'raw':
+            data = image.tobytes()
+            headers.update(width = str(image.width), height = str(image.height))
+        else:
+            img_io = BytesIO()
+            if format == 'png':
+                image.save(img_io, 'PNG', compress_level = 6 if quality is None else quality)
+            elif format == 'jpeg':
+                image.save(img_io, 'JPEG', quality = 90 if quality is None else quality)
+            else:
+                image.save(img_io, 'WEBP', quality = 90 if quality is None else quality)
+            data = img_io.getbuffer()
+        return EncodedImage(data, MIMETYPES[format], headers, time.perf_counter() - start)
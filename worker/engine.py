@@ -0,0 +1,196 @@
+import asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from PIL import Image
+from mflux.error.exceptions import StopImageGenerationException
+from model_pool import ModelKey, ModelPool
+
+
+class GenerationEngine:
+    """
+    Runs image generation on dedicated compute thread(s).
+    All of the MLX work (text encoding, the denoise loop, VAE decode) happens off of the asyncio loop,
+    so the loop is free to answer `request-worker` probes and shuffle messages while an image is being generated.
+
+    `phase_cb(phase, seconds)` is called from the compute thread with the time spent waiting for a compute thread (queue_wait)
+    and in each phase of the generation itself.
+
+    The model pool's backend (mflux or simulated) builds the config for a request and renders previews.
+    """
+
+    def __init__(self, model_pool : ModelPool, max_workers : int = 1, phase_cb : Optional[Callable[[str, float], None]] = None):
+        self.model_pool = model_pool
+        self.backend = model_pool.backend
+        self.phase_cb = phase_cb
+        self._executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "compute")
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    # How many requests have been handed to the engine but have not started computing yet
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def _enqueued(self):
+        with self._queued_lock:
+            self._queued += 1
+
+    def _dequeued(self):
+        with self._queued_lock:
+            self._queued -= 1
+
+    # `progress_cb(step, total)` is called on the event loop and must not block.
+    # Setting `cancel_event` stops the generation at the next step with a StopImageGenerationException.
+    # `received_at` (time.perf_counter) is when the request arrived, for measuring how long it queued.
+    # `preview_cb(step, total, jpeg)` is called on the event loop with a low resolution preview after every step
+    # for which `preview_due()` (if given) is true - it is called on the compute thread, before the preview is made.
+    async def generate(self,
+                       model_key : ModelKey,
+                       request : Dict[str,any],
+                       progress_cb : Callable[[int, int], None],
+                       cancel_event : Optional[threading.Event] = None,
+                       received_at : Optional[float] = None,
+                       preview_cb : Optional[Callable[[int, int, bytes], None]] = None,
+                       preview_due : Optional[Callable[[], bool]] = None) -> Image.Image:
+        loop = asyncio.get_running_loop()
+        received_at = time.perf_counter() if received_at is None else received_at
+        self._enqueued()
+        return await loop.run_in_executor(self._executor, self._generate_blocking, loop, model_key, request, progress_cb, cancel_event, received_at, preview_cb, preview_due)
+
+    def shutdown(self):
+        self._executor.shutdown(wait = True)
+
+    # Runs on a compute thread
+    def _generate_blocking(self, loop : asyncio.AbstractEventLoop, model_key : ModelKey, request : Dict[str,any], progress_cb, cancel_event, received_at, preview_cb, preview_due) -> Image.Image:
+        self._dequeued()
+        if self.phase_cb is not None:
+            self.phase_cb("queue_wait", time.perf_counter() - received_at)
+
+        # The request may have been cancelled while it waited for a compute thread
+        if cancel_event is not None and cancel_event.is_set():
+            raise StopImageGenerationException("Image generation cancelled before it started")
+
+        # A miss in the model pool means loading weights - which also should not happen on the event loop
+        flux = self.model_pool.get(model_key)
+
+        # Flux1.generate_image is a coroutine, so it gets a private event loop on this thread
+        config = self.backend.config_for_request(request)
+        image = asyncio.run(flux.generate_image(
+            seed=request["seed"],
+            prompt=request["prompt"],
+            config=config,
+            progress_cb = threadsafe(loop, progress_cb),
+            cancel_event = cancel_event,
+            phase_cb = self.phase_cb,
+            preview_cb = self._threadsafe_preview(loop, preview_cb, preview_due, config)
+        ))
+        return image.image
+
+    # Previews are made on the compute thread (where the latents are) and handed to the event loop as JPEG bytes
+    def _threadsafe_preview(self, loop : asyncio.AbstractEventLoop, preview_cb : Optional[Callable[[int, int, bytes], None]], preview_due, config):
+        if preview_cb is None:
+            return None
+        def threadsafe_preview_cb(step, total, latents):
+            if preview_due is not None and not preview_due():
+                return
+            start = time.perf_counter()
+            jpeg = self.backend.preview_jpeg(latents, config.height, config.width)
+            if self.phase_cb is not None:
+                self.phase_cb("preview", time.perf_counter() - start)
+            loop.call_soon_threadsafe(preview_cb, step, total, jpeg)
+        return threadsafe_preview_cb
+
+
+class PipelinedGenerationEngine(GenerationEngine):
+    """
+    Splits each generation into three stages - prompt encoding, denoising and VAE decoding - each with its own thread,
+    so that consecutive requests overlap: while request N is denoising, request N+1's prompt is being encoded
+    and request N-1 is being decoded. At most `depth` requests are in the pipeline at once.
+
+    The gain is bounded by the shorter stages: with mflux, denoising is most of the time an image takes, so overlapping
+    the encode and decode around it saves at most their share of it per request - and only if the GPU actually runs
+    them alongside the denoise steps rather than one after the other. It also holds up to `depth` requests' activations
+    in memory at once. Pipelining is therefore opt-in (`--pipeline_depth`, 1 by default); measure it on the
+    target machine before turning it on. The simulated backend, whose stages only sleep, does show the overlap.
+    """
+
+    STAGES = ("encode", "denoise", "decode")
+
+    def __init__(self, model_pool : ModelPool, depth : int = 3, phase_cb : Optional[Callable[[str, float], None]] = None):
+        if depth < 1:
+            raise ValueError("The pipeline depth must be at least 1")
+        # The single compute thread of the base engine runs the encode stage
+        super().__init__(model_pool, max_workers = 1, phase_cb = phase_cb)
+        self.depth = depth
+        self._in_pipeline = asyncio.Semaphore(depth)
+        self._executors = dict(encode = self._executor,
+                               denoise = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "denoise"),
+                               decode = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "decode"))
+
+    async def generate(self,
+                       model_key : ModelKey,
+                       request : Dict[str,any],
+                       progress_cb : Callable[[int, int], None],
+                       cancel_event : Optional[threading.Event] = None,
+                       received_at : Optional[float] = None,
+                       preview_cb : Optional[Callable[[int, int, bytes], None]] = None,
+                       preview_due : Optional[Callable[[], bool]] = None) -> Image.Image:
+        loop = asyncio.get_running_loop()
+        received_at = time.perf_counter() if received_at is None else received_at
+        self._enqueued()
+        async with self._in_pipeline:
+            flux, config, prompt_embeds, pooled_prompt_embeds = await loop.run_in_executor(
+                self._executors["encode"], self._encode_stage, model_key, request, cancel_event, received_at)
+            latents, generation_time = await loop.run_in_executor(
+                self._executors["denoise"], self._denoise_stage, loop, flux, config, request, prompt_embeds, pooled_prompt_embeds, progress_cb, cancel_event, preview_cb, preview_due)
+            image = await loop.run_in_executor(
+                self._executors["decode"], self._decode_stage, flux, config, request, latents, generation_time)
+        return image.image
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait = True)
+
+    # Runs on the encode thread
+    def _encode_stage(self, model_key : ModelKey, request : Dict[str,any], cancel_event, received_at):
+        self._dequeued()
+        if self.phase_cb is not None:
+            self.phase_cb("queue_wait", time.perf_counter() - received_at)
+        if cancel_event is not None and cancel_event.is_set():
+            raise StopImageGenerationException("Image generation cancelled before it started")
+        flux = self.model_pool.get(model_key)
+        config = self.backend.runtime_config(self.backend.config_for_request(request), flux)
+        prompt_embeds, pooled_prompt_embeds = flux.encode_prompt(request["prompt"], phase_cb = self.phase_cb)
+        return flux, config, prompt_embeds, pooled_prompt_embeds
+
+    # Runs on the denoise thread
+    def _denoise_stage(self, loop, flux, config, request, prompt_embeds, pooled_prompt_embeds, progress_cb, cancel_event, preview_cb, preview_due):
+        return asyncio.run(flux.denoise(
+            seed = request["seed"],
+            prompt = request["prompt"],
+            config = config,
+            prompt_embeds = prompt_embeds,
+            pooled_prompt_embeds = pooled_prompt_embeds,
+            progress_cb = threadsafe(loop, progress_cb),
+            cancel_event = cancel_event,
+            phase_cb = self.phase_cb,
+            preview_cb = self._threadsafe_preview(loop, preview_cb, preview_due, config)
+        ))
+
+    # Runs on the decode thread
+    def _decode_stage(self, flux, config, request, latents, generation_time):
+        return flux.decode(
+            latents = latents,
+            seed = request["seed"],
+            prompt = request["prompt"],
+            config = config,
+            generation_time = generation_time,
+            phase_cb = self.phase_cb
+        )
+
+
+# Progress is handed back to the event loop without waiting for it to be published
+def threadsafe(loop : asyncio.AbstractEventLoop, progress_cb : Callable[[int, int], None]):
+    async def threadsafe_progress_cb(step, total):
+        loop.call_soon_threadsafe(progress_cb, step, total)
+    return threadsafe_progress_cb
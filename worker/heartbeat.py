@@ -0,0 +1,41 @@
+import asyncio, json, time
+from typing import Callable, Dict
+from nats.aio.client import Client as NATS
+
+
+class HeartbeatPublisher:
+    """
+    Publishes the worker's state to `worker-heartbeat.{worker_id}` every `interval` seconds,
+    and straight away whenever `beat_now` is called (say, because a slot was taken or freed).
+    `state_fn` returns the fields of the heartbeat (free capacity, loaded models, queue depth, recent step latency).
+    Schedulers keep a registry of these so they can dispatch to a known-free worker without probing the pool.
+    """
+
+    def __init__(self, nc : NATS, worker_id : str, state_fn : Callable[[], Dict[str, any]], interval : float = 2.0):
+        self.nc = nc
+        self.worker_id = worker_id
+        self.subject = f"worker-heartbeat.{worker_id}"
+        self.state_fn = state_fn
+        self.interval = interval
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def beat_now(self):
+        self._wake.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            payload = dict(workerId = self.worker_id, timestamp = time.time(), intervalSeconds = self.interval, **self.state_fn())
+            await self.nc.publish(self.subject, json.dumps(payload).encode())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout = self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
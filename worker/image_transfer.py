@@ -0,0 +1,92 @@
+import hashlib, uuid
+from typing import Dict, Optional, Union
+from nats.aio.client import Client as NATS
+from nats.js.api import ObjectStoreConfig
+from nats.js.errors import BucketNotFoundError
+
+# Room left in each message for the headers that describe the chunk
+CHUNK_HEADER_ALLOWANCE = 4 * 1024
+
+TRANSFER_MODES = ["chunked", "object-store"]
+
+
+class ImageSender:
+    """
+    Delivers generated images to an imageInbox without ever exceeding the NATs server's `max_payload`.
+
+    "chunked": the image is split into sequenced messages. Every chunk carries the manifest headers
+               (transferId, chunkIndex, chunkCount, totalBytes, sha256, mimetype) so the receiver can reassemble and verify it.
+               An image that fits in one message is simply a transfer of one chunk.
+    "object-store": the image is put in a JetStream object store bucket and a single message referencing it
+               (bucket, objectName, totalBytes, sha256, mimetype) is sent instead. Objects expire after `object_ttl` seconds.
+    """
+
+    def __init__(self,
+                 nc : NATS,
+                 mode : str = "chunked",
+                 max_chunk_size : Optional[int] = None,
+                 bucket : str = "generated-images",
+                 object_ttl : float = 3600):
+        if mode not in TRANSFER_MODES:
+            raise ValueError(f"Unknown transfer mode '{mode}' (expected one of {TRANSFER_MODES})")
+        self.nc = nc
+        self.mode = mode
+        self.max_chunk_size = max_chunk_size
+        self.bucket = bucket
+        self.object_ttl = object_ttl
+        self._object_store = None
+
+    @property
+    def chunk_size(self) -> int:
+        chunk_size = self.nc.max_payload - CHUNK_HEADER_ALLOWANCE
+        if self.max_chunk_size is not None:
+            chunk_size = min(chunk_size, self.max_chunk_size)
+        return chunk_size
+
+    # Returns the manifest headers the image was described with
+    async def send(self, image_inbox : str, data : Union[bytes, memoryview], mimetype : str, headers : Optional[Dict[str,str]] = None) -> Dict[str,str]:
+        data = memoryview(data)
+        manifest = dict(headers or {},
+                        success = 'true',
+                        mimetype = mimetype,
+                        totalBytes = str(len(data)),
+                        sha256 = hashlib.sha256(data).hexdigest())
+        if self.mode == "object-store":
+            await self._send_by_reference(image_inbox, data, manifest)
+        else:
+            await self._send_chunked(image_inbox, data, manifest)
+        await self.nc.flush()
+        return manifest
+
+    async def _send_chunked(self, image_inbox : str, data : memoryview, manifest : Dict[str,str]):
+        chunk_size = self.chunk_size
+        chunk_count = max(1, -(-len(data) // chunk_size))
+        transfer_id = uuid.uuid4().hex
+        for chunk_index in range(chunk_count):
+            # Slicing a memoryview does not copy the image
+            chunk = data[chunk_index * chunk_size : (chunk_index + 1) * chunk_size]
+            headers = dict(manifest,
+                           transfer = 'chunked',
+                           transferId = transfer_id,
+                           chunkIndex = str(chunk_index),
+                           chunkCount = str(chunk_count))
+            await self.nc.publish(image_inbox, chunk, headers = headers)
+
+    async def _send_by_reference(self, image_inbox : str, data : memoryview, manifest : Dict[str,str]):
+        object_store = await self._get_object_store()
+        object_name = uuid.uuid4().hex
+        await object_store.put(object_name, data.tobytes())
+        headers = dict(manifest,
+                       transfer = 'object-store',
+                       bucket = self.bucket,
+                       objectName = object_name)
+        await self.nc.publish(image_inbox, b'', headers = headers)
+
+    async def _get_object_store(self):
+        if self._object_store is None:
+            js = self.nc.jetstream()
+            try:
+                self._object_store = await js.object_store(self.bucket)
+            except BucketNotFoundError:
+                self._object_store = await js.create_object_store(self.bucket, config = ObjectStoreConfig(ttl = self.object_ttl))
+        return self._object_store
@@ -0,0 +1,222 @@
+import asyncio, bisect, json, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from nats.aio.client import Client as NATS
+
+# Upper bounds (seconds) of the latency buckets - from a few ms (tokenizing) up to a minute (a large image end to end)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Histogram:
+    """A Prometheus-style histogram (cumulative buckets, sum and count) for each combination of label values."""
+
+    def __init__(self, name : str, help : str, label_names : Sequence[str] = (), buckets : Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts with a trailing +Inf bucket, sum)
+        self._series : Dict[LabelValues, Tuple[List[int], float]] = {}
+        # Observed from compute and encoder threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def observe(self, value : float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = { key: (list(counts), total) for key, (counts, total) in self._series.items() }
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + [float('inf')], counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{self._labels(key, le = le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            series = { key: (list(counts), total) for key, (counts, total) in self._series.items() }
+        return {
+            ",".join(key) or "all": dict(count = sum(counts),
+                                         sum = round(total, 6),
+                                         p50 = self._quantile(counts, 0.50),
+                                         p95 = self._quantile(counts, 0.95),
+                                         p99 = self._quantile(counts, 0.99))
+            for key, (counts, total) in series.items()
+        }
+
+    # Estimates a quantile by interpolating linearly within the bucket it falls in
+    def _quantile(self, counts : List[int], q : float) -> Optional[float]:
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return round(lower + (upper - lower) * (rank - cumulative) / count, 6)
+            cumulative += count
+        return self.buckets[-1]
+
+    def _labels(self, key : LabelValues, **extra) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing count for each combination of label values."""
+
+    def __init__(self, name : str, help : str, label_names : Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values : Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount : float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            labels = ",".join(f'{name}="{v}"' for name, v in zip(self.label_names, key))
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return { ",".join(key) or "all": value for key, value in self._values.items() }
+
+
+class Gauge:
+    """A value that goes up and down, read from `fn` whenever the metric is rendered."""
+
+    def __init__(self, name : str, help : str, fn = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.snapshot()}"]
+
+    def snapshot(self) -> float:
+        return self.fn() if self.fn is not None else 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def histogram(self, name : str, help : str, label_names : Sequence[str] = (), buckets : Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, label_names, buckets))
+
+    def counter(self, name : str, help : str, label_names : Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, label_names))
+
+    def gauge(self, name : str, help : str, fn = None) -> Gauge:
+        return self._metrics.setdefault(name, Gauge(name, help, fn))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, any]:
+        return { name: metric.snapshot() for name, metric in self._metrics.items() }
+
+
+class WorkerMetrics:
+    """The metrics a worker keeps: a latency histogram per generation phase, and outcome counts."""
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self.phase_seconds = self.registry.histogram(
+            "worker_phase_seconds",
+            "Seconds spent in each phase of handling an image request "
+            "(queue_wait, tokenize, t5_encode, clip_encode, denoise_step, preview, vae_decode, image_encode, publish)",
+            label_names = ("phase",))
+        self.images = self.registry.counter("worker_images_total", "Image requests handled, by outcome", label_names = ("outcome",))
+        self.cancel_to_free_seconds = self.registry.histogram(
+            "worker_cancel_to_free_seconds", "Seconds from receiving a cancellation to freeing the slot")
+        self.dropped = self.registry.counter("worker_requests_dropped_total", "Requests dropped without being computed, by reason", label_names = ("reason",))
+        # Set once the worker has a request queue (see track_queue_depth)
+        self.queue_depth = self.registry.gauge("worker_queue_depth", "Admitted requests waiting for their turn to compute")
+        # The last few denoise steps, for heartbeats (the histogram above never forgets, so it is slow to show a change)
+        self._recent_steps = deque(maxlen = 32)
+
+    # Safe to call from any thread
+    def observe_phase(self, phase : str, seconds : float):
+        self.phase_seconds.observe(seconds, phase = phase)
+        if phase == "denoise_step":
+            self._recent_steps.append(seconds)
+
+    def track_queue_depth(self, fn):
+        self.queue_depth.fn = fn
+
+    def recent_step_seconds(self) -> Optional[float]:
+        recent = list(self._recent_steps)
+        return round(sum(recent) / len(recent), 6) if recent else None
+
+
+class MetricsServer:
+    """Serves the registry in Prometheus text format at http://<host>:<port>/metrics, from a daemon thread."""
+
+    def __init__(self, registry : MetricsRegistry, port : int, host : str = "127.0.0.1"):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry_.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Scrapes are frequent - don't log each one
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target = self._server.serve_forever, name = "metrics-http", daemon = True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+async def publish_metrics_periodically(nc : NATS, worker_id : str, registry : MetricsRegistry, interval : float):
+    subject = f"worker-metrics.{worker_id}"
+    while True:
+        await asyncio.sleep(interval)
+        payload = dict(workerId = worker_id, timestamp = time.time(), metrics = registry.snapshot())
+        await nc.publish(subject, json.dumps(payload).encode())
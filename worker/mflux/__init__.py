@@ -1,9 +1,16 @@
-from mflux.config.config import Config, ConfigControlnet
-from mflux.config.model_config import ModelConfig
-from mflux.controlnet.flux_controlnet import Flux1Controlnet
-from mflux.error.exceptions import StopImageGenerationException
-from mflux.flux.flux import Flux1
-from mflux.post_processing.image_util import ImageUtil
+import importlib
+
+# The public names are imported on first use, so that importing a light submodule (say mflux.error.exceptions)
+# doesn't also import MLX, torch and transformers
+_EXPORTS = {
+    "Flux1": "mflux.flux.flux",
+    "Flux1Controlnet": "mflux.controlnet.flux_controlnet",
+    "Config": "mflux.config.config",
+    "ConfigControlnet": "mflux.config.config",
+    "ModelConfig": "mflux.config.model_config",
+    "ImageUtil": "mflux.post_processing.image_util",
+    "StopImageGenerationException": "mflux.error.exceptions",
+}
 
 __all__ = [
     "Flux1",
@@ -14,3 +21,9 @@ __all__ = [
     "ImageUtil",
     "StopImageGenerationException",
 ]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module 'mflux' has no attribute '{name}'")
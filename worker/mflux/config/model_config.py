@@ -19,9 +19,7 @@ class ModelConfig(Enum):
 
     @staticmethod
     def from_alias(alias: str) -> "ModelConfig":
-        try:
-            for model in ModelConfig:
-                if model.alias == alias:
-                    return model
-        except KeyError:
-            raise ValueError(f"'{alias}' is not a valid model")
+        for model in ModelConfig:
+            if model.alias == alias:
+                return model
+        raise ValueError(f"'{alias}' is not a valid model")
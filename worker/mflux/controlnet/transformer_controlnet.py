@@ -53,10 +53,12 @@ class TransformerControlnet(nn.Module):
         guidance = mx.broadcast_to(config.guidance * config.num_train_steps, (1,)).astype(config.precision)
         text_embeddings = self.time_text_embed.forward(time_step, pooled_prompt_embeds, guidance)
         encoder_hidden_states = self.context_embedder(prompt_embeds)
-        txt_ids = Transformer.prepare_text_ids(seq_len=prompt_embeds.shape[1])
-        img_ids = Transformer.prepare_latent_image_ids(height=config.height, width=config.width)
-        ids = mx.concatenate((txt_ids, img_ids), axis=1)
-        image_rotary_emb = self.pos_embed.forward(ids)
+        image_rotary_emb = Transformer.rotary_embeddings(
+            pos_embed=self.pos_embed,
+            seq_len=prompt_embeds.shape[1],
+            height=config.height,
+            width=config.width,
+        )
 
         block_samples = ()
         for block in self.transformer_blocks:
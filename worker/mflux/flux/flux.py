@@ -1,6 +1,9 @@
 import asyncio
+import threading
+import time
 
 from pathlib import Path
+from typing import Callable
 
 import mlx.core as mx
 from mlx import nn
@@ -39,10 +42,16 @@ class Flux1:
         self.lora_scales = lora_scales
         self.model_config = model_config
 
+        # Seconds spent in each phase of loading the model (tokenizers, weights, quantize)
+        self.load_timings = {}
+
         # Load and initialize the tokenizers from disk, huggingface cache, or download from huggingface
+        start = time.perf_counter()
         tokenizers = TokenizerHandler(model_config.model_name, self.model_config.max_sequence_length, local_path)
         self.t5_tokenizer = TokenizerT5(tokenizers.t5, max_length=self.model_config.max_sequence_length)
         self.clip_tokenizer = TokenizerCLIP(tokenizers.clip)
+        self.load_timings["tokenizers"] = time.perf_counter() - start
+        start = time.perf_counter()
 
         # Initialize the models
         self.vae = VAE()
@@ -61,6 +70,8 @@ class Flux1:
         # Set the loaded weights if they are not quantized
         if weights.quantization_level is None:
             self._set_model_weights(weights)
+        self.load_timings["weights"] = time.perf_counter() - start
+        start = time.perf_counter()
 
         # Optionally quantize the model here at initialization (also required if about to load quantized weights)
         self.bits = None
@@ -72,10 +83,13 @@ class Flux1:
             nn.quantize(self.t5_text_encoder, class_predicate=lambda _, m: isinstance(m, nn.Linear), group_size=64, bits=self.bits)
             nn.quantize(self.clip_text_encoder, class_predicate=lambda _, m: isinstance(m, nn.Linear), group_size=64, bits=self.bits)
             # fmt: on
+        self.load_timings["quantize"] = time.perf_counter() - start
 
         # If loading previously saved quantized weights, the weights must be set after modules have been quantized
         if weights.quantization_level is not None:
+            start = time.perf_counter()
             self._set_model_weights(weights)
+            self.load_timings["weights"] += time.perf_counter() - start
 
     async def generate_image(
         self,
@@ -84,9 +98,76 @@ class Flux1:
         config: Config = Config(),
         stepwise_output_dir: Path = None,
         progress_cb = None,
+        cancel_event: threading.Event | None = None,
+        phase_cb: Callable[[str, float], None] | None = None,
+        preview_cb: Callable[[int, int, mx.array], None] | None = None,
     ) -> GeneratedImage:
         # Create a new runtime config based on the model type and input parameters
         config = RuntimeConfig(config, self.model_config)
+
+        # 1. Embed the prompt
+        prompt_embeds, pooled_prompt_embeds = self.encode_prompt(prompt, phase_cb=phase_cb)
+
+        # 2. Denoise the initial latents
+        latents, generation_time = await self.denoise(
+            seed=seed,
+            prompt=prompt,
+            config=config,
+            prompt_embeds=prompt_embeds,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            stepwise_output_dir=stepwise_output_dir,
+            progress_cb=progress_cb,
+            cancel_event=cancel_event,
+            phase_cb=phase_cb,
+            preview_cb=preview_cb,
+        )
+
+        # 3. Decode the latents into an image
+        return self.decode(
+            latents=latents,
+            seed=seed,
+            prompt=prompt,
+            config=config,
+            generation_time=generation_time,
+            phase_cb=phase_cb,
+        )
+
+    # The three stages of generate_image are also usable on their own, so that consecutive requests
+    # can be pipelined (one request's prompt encoding overlapping with another's denoising and a third one's decoding)
+
+    def encode_prompt(
+        self,
+        prompt: str,
+        phase_cb: Callable[[str, float], None] | None = None,
+    ) -> tuple[mx.array, mx.array]:
+        # Embeddings are evaluated eagerly so that each encoder's time is its own
+        start = time.perf_counter()
+        t5_tokens = self.t5_tokenizer.tokenize(prompt)
+        clip_tokens = self.clip_tokenizer.tokenize(prompt)
+        Flux1._record_phase(phase_cb, "tokenize", start)
+        start = time.perf_counter()
+        prompt_embeds = self.t5_text_encoder.forward(t5_tokens)
+        mx.eval(prompt_embeds)
+        Flux1._record_phase(phase_cb, "t5_encode", start)
+        start = time.perf_counter()
+        pooled_prompt_embeds = self.clip_text_encoder.forward(clip_tokens)
+        mx.eval(pooled_prompt_embeds)
+        Flux1._record_phase(phase_cb, "clip_encode", start)
+        return prompt_embeds, pooled_prompt_embeds
+
+    async def denoise(
+        self,
+        seed: int,
+        prompt: str,
+        config: RuntimeConfig,
+        prompt_embeds: mx.array,
+        pooled_prompt_embeds: mx.array,
+        stepwise_output_dir: Path = None,
+        progress_cb = None,
+        cancel_event: threading.Event | None = None,
+        phase_cb: Callable[[str, float], None] | None = None,
+        preview_cb: Callable[[int, int, mx.array], None] | None = None,
+    ) -> tuple[mx.array, float]:
         time_steps = tqdm(range(config.init_time_step, config.num_inference_steps))
         stepwise_handler = StepwiseHandler(
             flux=self,
@@ -100,15 +181,15 @@ class Flux1:
         # 1. Create the initial latents
         latents = LatentCreator.create_for_txt2img_or_img2img(seed, config, self.vae)
 
-        # 2. Embed the prompt
-        t5_tokens = self.t5_tokenizer.tokenize(prompt)
-        clip_tokens = self.clip_tokenizer.tokenize(prompt)
-        prompt_embeds = self.t5_text_encoder.forward(t5_tokens)
-        pooled_prompt_embeds = self.clip_text_encoder.forward(clip_tokens)
-
         for gen_step, t in enumerate(time_steps, 1):
+            # Stop between steps if whoever asked for the image no longer wants it
+            if cancel_event is not None and cancel_event.is_set():
+                raise StopImageGenerationException(f"Image generation cancelled at step {gen_step}/{len(time_steps)}")
+
             try:
-                # 3.t Predict the noise
+                start = time.perf_counter()
+
+                # 2.t Predict the noise
                 noise = self.transformer.predict(
                     t=t,
                     prompt_embeds=prompt_embeds,
@@ -117,7 +198,7 @@ class Flux1:
                     config=config,
                 )
 
-                # 4.t Take one denoise step
+                # 3.t Take one denoise step
                 dt = config.sigmas[t + 1] - config.sigmas[t]
                 latents += noise * dt
 
@@ -126,28 +207,56 @@ class Flux1:
 
                 # Evaluate to enable progress tracking
                 mx.eval(latents)
+                Flux1._record_phase(phase_cb, "denoise_step", start)
+
+                # Hand the (packed, evaluated) latents over for a cheap preview - see LatentPreview
+                if preview_cb is not None:
+                    preview_cb(gen_step, len(time_steps), latents)
 
-                await progress_cb(100 * (gen_step)/config.num_inference_steps)
+                if progress_cb is not None:
+                    await progress_cb(gen_step, len(time_steps))
 
             except KeyboardInterrupt:  # noqa: PERF203
                 stepwise_handler.handle_interruption()
                 raise StopImageGenerationException(f"Stopping image generation at step {t + 1}/{len(time_steps)}")
 
-        # 5. Decode the latent array and return the image
+        # The VAE decode is expensive too, so don't start it for a cancelled image
+        if cancel_event is not None and cancel_event.is_set():
+            raise StopImageGenerationException("Image generation cancelled before decoding")
+
+        return latents, time_steps.format_dict["elapsed"]
+
+    def decode(
+        self,
+        latents: mx.array,
+        seed: int,
+        prompt: str,
+        config: RuntimeConfig,
+        generation_time: float,
+        phase_cb: Callable[[str, float], None] | None = None,
+    ) -> GeneratedImage:
+        start = time.perf_counter()
         latents = ArrayUtil.unpack_latents(latents=latents, height=config.height, width=config.width)
         decoded = self.vae.decode(latents)
-        return ImageUtil.to_image(
+        image = ImageUtil.to_image(
             decoded_latents=decoded,
             seed=seed,
             prompt=prompt,
             quantization=self.bits,
-            generation_time=time_steps.format_dict["elapsed"],
+            generation_time=generation_time,
             lora_paths=self.lora_paths,
             lora_scales=self.lora_scales,
             init_image_path=config.init_image_path,
             init_image_strength=config.init_image_strength,
             config=config,
         )
+        Flux1._record_phase(phase_cb, "vae_decode", start)
+        return image
+
+    @staticmethod
+    def _record_phase(phase_cb: Callable[[str, float], None] | None, phase: str, start: float) -> None:
+        if phase_cb is not None:
+            phase_cb(phase, time.perf_counter() - start)
 
     @staticmethod
     def from_alias(alias: str, quantize: int | None = None) -> "Flux1":
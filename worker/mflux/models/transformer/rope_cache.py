@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import mlx.core as mx
+
+
+class RopeCache:
+    # The rotary embeddings only depend on the text sequence length and the image size - not on the step, the prompt
+    # or the weights - so they are computed once per shape and reused across denoise steps and requests.
+    # Bounded: the least recently used shape is evicted once there are more than max_entries.
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, mx.array] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], mx.array]) -> mx.array:
+        with self._lock:
+            embeddings = self._entries.get(key)
+            if embeddings is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeddings
+            self.misses += 1
+
+        # Computed outside the lock (generations run on several threads). Evaluated now, so that every step
+        # reuses the table instead of the graph that builds it.
+        embeddings = compute()
+        mx.eval(embeddings)
+
+        with self._lock:
+            self._entries[key] = embeddings
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeddings
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by Transformer and TransformerControlnet (EmbedND has no weights, so every instance gives the same table)
+ROPE_CACHE = RopeCache()
@@ -0,0 +1,38 @@
+import mlx.core as mx
+
+from mflux.models.transformer.embed_nd import EmbedND
+from mflux.models.transformer.rope_cache import RopeCache
+from mflux.models.transformer.transformer import Transformer
+
+
+def _uncached(seq_len: int, height: int, width: int) -> mx.array:
+    txt_ids = Transformer.prepare_text_ids(seq_len=seq_len)
+    img_ids = Transformer.prepare_latent_image_ids(height, width)
+    return EmbedND().forward(mx.concatenate((txt_ids, img_ids), axis=1))
+
+
+def test_cached_embeddings_match_the_uncached_path():
+    for seq_len, height, width in [(16, 64, 64), (32, 128, 96)]:
+        cached = Transformer.rotary_embeddings(EmbedND(), seq_len=seq_len, height=height, width=width)
+        assert mx.array_equal(cached, _uncached(seq_len, height, width)).item()
+
+
+def test_the_same_shape_is_computed_once():
+    cache = RopeCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return mx.zeros((1,))
+
+    first = cache.get((16, 64, 64), compute)
+    assert cache.get((16, 64, 64), compute) is first
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_shape_is_evicted():
+    cache = RopeCache(max_entries=2)
+    for key in [1, 2, 1, 3]:
+        cache.get(key, lambda: mx.zeros((1,)))
+    assert list(cache._entries) == [1, 3]
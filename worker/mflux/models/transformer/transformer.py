@@ -12,6 +12,7 @@ from mflux.models.transformer.embed_nd import EmbedND
 from mflux.models.transformer.joint_transformer_block import (
     JointTransformerBlock,
 )
+from mflux.models.transformer.rope_cache import ROPE_CACHE
 from mflux.models.transformer.single_transformer_block import (
     SingleTransformerBlock,
 )
@@ -46,10 +47,12 @@ class Transformer(nn.Module):
         guidance = mx.broadcast_to(config.guidance * config.num_train_steps, (1,)).astype(config.precision)
         text_embeddings = self.time_text_embed.forward(time_step, pooled_prompt_embeds, guidance)
         encoder_hidden_states = self.context_embedder(prompt_embeds)
-        txt_ids = Transformer.prepare_text_ids(seq_len=prompt_embeds.shape[1])
-        img_ids = Transformer.prepare_latent_image_ids(config.height, config.width)
-        ids = mx.concatenate((txt_ids, img_ids), axis=1)
-        image_rotary_emb = self.pos_embed.forward(ids)
+        image_rotary_emb = Transformer.rotary_embeddings(
+            pos_embed=self.pos_embed,
+            seq_len=prompt_embeds.shape[1],
+            height=config.height,
+            width=config.width,
+        )
 
         for idx, block in enumerate(self.transformer_blocks):
             encoder_hidden_states, hidden_states = block.forward(
@@ -85,6 +88,16 @@ class Transformer(nn.Module):
         noise = hidden_states
         return noise
 
+    @staticmethod
+    def rotary_embeddings(pos_embed: EmbedND, seq_len: int, height: int, width: int) -> mx.array:
+        def compute() -> mx.array:
+            txt_ids = Transformer.prepare_text_ids(seq_len=seq_len)
+            img_ids = Transformer.prepare_latent_image_ids(height, width)
+            ids = mx.concatenate((txt_ids, img_ids), axis=1)
+            return pos_embed.forward(ids)
+
+        return ROPE_CACHE.get((seq_len, height, width), compute)
+
     @staticmethod
     def prepare_latent_image_ids(height: int, width: int) -> mx.array:
         latent_width = width // 16
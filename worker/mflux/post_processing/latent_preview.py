@@ -0,0 +1,60 @@
+import io
+
+import mlx.core as mx
+import numpy as np
+from PIL import Image
+
+# A linear approximation of the VAE decoder: each of Flux's 16 latent channels contributes a fixed amount of R, G and B
+# (the factors ComfyUI uses for its Flux previews). Good enough to see the composition and colours emerge.
+LATENT_RGB_FACTORS = [
+    [-0.0346, 0.0244, 0.0681],
+    [0.0034, 0.0210, 0.0687],
+    [0.0275, -0.0668, -0.0433],
+    [-0.0174, 0.0160, 0.0617],
+    [0.0859, 0.0721, 0.0329],
+    [0.0004, 0.0383, 0.0115],
+    [0.0405, 0.0861, 0.0915],
+    [-0.0236, -0.0185, -0.0259],
+    [-0.0245, 0.0250, 0.1180],
+    [0.1008, 0.0755, -0.0421],
+    [-0.0515, 0.0201, 0.0011],
+    [0.0428, -0.0012, -0.0036],
+    [0.0817, 0.0765, 0.0749],
+    [-0.1264, -0.0522, -0.1103],
+    [-0.0280, -0.0881, -0.0499],
+    [-0.1262, -0.0982, -0.0778],
+]
+LATENT_RGB_BIAS = [-0.0329, -0.0718, -0.0851]
+
+
+def _packed_factors() -> tuple[mx.array, mx.array]:
+    # A packed latent token holds a 2x2 patch of all 16 channels, laid out as (channel, dy, dx) - see ArrayUtil.pack_latents.
+    # Expanding the 16x3 map to 64x12 maps a whole token to the RGB of its 4 pixels in one matmul, without unpacking first.
+    factors = np.array(LATENT_RGB_FACTORS, dtype=np.float32)
+    packed = np.einsum("ck,pq->cpqk", factors, np.eye(4, dtype=np.float32)).reshape(64, 12)
+    bias = np.tile(np.array(LATENT_RGB_BIAS, dtype=np.float32), 4)
+    return mx.array(packed), mx.array(bias)
+
+
+class LatentPreview:
+    _factors, _bias = _packed_factors()
+
+    @staticmethod
+    def to_array(latents: mx.array, height: int, width: int) -> np.ndarray:
+        # latents are packed: (1, (height // 16) * (width // 16), 64) -> an RGB image at latent resolution (1/8 of the image)
+        rgb = latents[0].astype(mx.float32) @ LatentPreview._factors + LatentPreview._bias
+        rgb = mx.reshape(rgb, (height // 16, width // 16, 2, 2, 3))
+        rgb = mx.transpose(rgb, (0, 2, 1, 3, 4))
+        rgb = mx.reshape(rgb, (height // 8, width // 8, 3))
+        rgb = mx.clip((rgb + 1.0) * 127.5, 0, 255).astype(mx.uint8)
+        return np.array(rgb)
+
+    @staticmethod
+    def to_image(latents: mx.array, height: int, width: int) -> Image.Image:
+        return Image.fromarray(LatentPreview.to_array(latents, height, width), mode="RGB")
+
+    @staticmethod
+    def to_jpeg(latents: mx.array, height: int, width: int, quality: int = 70) -> bytes:
+        buffer = io.BytesIO()
+        LatentPreview.to_image(latents, height, width).save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
@@ -0,0 +1,47 @@
+import io
+
+import mlx.core as mx
+import numpy as np
+from PIL import Image
+
+from mflux.post_processing.array_util import ArrayUtil
+from mflux.post_processing.latent_preview import LATENT_RGB_BIAS, LATENT_RGB_FACTORS, LatentPreview
+
+
+def _expected(latents: np.ndarray) -> np.ndarray:
+    # The linear decoder applied pixel by pixel to the unpacked (16, height // 8, width // 8) latents
+    rgb = np.einsum("cyx,ck->yxk", latents, np.array(LATENT_RGB_FACTORS, dtype=np.float32)) + np.array(LATENT_RGB_BIAS)
+    return np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+
+
+def test_packed_latents_map_to_an_image_at_an_eighth_of_the_size():
+    # Not square, so that swapping height and width (or the 2x2 patch axes) can't go unnoticed
+    height, width = 64, 96
+    latents = np.random.default_rng(0).normal(size=(16, height // 8, width // 8)).astype(np.float32)
+    packed = ArrayUtil.pack_latents(mx.array(latents[None]), height, width)
+    assert packed.shape == (1, (height // 16) * (width // 16), 64)
+
+    preview = LatentPreview.to_array(packed, height, width)
+
+    assert preview.shape == (height // 8, width // 8, 3)
+    assert preview.dtype == np.uint8
+    assert np.abs(preview.astype(int) - _expected(latents).astype(int)).max() <= 1
+
+
+def test_each_pixel_comes_from_its_own_place_in_the_latents():
+    height, width = 32, 48
+    latents = np.zeros((16, height // 8, width // 8), dtype=np.float32)
+    # A bright pixel in the bottom right corner of the first 2x2 patch - every other pixel is just the bias
+    latents[:, 1, 1] = 10 * np.sign(np.array(LATENT_RGB_FACTORS, dtype=np.float32)[:, 0])
+    preview = LatentPreview.to_array(ArrayUtil.pack_latents(mx.array(latents[None]), height, width), height, width)
+    assert preview[1, 1, 0] == 255
+    background = _expected(np.zeros_like(latents))[0, 0]
+    assert (preview[:, :, 0] == background[0]).sum() == preview[:, :, 0].size - 1
+
+
+def test_jpeg():
+    height, width = 64, 64
+    latents = mx.zeros((1, (height // 16) * (width // 16), 64))
+    image = Image.open(io.BytesIO(LatentPreview.to_jpeg(latents, height, width)))
+    assert image.format == "JPEG"
+    assert image.size == (width // 8, height // 8)
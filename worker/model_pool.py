@@ -0,0 +1,171 @@
+import threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class ModelKey(NamedTuple):
+    alias : str
+    quantize : Optional[int]
+    local_path : Optional[str]
+    # (lora_path, lora_scale) pairs, sorted so that the same LoRA set always produces the same key
+    loras : Tuple[Tuple[str, float], ...]
+
+    @staticmethod
+    def create(alias : str,
+               quantize : Optional[int] = None,
+               local_path : Optional[str] = None,
+               lora_paths : Optional[List[str]] = None,
+               lora_scales : Optional[List[float]] = None) -> "ModelKey":
+        lora_paths = lora_paths or []
+        lora_scales = lora_scales or [1.0] * len(lora_paths)
+        if len(lora_paths) != len(lora_scales):
+            raise ValueError("lora_paths and lora_scales must be the same length")
+        loras = tuple(sorted(zip(lora_paths, (float(s) for s in lora_scales))))
+        return ModelKey(alias, quantize, local_path, loras)
+
+
+class ModelAllowList:
+    """
+    Which models requests may ask the worker for. A request that names a model, quantization or LoRAs makes the worker
+    load them (evicting a resident model if the pool is full), so anything beyond the preloaded models must be allowed
+    by the operator: `models` are (alias, quantize) pairs, where a quantize of None allows any quantization,
+    and `lora_paths` are the only LoRA files a request may load (at any scale).
+    """
+
+    def __init__(self,
+                 preloaded : List[ModelKey],
+                 models : Optional[List[Tuple[str, Optional[int]]]] = None,
+                 lora_paths : Optional[List[str]] = None):
+        self.preloaded = set(preloaded)
+        self.models = set(models or [])
+        self.lora_paths = set(lora_paths or [])
+
+    def allows(self, key : ModelKey) -> bool:
+        if key in self.preloaded:
+            return True
+        if (key.alias, key.quantize) not in self.models and (key.alias, None) not in self.models:
+            return False
+        return all(path in self.lora_paths for path, _ in key.loras)
+
+    # Parses ALIAS or ALIAS:QUANTIZE (as given to --allowed_models)
+    @staticmethod
+    def parse_model(spec : str) -> Tuple[str, Optional[int]]:
+        alias, _, quantize = spec.partition(":")
+        return alias, int(quantize) if quantize else None
+
+
+class ModelPool:
+    """
+    Keeps fully loaded (and quantized) Flux1 instances resident in the worker, so that a request
+    only pays for the denoise loop rather than for re-reading tokenizers, safetensors shards and re-quantizing.
+    Models are preloaded at startup. A request for a model that is not resident is a "miss" - it is loaded,
+    and if the pool is full the least recently used model is evicted to make room for it.
+    Loading happens outside of the pool's lock, so requests for resident models carry on while a model loads.
+    Requests for a model that is already being loaded wait for that load instead of starting another.
+
+    Models are loaded by the `backend` (see backends.py) - Flux1 instances for mflux, stand-ins for the simulated backend.
+    """
+
+    def __init__(self, backend, max_resident : int = 1):
+        if max_resident < 1:
+            raise ValueError("The model pool must be able to hold at least one model")
+        self.backend = backend
+        self.max_resident = max_resident
+        self._models : "OrderedDict[ModelKey, any]" = OrderedDict()
+        # Guards the bookkeeping only - it is never held while a model loads
+        self._lock = threading.Lock()
+        # Models being loaded, so that the same model is never loaded twice at once
+        self._loading : Dict[ModelKey, Future] = {}
+        # Loading is slow and memory hungry - never load two models at once
+        self._load_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds : Dict[ModelKey, float] = {}
+
+    def preload(self, key : ModelKey):
+        return self._get(key, count = False)
+
+    def get(self, key : ModelKey):
+        return self._get(key, count = True)
+
+    def _get(self, key : ModelKey, count : bool):
+        with self._lock:
+            flux = self._models.get(key)
+            if flux is not None:
+                if count:
+                    self.hits += 1
+                self._models.move_to_end(key)
+                return flux
+            if count:
+                self.misses += 1
+            future = self._loading.get(key)
+            loading_here = future is None
+            if loading_here:
+                future = Future()
+                self._loading[key] = future
+        if not loading_here:
+            return future.result()
+        try:
+            flux = self._load(key)
+            future.set_result(flux)
+            return flux
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def keys(self) -> List[ModelKey]:
+        with self._lock:
+            return list(self._models.keys())
+
+    # Human readable names of the resident models, most recently used last
+    def describe_resident(self) -> List[str]:
+        with self._lock:
+            return [_describe(key) for key in self._models.keys()]
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                resident = len(self._models),
+                hits = self.hits,
+                misses = self.misses,
+                hit_rate = (self.hits / lookups) if lookups > 0 else None,
+                evictions = self.evictions,
+                load_seconds = { _describe(key): round(seconds, 3) for key, seconds in self.load_seconds.items() }
+            )
+
+    # Must be called without holding the lock
+    def _load(self, key : ModelKey):
+        with self._load_lock:
+            # Make room first so that the outgoing model can be freed before the incoming model is allocated
+            # (requests still running on an evicted model keep their own reference to it)
+            with self._lock:
+                while len(self._models) >= self.max_resident:
+                    evicted_key, _ = self._models.popitem(last = False)
+                    self.evictions += 1
+                    print(f"Model pool evicted {_describe(evicted_key)}")
+
+            print(f"Model pool loading {_describe(key)}...")
+            start = time.perf_counter()
+            flux = self.backend.load(key)
+            elapsed = time.perf_counter() - start
+            print(f"Model pool loaded {_describe(key)} in {elapsed:.2f}s")
+
+            with self._lock:
+                self.load_seconds[key] = elapsed
+                self._models[key] = flux
+            return flux
+
+
+def _describe(key : ModelKey) -> str:
+    description = f"{key.alias}/q{key.quantize}"
+    if key.local_path:
+        description += f"@{key.local_path}"
+    if key.loras:
+        description += "+" + ",".join(f"{path}:{scale}" for path, scale in key.loras)
+    return description
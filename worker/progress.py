@@ -0,0 +1,85 @@
+import asyncio, struct, time
+from typing import Optional, Tuple
+from nats.aio.client import Client as NATS
+
+# Progress messages are 8 bytes: step (uint16), total steps (uint16), elapsed milliseconds since generation started (uint32)
+PROGRESS_FORMAT = struct.Struct("!HHI")
+
+
+class ProgressPublisher:
+    """
+    Publishes denoise progress for one image, at most once every `min_interval` seconds.
+
+    `update` never blocks the caller: it records the latest value and (if nothing is scheduled yet) schedules a send.
+    Updates that arrive while a send is scheduled are coalesced, so only the most recent step goes out.
+    Messages are not followed by a flush - the NATs client's own flusher sends them without a round-trip to the server.
+
+    Latent previews (small JPEGs) go out on the same subject, throttled and coalesced the same way,
+    as messages with a `kind: preview` header (and `step` and `total` headers) to tell them apart from progress.
+    Making a preview is not free, so the compute thread asks `preview_due` first.
+    """
+
+    def __init__(self, nc : NATS, subject : str, min_interval : float = 0.25):
+        self.nc = nc
+        self.subject = subject
+        self.min_interval = min_interval
+        self.start = time.monotonic()
+        self._latest : Optional[Tuple[int, int, int]] = None
+        self._latest_preview : Optional[Tuple[int, int, bytes]] = None
+        self._last_sent = float('-inf')
+        self._task : Optional[asyncio.Task] = None
+        self._closed = False
+
+    # Must be called on the event loop (use loop.call_soon_threadsafe from a compute thread)
+    def update(self, step : int, total : int):
+        if self._closed:
+            return
+        elapsed_ms = int((time.monotonic() - self.start) * 1000)
+        self._latest = (step, total, elapsed_ms)
+        self._schedule()
+
+    # Must be called on the event loop, like `update`
+    def preview(self, step : int, total : int, jpeg : bytes):
+        if self._closed:
+            return
+        self._latest_preview = (step, total, jpeg)
+        self._schedule()
+
+    # Whether a preview made now would go out, rather than replace one that is still waiting to be sent.
+    # Called from the compute thread before making a preview (it only reads), so previews that would be coalesced away
+    # are never computed in the first place.
+    def preview_due(self) -> bool:
+        return not self._closed and self._latest_preview is None
+
+    def _schedule(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._send_after_interval())
+
+    # Sends whatever is still pending, so the last step is never lost to coalescing - or, with send_pending=False, drops it
+    # (a failed generation mustn't have progress arrive after its final reply). Nothing is published after closing.
+    async def close(self, send_pending : bool = True):
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if send_pending:
+            await self._send_latest()
+        else:
+            self._latest, self._latest_preview = None, None
+
+    async def _send_after_interval(self):
+        delay = self._last_sent + self.min_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._send_latest()
+
+    async def _send_latest(self):
+        if self._latest is None and self._latest_preview is None:
+            return
+        latest, latest_preview = self._latest, self._latest_preview
+        self._latest, self._latest_preview = None, None
+        self._last_sent = time.monotonic()
+        if latest is not None:
+            await self.nc.publish(self.subject, PROGRESS_FORMAT.pack(*latest))
+        if latest_preview is not None:
+            step, total, jpeg = latest_preview
+            await self.nc.publish(self.subject, jpeg, headers = dict(kind = 'preview', step = str(step), total = str(total)))
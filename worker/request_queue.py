@@ -0,0 +1,85 @@
+import asyncio, heapq, itertools, time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+
+class DeadlineExpired(Exception):
+    """The request's deadline passed before it could start, so it was dropped without being computed."""
+
+
+class RequestQueue:
+    """
+    Decides which admitted request computes next. At most `concurrency` requests hold a turn at once;
+    the rest wait in a heap ordered by priority (highest first), then earliest deadline, then arrival.
+
+    A request whose deadline (time.time(), in seconds) passes while it waits - or that arrives already expired -
+    is dropped with DeadlineExpired instead of taking a turn, since whoever asked for it has given up by then.
+
+    Only used from the event loop, so there is no locking.
+    """
+
+    def __init__(self, concurrency : int = 1):
+        if concurrency < 1:
+            raise ValueError("The queue must let at least one request run")
+        self.concurrency = concurrency
+        self.running = 0
+        # (-priority, deadline, sequence, future) - futures of requests that gave up stay in the heap until popped
+        self._heap : List[Tuple[int, float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for *_, future in self._heap if not future.done())
+
+    @asynccontextmanager
+    async def turn(self, priority : int = 0, deadline : Optional[float] = None):
+        await self._wait_for_turn(priority, deadline)
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._grant_next()
+
+    async def _wait_for_turn(self, priority : int, deadline : Optional[float]):
+        if deadline is not None and deadline <= time.time():
+            self.dropped += 1
+            raise DeadlineExpired("The request's deadline had passed when it arrived")
+        if self.running < self.concurrency and not self._has_waiters():
+            self.running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (-priority, deadline if deadline is not None else float('inf'), next(self._sequence), future))
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        try:
+            # The turn is handed over (running incremented) by _grant_next before the future resolves
+            await asyncio.wait_for(asyncio.shield(future), timeout = timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted at the same moment the deadline passed - the turn is ours, so give it back
+                self.running -= 1
+                self._grant_next()
+            future.cancel()
+            self.dropped += 1
+            raise DeadlineExpired("The request's deadline passed while it was queued")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.running -= 1
+                self._grant_next()
+            future.cancel()
+            raise
+
+    def _has_waiters(self) -> bool:
+        while self._heap and self._heap[0][3].done():
+            heapq.heappop(self._heap)
+        return len(self._heap) > 0
+
+    def _grant_next(self):
+        while self.running < self.concurrency and self._heap:
+            *_, future = heapq.heappop(self._heap)
+            if future.done():
+                # Its deadline passed (or it was cancelled) while it waited
+                continue
+            self.running += 1
+            future.set_result(None)
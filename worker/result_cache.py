@@ -0,0 +1,183 @@
+import asyncio, hashlib, json, math, os, time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Union
+from nats.aio.client import Client as NATS
+from nats.js.api import ObjectMeta, ObjectStoreConfig
+from nats.js.errors import BucketNotFoundError, ObjectNotFoundError, ServiceUnavailableError
+from model_pool import ModelKey
+
+RESULT_CACHE_MODES = ["off", "object-store", "disk"]
+
+# Bumped whenever something changes what a given key would generate (so that stale entries stop matching)
+RESULT_CACHE_KEY_VERSION = "v1"
+
+# mflux's default guidance, used for requests that don't set one
+DEFAULT_GUIDANCE = 4.0
+
+
+# Floats (LoRA scales, guidance) are keyed in thousandths so the same value always serializes the same way.
+# Halves round up, as in server/resultCacheKey.ts - not with round(), which rounds them to even where Math.round doesn't.
+def thousandths(value : float) -> int:
+    return math.floor(value * 1000 + 0.5)
+
+
+def result_cache_key(model_key : ModelKey, request : Dict[str,any]) -> str:
+    """
+    The SHA-256 of everything that determines the bytes of a generated image, in a fixed order.
+    server/resultCacheKey.ts computes the same key - the two must be kept in step.
+    """
+    fields = [RESULT_CACHE_KEY_VERSION,
+              model_key.alias,
+              model_key.quantize,
+              [[path, thousandths(scale)] for path, scale in model_key.loras],
+              request["prompt"],
+              request["seed"],
+              request["numSteps"],
+              request["height"],
+              request["width"],
+              thousandths(request.get("guidance", DEFAULT_GUIDANCE)),
+              request.get("format", "png"),
+              request.get("quality")]
+    canonical = json.dumps(fields, ensure_ascii = False, separators = (",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CachedResult(NamedTuple):
+    data : bytes
+    # The manifest headers the image was originally sent with (mimetype, totalBytes, sha256, ...)
+    headers : Dict[str,str]
+
+
+class ObjectStoreResultCache:
+    """
+    Generated images kept in a JetStream object store bucket, named by their result_cache_key, and shared by the whole cluster.
+    The server looks keys up before acquiring a worker and on a hit sends the requester a reference to the object instead.
+
+    Entries expire after `ttl` seconds. When the bucket reaches `max_bytes` the oldest entries are deleted to make room.
+    """
+
+    def __init__(self, nc : NATS, bucket : str = "result-cache", max_bytes : int = 1024 ** 3, ttl : float = 24 * 3600):
+        self.nc = nc
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._object_store = None
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key : str) -> Optional[CachedResult]:
+        object_store = await self._get_object_store()
+        try:
+            result = await object_store.get(key)
+        except ObjectNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedResult(result.data, dict(result.info.headers or {}))
+
+    async def put(self, key : str, data : Union[bytes, memoryview], headers : Dict[str,str]):
+        object_store = await self._get_object_store()
+        data = bytes(data)
+        meta = ObjectMeta(name = key, headers = dict(headers))
+        try:
+            await object_store.put(key, data, meta = meta)
+        except ServiceUnavailableError:
+            # The bucket is full - drop the oldest entries and try once more
+            await self._evict_oldest(len(data))
+            await object_store.put(key, data, meta = meta)
+
+    def stats(self) -> Dict[str, any]:
+        return dict(mode = "object-store", bucket = self.bucket, hits = self.hits, misses = self.misses)
+
+    async def _evict_oldest(self, needed_bytes : int):
+        object_store = await self._get_object_store()
+        infos = sorted((info for info in await object_store.list() if not info.deleted), key = lambda info: info.mtime)
+        freed = 0
+        for info in infos:
+            if freed >= needed_bytes:
+                break
+            await object_store.delete(info.name)
+            freed += info.size
+
+    async def _get_object_store(self):
+        if self._object_store is None:
+            js = self.nc.jetstream()
+            try:
+                self._object_store = await js.object_store(self.bucket)
+            except BucketNotFoundError:
+                config = ObjectStoreConfig(ttl = self.ttl, max_bytes = self.max_bytes)
+                self._object_store = await js.create_object_store(self.bucket, config = config)
+        return self._object_store
+
+
+class DiskResultCache:
+    """
+    A stand-in for the object store when the worker runs without JetStream: the same entries, in a local directory,
+    with least recently used entries evicted once they add up to more than `max_bytes`.
+    Only the worker itself can see these, so a hit still costs acquiring a worker (but not generating the image).
+    """
+
+    def __init__(self, directory : str, max_bytes : int = 1024 ** 3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents = True, exist_ok = True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key : str) -> Optional[CachedResult]:
+        result = await asyncio.to_thread(self._get_blocking, key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def put(self, key : str, data : Union[bytes, memoryview], headers : Dict[str,str]):
+        await asyncio.to_thread(self._put_blocking, key, bytes(data), dict(headers))
+
+    def stats(self) -> Dict[str, any]:
+        return dict(mode = "disk", directory = str(self.directory), hits = self.hits, misses = self.misses)
+
+    def _get_blocking(self, key : str) -> Optional[CachedResult]:
+        data_path, headers_path = self._paths(key)
+        try:
+            data = data_path.read_bytes()
+            headers = json.loads(headers_path.read_text())
+        except FileNotFoundError:
+            return None
+        # Reading an entry makes it the most recently used (unless it was evicted in the meantime)
+        now = time.time()
+        try:
+            os.utime(data_path, (now, now))
+        except FileNotFoundError:
+            pass
+        return CachedResult(data, headers)
+
+    def _put_blocking(self, key : str, data : bytes, headers : Dict[str,str]):
+        data_path, headers_path = self._paths(key)
+        # Headers first and the image last, each renamed into place, so a reader never sees half an entry
+        for path, content in ((headers_path, json.dumps(headers).encode()), (data_path, data)):
+            partial = path.with_suffix(path.suffix + ".partial")
+            partial.write_bytes(content)
+            os.replace(partial, path)
+        self._evict_blocking()
+
+    def _evict_blocking(self):
+        entries = []
+        for path in self.directory.glob("*.bin"):
+            # Another put may evict (or replace) an entry between listing the directory and looking at it
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok = True)
+            path.with_suffix(".json").unlink(missing_ok = True)
+            total -= size
+
+    def _paths(self, key : str):
+        return self.directory / f"{key}.bin", self.directory / f"{key}.json"
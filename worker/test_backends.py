@@ -0,0 +1,88 @@
+import asyncio, statistics, threading
+from io import BytesIO
+import pytest
+from PIL import Image
+from mflux.error.exceptions import StopImageGenerationException
+import backends
+from backends import LatencyModel, SimulatedBackend, create_backend
+from model_pool import ModelKey
+
+KEY = ModelKey.create("schnell")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # The simulated model's durations, without waiting them out
+    sleeps = []
+    monkeypatch.setattr(backends.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def generate(backend, request, **kwargs):
+    flux = backend.load(KEY)
+    return asyncio.run(flux.generate_image(request["seed"], request["prompt"], backend.config_for_request(request), **kwargs))
+
+
+def request(**overrides):
+    return dict(dict(seed = 1, prompt = "p", numSteps = 4, height = 512, width = 1024), **overrides)
+
+
+def test_latency_scales_with_megapixels():
+    latency = LatencyModel(seconds_per_megapixel_step = 0.5, step_overhead = 0.02, seconds_per_megapixel_decode = 0.3)
+    assert latency.step_seconds(1000, 1000) == pytest.approx(0.52)
+    assert latency.step_seconds(500, 1000) == pytest.approx(0.27)
+    assert latency.decode_seconds(1000, 2000) == pytest.approx(0.6)
+
+def test_every_phase_takes_as_long_as_the_model_says(sleeps):
+    latency = LatencyModel(jitter = 0.0, load_seconds = 1.5)
+    phases = []
+    generate(SimulatedBackend(latency), request(), phase_cb = lambda phase, seconds: phases.append(phase))
+    megapixels = 512 * 1024 / 1e6
+    assert sleeps == pytest.approx([1.5, latency.encode_seconds]
+                                   + [latency.step_overhead + latency.seconds_per_megapixel_step * megapixels] * 4
+                                   + [latency.seconds_per_megapixel_decode * megapixels])
+    assert phases == ["t5_encode"] + ["denoise_step"] * 4 + ["vae_decode"]
+
+def test_jitter_spreads_durations_around_the_model(sleeps):
+    latency = LatencyModel(step_overhead = 1.0, seconds_per_megapixel_step = 0.0, jitter = 0.1)
+    generate(SimulatedBackend(latency), request(numSteps = 2000))
+    # After loading and encoding, before decoding
+    steps = sleeps[2:-1]
+    assert len(steps) == 2000
+    assert min(steps) >= 0
+    assert statistics.mean(steps) == pytest.approx(1.0, abs = 0.02)
+    assert statistics.stdev(steps) == pytest.approx(0.1, abs = 0.02)
+
+def test_progress_previews_and_cancellation_behave_like_flux(sleeps):
+    backend = SimulatedBackend(LatencyModel(jitter = 0.0))
+    cancel_event = threading.Event()
+    progress, previews = [], []
+
+    async def progress_cb(step, total):
+        progress.append((step, total))
+        if step == 2:
+            cancel_event.set()
+
+    with pytest.raises(StopImageGenerationException):
+        generate(backend, request(), progress_cb = progress_cb, cancel_event = cancel_event,
+                 preview_cb = lambda step, total, latents: previews.append((step, latents)))
+    assert progress == [(1, 4), (2, 4)]
+    assert previews == [(1, 0.25), (2, 0.5)]
+
+def test_images_are_determined_by_seed_and_prompt(sleeps):
+    backend = SimulatedBackend(LatencyModel(jitter = 0.0))
+    image = generate(backend, request(height = 100, width = 70)).image
+    # Sizes are rounded down to a multiple of 16, as with mflux
+    assert image.size == (64, 96)
+    assert generate(backend, request(height = 100, width = 70)).image.tobytes() == image.tobytes()
+    assert generate(backend, request(height = 100, width = 70, seed = 2)).image.tobytes() != image.tobytes()
+    assert generate(backend, request(height = 100, width = 70, prompt = "q")).image.tobytes() != image.tobytes()
+
+def test_previews_are_an_eighth_of_the_image():
+    jpeg = SimulatedBackend().preview_jpeg(0.5, 512, 1024)
+    assert Image.open(BytesIO(jpeg)).size == (128, 64)
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_backend("onnx")
+    assert isinstance(create_backend("simulated"), SimulatedBackend)
@@ -0,0 +1,68 @@
+import time
+import pytest
+from capacity import CapacityManager
+
+
+def test_reserving_takes_a_free_slot():
+    capacity = CapacityManager(slots = 2)
+    assert capacity.reserve() is not None
+    assert capacity.free_slots == 1
+    assert capacity.reserve() is not None
+    assert capacity.free_slots == 0
+    assert capacity.reserve() is None
+
+def test_claiming_a_lease_moves_it_to_running():
+    capacity = CapacityManager(slots = 1)
+    lease_id = capacity.reserve()
+    assert capacity.claim(lease_id)
+    assert capacity.running == 1 and capacity.reserved == 0 and capacity.free_slots == 0
+    capacity.release()
+    assert capacity.running == 0 and capacity.free_slots == 1
+
+def test_claiming_without_a_live_lease_is_refused():
+    capacity = CapacityManager(slots = 2)
+    capacity.reserve()
+    # A slot is free, but it may be about to be promised to a probe
+    assert capacity.free_slots == 1
+    assert not capacity.claim(None)
+    assert not capacity.claim("not-a-lease")
+    assert capacity.running == 0
+
+def test_a_lease_cannot_be_claimed_twice():
+    capacity = CapacityManager(slots = 2)
+    lease_id = capacity.reserve()
+    assert capacity.claim(lease_id)
+    assert not capacity.claim(lease_id)
+    assert capacity.running == 1
+
+def test_an_expired_lease_cannot_be_claimed():
+    capacity = CapacityManager(slots = 1, lease_ttl = 0.05)
+    lease_id = capacity.reserve()
+    time.sleep(0.1)
+    assert not capacity.claim(lease_id)
+    assert capacity.running == 0
+
+def test_unclaimed_leases_expire():
+    capacity = CapacityManager(slots = 1, lease_ttl = 0.05)
+    lease_id = capacity.reserve()
+    assert capacity.free_slots == 0
+    time.sleep(0.1)
+    assert capacity.free_slots == 1
+    assert capacity.expired_leases == 1
+    assert not capacity.cancel(lease_id)
+
+def test_cancelling_a_lease_frees_its_slot():
+    capacity = CapacityManager(slots = 1)
+    lease_id = capacity.reserve()
+    assert capacity.cancel(lease_id)
+    assert capacity.free_slots == 1
+    assert not capacity.cancel(lease_id)
+
+def test_release_never_goes_below_zero():
+    capacity = CapacityManager(slots = 1)
+    capacity.release()
+    assert capacity.running == 0
+
+def test_a_worker_needs_a_slot():
+    with pytest.raises(ValueError):
+        CapacityManager(slots = 0)
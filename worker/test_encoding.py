@@ -0,0 +1,62 @@
+import asyncio
+from io import BytesIO
+import pytest
+from PIL import Image
+from encoding import RAW_MIMETYPE, ImageEncoder
+
+IMAGE = Image.new("RGB", (32, 16), (10, 200, 30))
+
+
+def encode(format, quality = None, image = IMAGE):
+    async def main():
+        encoder = ImageEncoder(max_workers = 1)
+        try:
+            return await encoder.encode(image, format, quality)
+        finally:
+            encoder.shutdown()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("format, quality", [("png", None), ("png", 0), ("png", 9), ("jpeg", 1), ("jpeg", 100), ("webp", 50), ("raw", None), ("raw", 500)])
+def test_valid_formats_and_qualities(format, quality):
+    ImageEncoder.validate(format, quality)
+
+@pytest.mark.parametrize("format, quality", [("gif", None), ("PNG", None), ("png", 10), ("png", -1), ("jpeg", 0), ("jpeg", 101),
+                                             ("webp", "90"), ("webp", 9.5), ("jpeg", True)])
+def test_invalid_formats_and_qualities(format, quality):
+    with pytest.raises(ValueError):
+        ImageEncoder.validate(format, quality)
+
+def test_encode_refuses_what_validate_refuses():
+    with pytest.raises(ValueError):
+        encode("png", 50)
+
+@pytest.mark.parametrize("format, mimetype, pil_format", [("png", "image/png", "PNG"), ("jpeg", "image/jpeg", "JPEG"), ("webp", "image/webp", "WEBP")])
+def test_compressed_formats_decode_to_the_image(format, mimetype, pil_format):
+    encoded = encode(format, 90 if format != "png" else 6)
+    assert encoded.mimetype == mimetype
+    decoded = Image.open(BytesIO(bytes(encoded.data)))
+    assert decoded.format == pil_format and decoded.size == IMAGE.size
+
+def test_raw_is_packed_rgb_rows_with_the_dimensions_in_headers():
+    image = Image.new("RGBA", (3, 2))
+    image.putpixel((2, 1), (1, 2, 3, 255))
+    encoded = encode("raw", image = image)
+    assert encoded.mimetype == RAW_MIMETYPE
+    assert encoded.headers == dict(width = "3", height = "2")
+    data = bytes(encoded.data)
+    assert len(data) == 3 * 2 * 3
+    # The last pixel, with the alpha channel dropped
+    assert data[-3:] == bytes([1, 2, 3])
+
+def test_stats_are_kept_per_format():
+    async def main():
+        encoder = ImageEncoder(max_workers = 1)
+        await encoder.encode(IMAGE, "png")
+        await encoder.encode(IMAGE, "png")
+        await encoder.encode(IMAGE, "raw")
+        encoder.shutdown()
+        return encoder.stats()
+    stats = asyncio.run(main())
+    assert stats["png"]["count"] == 2 and stats["raw"]["count"] == 1
+    assert stats["raw"]["mean_bytes"] == 32 * 16 * 3
@@ -0,0 +1,136 @@
+import asyncio, threading, time
+import pytest
+from mflux.error.exceptions import StopImageGenerationException
+from backends import LatencyModel, SimulatedBackend, synthetic_image
+from engine import GenerationEngine, PipelinedGenerationEngine
+from model_pool import ModelKey, ModelPool
+
+KEY = ModelKey.create("schnell")
+# Every stage takes 50ms (one denoise step of a 256x256 image), without jitter
+LATENCY = LatencyModel(seconds_per_megapixel_step = 0.0, step_overhead = 0.05, encode_seconds = 0.05,
+                       seconds_per_megapixel_decode = 0.05 * 1e6 / (256 * 256), jitter = 0.0)
+
+
+def request(seed, num_steps = 1):
+    return dict(seed = seed, prompt = f"prompt {seed}", numSteps = num_steps, height = 256, width = 256)
+
+
+class StageRecorder:
+    """A phase_cb that records which thread each phase ran on and when."""
+
+    def __init__(self):
+        self.intervals = []
+        self._lock = threading.Lock()
+
+    def __call__(self, phase, seconds):
+        end = time.perf_counter()
+        with self._lock:
+            self.intervals.append((phase, threading.current_thread().name, end - seconds, end))
+
+    def of(self, phase):
+        return [(start, end) for recorded, _, start, end in self.intervals if recorded == phase]
+
+
+def overlaps(a, b):
+    return any(a_start < b_end and b_start < a_end for a_start, a_end in a for b_start, b_end in b)
+
+
+def test_pipeline_depth_must_be_positive():
+    with pytest.raises(ValueError):
+        PipelinedGenerationEngine(ModelPool(SimulatedBackend(LATENCY)), depth = 0)
+
+def test_pipeline_keeps_the_order_and_overlaps_the_stages():
+    recorder = StageRecorder()
+    engine = PipelinedGenerationEngine(ModelPool(SimulatedBackend(LATENCY)), depth = 3, phase_cb = recorder)
+    finished = []
+
+    async def generate(seed):
+        image = await engine.generate(KEY, request(seed), progress_cb = lambda step, total: None)
+        finished.append(seed)
+        return image
+
+    async def main():
+        return await asyncio.gather(*(generate(seed) for seed in range(4)))
+
+    try:
+        images = asyncio.run(main())
+    finally:
+        engine.shutdown()
+
+    assert finished == [0, 1, 2, 3]
+    assert [image.tobytes() for image in images] == [synthetic_image(seed, f"prompt {seed}", 256, 256).tobytes() for seed in range(4)]
+    # Each stage has its own thread...
+    assert { (phase, thread.split("_")[0]) for phase, thread, _, _ in recorder.intervals } == \
+        { ("queue_wait", "compute"), ("t5_encode", "compute"), ("denoise_step", "denoise"), ("vae_decode", "decode") }
+    # ... and they worked on different requests at the same time
+    assert overlaps(recorder.of("t5_encode"), recorder.of("denoise_step"))
+    assert overlaps(recorder.of("denoise_step"), recorder.of("vae_decode"))
+    assert engine.queue_depth == 0
+
+def test_without_a_pipeline_the_stages_do_not_overlap():
+    recorder = StageRecorder()
+    engine = GenerationEngine(ModelPool(SimulatedBackend(LATENCY)), phase_cb = recorder)
+
+    async def main():
+        await asyncio.gather(*(engine.generate(KEY, request(seed), progress_cb = lambda step, total: None) for seed in range(3)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        engine.shutdown()
+    assert not overlaps(recorder.of("t5_encode"), recorder.of("denoise_step"))
+    assert not overlaps(recorder.of("denoise_step"), recorder.of("vae_decode"))
+
+def test_cancelling_mid_pipeline_frees_its_place():
+    engine = PipelinedGenerationEngine(ModelPool(SimulatedBackend(LATENCY)), depth = 1)
+    cancel_event = threading.Event()
+
+    def cancel_after_the_first_step(step, total):
+        cancel_event.set()
+
+    async def main():
+        cancelled = asyncio.create_task(engine.generate(KEY, request(0, num_steps = 50), progress_cb = cancel_after_the_first_step,
+                                                        cancel_event = cancel_event))
+        # Waits for the only place in the pipeline, which the cancelled request has to give up
+        follower = asyncio.create_task(engine.generate(KEY, request(1), progress_cb = lambda step, total: None))
+        with pytest.raises(StopImageGenerationException):
+            await cancelled
+        return await asyncio.wait_for(follower, timeout = 2)
+
+    start = time.perf_counter()
+    try:
+        image = asyncio.run(main())
+    finally:
+        engine.shutdown()
+    assert image.size == (256, 256)
+    # Far less than the 50 steps of the cancelled request
+    assert time.perf_counter() - start < 1.0
+    assert engine.queue_depth == 0
+
+def test_previews_are_made_only_when_due():
+    class CountingBackend(SimulatedBackend):
+        made = 0
+        def preview_jpeg(self, latents, height, width):
+            CountingBackend.made += 1
+            return super().preview_jpeg(latents, height, width)
+
+    engine = GenerationEngine(ModelPool(CountingBackend(LATENCY)))
+    asked = []
+    previews = []
+
+    def preview_due():
+        asked.append(len(asked) + 1)
+        return len(asked) % 2 == 1
+
+    async def main():
+        await engine.generate(KEY, request(0, num_steps = 5), progress_cb = lambda step, total: None,
+                              preview_cb = lambda step, total, jpeg: previews.append(step), preview_due = preview_due)
+        await asyncio.sleep(0)
+
+    try:
+        asyncio.run(main())
+    finally:
+        engine.shutdown()
+    assert asked == [1, 2, 3, 4, 5]
+    assert CountingBackend.made == 3
+    assert previews == [1, 3, 5]
@@ -0,0 +1,63 @@
+import asyncio, json
+from heartbeat import HeartbeatPublisher
+
+
+class FakeNats:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, subject, payload):
+        self.published.append((subject, json.loads(payload.decode())))
+
+
+def test_heartbeats_carry_the_state_and_interval():
+    nc = FakeNats()
+    state = dict(freeSlots = 1, totalSlots = 2)
+
+    async def main():
+        publisher = HeartbeatPublisher(nc, "w1", lambda: state, interval = 0.05)
+        publisher.start()
+        await asyncio.sleep(0.01)
+        state["freeSlots"] = 0
+        await asyncio.sleep(0.1)
+        await publisher.stop()
+
+    asyncio.run(main())
+    subjects = { subject for subject, _ in nc.published }
+    assert subjects == { "worker-heartbeat.w1" }
+    first, *later = [payload for _, payload in nc.published]
+    # One straight away, then one every interval
+    assert first["workerId"] == "w1" and first["intervalSeconds"] == 0.05 and first["freeSlots"] == 1
+    assert len(later) >= 1 and later[-1]["freeSlots"] == 0
+
+def test_beat_now_publishes_without_waiting_for_the_interval():
+    nc = FakeNats()
+
+    async def main():
+        publisher = HeartbeatPublisher(nc, "w1", lambda: dict(freeSlots = 1), interval = 60)
+        publisher.start()
+        await asyncio.sleep(0.01)
+        publisher.beat_now()
+        await asyncio.sleep(0.01)
+        publisher.beat_now()
+        await asyncio.sleep(0.01)
+        await publisher.stop()
+
+    asyncio.run(main())
+    assert len(nc.published) == 3
+
+def test_stop_ends_the_heartbeats():
+    nc = FakeNats()
+
+    async def main():
+        publisher = HeartbeatPublisher(nc, "w1", lambda: {}, interval = 0.01)
+        publisher.start()
+        await asyncio.sleep(0.05)
+        await publisher.stop()
+        await asyncio.sleep(0)
+        count = len(nc.published)
+        await asyncio.sleep(0.05)
+        return count
+
+    count = asyncio.run(main())
+    assert count >= 2 and len(nc.published) == count
@@ -0,0 +1,107 @@
+import asyncio, hashlib, os, random, sys
+from types import SimpleNamespace
+import pytest
+from nats.js.errors import BucketNotFoundError
+from image_transfer import CHUNK_HEADER_ALLOWANCE, ImageSender
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'requester'))
+from image_reassembler import ImageReassembler
+
+IMAGE = random.Random(0).randbytes(10_000)
+
+
+class FakeObjectStore:
+    def __init__(self):
+        self.objects = {}
+
+    async def put(self, name, data):
+        self.objects[name] = bytes(data)
+
+    async def get(self, name):
+        return SimpleNamespace(data = self.objects[name])
+
+
+class FakeJetStream:
+    def __init__(self):
+        self.buckets = {}
+
+    async def object_store(self, bucket):
+        if bucket not in self.buckets:
+            raise BucketNotFoundError()
+        return self.buckets[bucket]
+
+    async def create_object_store(self, bucket, config = None):
+        self.buckets[bucket] = FakeObjectStore()
+        return self.buckets[bucket]
+
+
+class FakeNats:
+    """Records what is published, as a NATs server with the given max_payload would deliver it."""
+
+    def __init__(self, max_payload = 1024 * 1024):
+        self.max_payload = max_payload
+        self.messages = []
+        self.js = FakeJetStream()
+
+    async def publish(self, subject, payload, headers = None):
+        assert len(payload) <= self.max_payload
+        self.messages.append(SimpleNamespace(subject = subject, data = bytes(payload), headers = dict(headers or {})))
+
+    async def flush(self):
+        pass
+
+    def jetstream(self):
+        return self.js
+
+
+def send_and_reassemble(nc, sender):
+    async def main():
+        manifest = await sender.send("inbox", IMAGE, mimetype = "image/png", headers = dict(seed = "7"))
+        reassembler = ImageReassembler(nc)
+        results = [await reassembler.receive(msg) for msg in nc.messages]
+        return manifest, results
+    return asyncio.run(main())
+
+
+def test_chunks_respect_the_chunk_size_and_carry_the_manifest():
+    nc = FakeNats()
+    manifest, results = send_and_reassemble(nc, ImageSender(nc, max_chunk_size = 3000))
+    assert [len(m.data) for m in nc.messages] == [3000, 3000, 3000, 1000]
+    for i, msg in enumerate(nc.messages):
+        assert msg.subject == "inbox"
+        assert msg.headers["chunkIndex"] == str(i)
+        assert msg.headers["chunkCount"] == "4"
+        assert msg.headers["totalBytes"] == str(len(IMAGE))
+        assert msg.headers["sha256"] == hashlib.sha256(IMAGE).hexdigest()
+        assert msg.headers["transferId"] == nc.messages[0].headers["transferId"]
+        assert (msg.headers["success"], msg.headers["mimetype"], msg.headers["seed"]) == ("true", "image/png", "7")
+    assert manifest["sha256"] == hashlib.sha256(IMAGE).hexdigest()
+    assert results[:-1] == [None] * 3
+    assert results[-1].data == IMAGE
+
+def test_chunks_leave_room_for_headers_under_the_server_max_payload():
+    nc = FakeNats(max_payload = 8 * 1024)
+    sender = ImageSender(nc)
+    assert sender.chunk_size == 8 * 1024 - CHUNK_HEADER_ALLOWANCE
+    _, results = send_and_reassemble(nc, sender)
+    assert len(nc.messages) == 3
+    assert results[-1].data == IMAGE
+
+def test_a_small_image_is_a_transfer_of_one_chunk():
+    nc = FakeNats()
+    _, results = send_and_reassemble(nc, ImageSender(nc))
+    assert len(nc.messages) == 1 and nc.messages[0].headers["chunkCount"] == "1"
+    assert results[0].data == IMAGE
+
+def test_object_store_transfer_sends_a_reference():
+    nc = FakeNats()
+    _, results = send_and_reassemble(nc, ImageSender(nc, mode = "object-store", bucket = "images"))
+    [msg] = nc.messages
+    assert msg.data == b''
+    assert msg.headers["transfer"] == "object-store" and msg.headers["bucket"] == "images"
+    assert nc.js.buckets["images"].objects[msg.headers["objectName"]] == IMAGE
+    assert results[0].data == IMAGE
+
+def test_unknown_transfer_modes_are_refused():
+    with pytest.raises(ValueError):
+        ImageSender(FakeNats(), mode = "carrier-pigeon")
@@ -0,0 +1,112 @@
+import urllib.error, urllib.request
+import pytest
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, MetricsServer, WorkerMetrics
+
+
+def test_observations_land_in_the_first_bucket_they_fit():
+    histogram = Histogram("h", "help", buckets = (1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 2.0, 3.0, 100.0):
+        histogram.observe(value)
+    lines = histogram.render()
+    # Bucket bounds are inclusive (`le`) and cumulative, with everything above the last bound in +Inf
+    assert 'h_bucket{le="1.0"} 2' in lines
+    assert 'h_bucket{le="2.0"} 4' in lines
+    assert 'h_bucket{le="+Inf"} 6' in lines
+    assert "h_count 6" in lines
+    assert "h_sum 108.0" in lines
+
+def test_buckets_are_sorted():
+    histogram = Histogram("h", "help", buckets = (2.0, 1.0))
+    assert histogram.buckets == (1.0, 2.0)
+
+def test_quantiles_interpolate_within_their_bucket():
+    histogram = Histogram("h", "help", buckets = (1.0, 2.0))
+    for _ in range(10):
+        histogram.observe(1.5)
+    snapshot = histogram.snapshot()["all"]
+    assert snapshot["count"] == 10
+    assert snapshot["sum"] == 15.0
+    # All observations are in (1, 2] - the median is estimated halfway through it
+    assert snapshot["p50"] == pytest.approx(1.5)
+    assert snapshot["p95"] == pytest.approx(1.95)
+    assert snapshot["p99"] == pytest.approx(1.99)
+
+def test_quantiles_span_buckets():
+    histogram = Histogram("h", "help", buckets = (1.0, 2.0, 4.0))
+    for value in [0.5] * 50 + [3.0] * 50:
+        histogram.observe(value)
+    snapshot = histogram.snapshot()["all"]
+    assert snapshot["p50"] == pytest.approx(1.0)
+    assert snapshot["p95"] == pytest.approx(2.0 + 2.0 * 45 / 50)
+
+def test_quantiles_beyond_the_last_bucket_are_capped_at_it():
+    histogram = Histogram("h", "help", buckets = (1.0, 2.0))
+    histogram.observe(50.0)
+    assert histogram.snapshot()["all"]["p99"] == 2.0
+
+def test_empty_histogram():
+    histogram = Histogram("h", "help", label_names = ("phase",))
+    assert histogram.snapshot() == {}
+    assert histogram.render() == ["# HELP h help", "# TYPE h histogram"]
+
+def test_each_label_combination_is_a_separate_series():
+    histogram = Histogram("h", "help", label_names = ("phase",), buckets = (1.0,))
+    histogram.observe(0.5, phase = "tokenize")
+    histogram.observe(2.0, phase = "denoise_step")
+    snapshot = histogram.snapshot()
+    assert snapshot["tokenize"]["count"] == 1 and snapshot["denoise_step"]["count"] == 1
+    lines = histogram.render()
+    assert 'h_bucket{phase="tokenize",le="1.0"} 1' in lines
+    assert 'h_bucket{phase="denoise_step",le="1.0"} 0' in lines
+    assert 'h_count{phase="denoise_step"} 1' in lines
+
+def test_counter_and_gauge():
+    counter = Counter("c", "help", label_names = ("outcome",))
+    counter.inc(outcome = "success")
+    counter.inc(2, outcome = "success")
+    counter.inc(outcome = "cancelled")
+    assert counter.snapshot() == { "success": 3, "cancelled": 1 }
+    assert 'c{outcome="success"} 3' in counter.render()
+    depth = [4]
+    gauge = Gauge("g", "help", fn = lambda: depth[0])
+    assert gauge.render()[-1] == "g 4"
+    depth[0] = 1
+    assert gauge.snapshot() == 1
+    assert Gauge("unset", "help").snapshot() == 0
+
+def test_prometheus_text_output():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+    registry.histogram("latency_seconds", "Latency", buckets = (0.1,)).observe(0.05)
+    text = registry.render_prometheus()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert lines[:3] == ["# HELP requests_total Requests", "# TYPE requests_total counter", "requests_total 1"]
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    # Registering a name twice returns the metric that is already there
+    assert registry.counter("requests_total", "Requests").snapshot() == { "all": 1 }
+
+def test_worker_metrics_keep_recent_denoise_steps():
+    metrics = WorkerMetrics()
+    assert metrics.recent_step_seconds() is None
+    metrics.observe_phase("tokenize", 5.0)
+    metrics.observe_phase("denoise_step", 1.0)
+    metrics.observe_phase("denoise_step", 2.0)
+    assert metrics.recent_step_seconds() == 1.5
+    assert metrics.phase_seconds.snapshot()["denoise_step"]["count"] == 2
+
+def test_metrics_server_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+    server = MetricsServer(registry, port = 0)
+    server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode() == registry.render_prometheus()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
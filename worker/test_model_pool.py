@@ -0,0 +1,105 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from model_pool import ModelAllowList, ModelKey, ModelPool
+
+SCHNELL = ModelKey.create("schnell", 8)
+DEV = ModelKey.create("dev", 4)
+
+
+class RecordingBackend:
+    """Loads stand-in models, optionally waiting on `release` so a test can hold a load open."""
+
+    def __init__(self):
+        self.loads = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def load(self, key : ModelKey):
+        self.loads.append(key)
+        self.release.wait()
+        return f"model {key.alias}"
+
+
+def test_a_resident_model_is_a_hit():
+    backend = RecordingBackend()
+    pool = ModelPool(backend)
+    pool.preload(SCHNELL)
+    assert pool.get(SCHNELL) == "model schnell"
+    assert backend.loads == [SCHNELL]
+    assert (pool.hits, pool.misses) == (1, 0)
+
+def test_a_miss_loads_the_model_and_evicts_the_least_recently_used():
+    backend = RecordingBackend()
+    pool = ModelPool(backend, max_resident = 2)
+    flux2 = ModelKey.create("schnell", 4)
+    pool.preload(SCHNELL)
+    pool.preload(DEV)
+    pool.get(SCHNELL)
+    pool.get(flux2)
+    assert pool.keys() == [SCHNELL, flux2]
+    assert (pool.hits, pool.misses, pool.evictions) == (1, 1, 1)
+    assert pool.stats()["resident"] == 2
+
+def test_resident_models_are_served_while_another_model_loads():
+    backend = RecordingBackend()
+    pool = ModelPool(backend, max_resident = 2)
+    pool.preload(SCHNELL)
+    backend.release.clear()
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        loading = executor.submit(pool.get, DEV)
+        while DEV not in backend.loads:
+            time.sleep(0.001)
+        start = time.perf_counter()
+        assert pool.get(SCHNELL) == "model schnell"
+        assert time.perf_counter() - start < 0.1
+        backend.release.set()
+        assert loading.result() == "model dev"
+
+def test_concurrent_misses_for_the_same_model_load_it_once():
+    backend = RecordingBackend()
+    pool = ModelPool(backend, max_resident = 2)
+    backend.release.clear()
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        results = [executor.submit(pool.get, DEV) for _ in range(4)]
+        while DEV not in backend.loads:
+            time.sleep(0.001)
+        time.sleep(0.01)
+        backend.release.set()
+        assert [r.result() for r in results] == ["model dev"] * 4
+    assert backend.loads == [DEV]
+
+def test_a_failed_load_can_be_retried():
+    class FailingOnce(RecordingBackend):
+        def load(self, key):
+            if not self.loads:
+                self.loads.append(key)
+                raise RuntimeError("out of memory")
+            return super().load(key)
+    pool = ModelPool(FailingOnce())
+    with pytest.raises(RuntimeError):
+        pool.get(DEV)
+    assert pool.get(DEV) == "model dev"
+
+def test_the_allow_list_always_allows_the_preloaded_model():
+    with_loras = ModelKey.create("schnell", 8, lora_paths = ["style.safetensors"])
+    allow_list = ModelAllowList(preloaded = [with_loras])
+    assert allow_list.allows(with_loras)
+    assert not allow_list.allows(SCHNELL)
+
+def test_the_allow_list_matches_alias_and_quantize():
+    allow_list = ModelAllowList(preloaded = [SCHNELL], models = [ModelAllowList.parse_model("dev:4"), ModelAllowList.parse_model("schnell")])
+    assert allow_list.allows(DEV)
+    assert not allow_list.allows(ModelKey.create("dev", 8))
+    # A bare alias allows any quantization
+    assert allow_list.allows(ModelKey.create("schnell", 4))
+    assert not allow_list.allows(ModelKey.create("some/other-model", 8))
+
+def test_the_allow_list_only_allows_listed_lora_files():
+    allow_list = ModelAllowList(preloaded = [SCHNELL], models = [("schnell", None)], lora_paths = ["style.safetensors"])
+    assert allow_list.allows(ModelKey.create("schnell", 8, lora_paths = ["style.safetensors"], lora_scales = [0.7]))
+    assert not allow_list.allows(ModelKey.create("schnell", 8, lora_paths = ["style.safetensors", "/etc/passwd"]))
+
+def test_parse_model():
+    assert ModelAllowList.parse_model("dev") == ("dev", None)
+    assert ModelAllowList.parse_model("dev:4") == ("dev", 4)
@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import progress
+from progress import PROGRESS_FORMAT, ProgressPublisher
+
+
+class FakeNats:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, subject, payload, headers = None):
+        self.published.append((subject, payload, headers))
+
+    def steps(self):
+        return [PROGRESS_FORMAT.unpack(payload)[0] for _, payload, headers in self.published if headers is None]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Time only moves when the publisher sleeps (or a test moves it), so throttling is deterministic
+    clock = SimpleNamespace(now = 0.0, sleeps = [])
+    real_sleep = asyncio.sleep
+    async def sleep(delay):
+        clock.sleeps.append(delay)
+        clock.now += delay
+        await real_sleep(0)
+    monkeypatch.setattr(progress, "time", SimpleNamespace(monotonic = lambda: clock.now))
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return clock
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_the_first_update_goes_out_right_away(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "inbox.worker-progress", min_interval = 0.25)
+        clock.now = 1.5
+        publisher.update(1, 4)
+        await settle()
+        return nc
+    nc = asyncio.run(main())
+    assert [(subject, PROGRESS_FORMAT.unpack(payload)) for subject, payload, _ in nc.published] == [("inbox.worker-progress", (1, 4, 1500))]
+    # Nothing to wait out before the first message
+    assert not any(clock.sleeps)
+
+def test_updates_within_the_interval_are_coalesced_to_the_latest(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "subject", min_interval = 0.25)
+        publisher.update(1, 10)
+        await settle()
+        for step in (2, 3, 4):
+            publisher.update(step, 10)
+        await settle()
+        return nc
+    nc = asyncio.run(main())
+    assert nc.steps() == [1, 4]
+    # The second send waited out the rest of the interval
+    assert 0.25 in clock.sleeps
+
+def test_close_sends_the_pending_step(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "subject", min_interval = 0.25)
+        publisher.update(1, 2)
+        await settle()
+        publisher.update(2, 2)
+        await publisher.close()
+        await settle()
+        publisher.update(3, 2)
+        await settle()
+        return nc
+    assert asyncio.run(main()).steps() == [1, 2]
+
+def test_close_without_sending_drops_the_pending_step(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "subject", min_interval = 0.25)
+        publisher.update(1, 2)
+        await settle()
+        publisher.update(2, 2)
+        publisher.preview(2, 2, b"jpeg")
+        await publisher.close(send_pending = False)
+        await settle()
+        # A late update from the compute thread
+        publisher.update(2, 2)
+        await settle()
+        return nc
+    nc = asyncio.run(main())
+    assert nc.steps() == [1]
+    assert len(nc.published) == 1
+
+def test_previews_go_out_with_a_kind_header(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "subject")
+        publisher.update(3, 8)
+        publisher.preview(3, 8, b"jpeg")
+        await settle()
+        return nc
+    nc = asyncio.run(main())
+    assert nc.steps() == [3]
+    assert [(payload, headers) for _, payload, headers in nc.published if headers] == [(b"jpeg", dict(kind = 'preview', step = '3', total = '8'))]
+
+def test_a_preview_is_due_only_when_none_is_waiting_to_be_sent(clock):
+    async def main():
+        nc = FakeNats()
+        publisher = ProgressPublisher(nc, "subject", min_interval = 0.25)
+        due = [publisher.preview_due()]
+        publisher.preview(1, 10, b"first")
+        await settle()
+        # The first went straight out, so the next one is due - but has to wait out the interval once made
+        due.append(publisher.preview_due())
+        publisher.preview(2, 10, b"second")
+        due.append(publisher.preview_due())
+        await settle()
+        due.append(publisher.preview_due())
+        await publisher.close()
+        due.append(publisher.preview_due())
+        return nc, due
+    nc, due = asyncio.run(main())
+    assert due == [True, True, False, True, False]
+    assert [payload for _, payload, headers in nc.published if headers is not None] == [b"first", b"second"]
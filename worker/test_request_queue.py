@@ -0,0 +1,91 @@
+import asyncio, time
+import pytest
+from request_queue import DeadlineExpired, RequestQueue
+
+
+async def _run_in_order(queue : RequestQueue, requests, order):
+    # The first request holds the only turn while the others queue up behind it
+    release = asyncio.Event()
+    async def hold():
+        async with queue.turn():
+            await release.wait()
+    async def request(name, priority, deadline):
+        try:
+            async with queue.turn(priority, deadline):
+                order.append(name)
+        except DeadlineExpired:
+            order.append(f"{name} expired")
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, priority, deadline in requests:
+        tasks.append(asyncio.create_task(request(name, priority, deadline)))
+        await asyncio.sleep(0)
+    return holder, release, tasks
+
+def test_higher_priority_goes_first_then_earliest_deadline_then_arrival():
+    async def main():
+        queue = RequestQueue(concurrency = 1)
+        order = []
+        later = time.time() + 60
+        holder, release, tasks = await _run_in_order(queue, [("low", 0, None),
+                                                             ("high", 5, None),
+                                                             ("low-later-deadline", 0, later + 10),
+                                                             ("low-deadline", 0, later)], order)
+        assert queue.depth == 4
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+    assert asyncio.run(main()) == ["high", "low-deadline", "low-later-deadline", "low"]
+
+def test_a_request_whose_deadline_passes_while_queued_is_dropped():
+    async def main():
+        queue = RequestQueue(concurrency = 1)
+        order = []
+        holder, release, tasks = await _run_in_order(queue, [("soon", 0, time.time() + 0.05), ("whenever", 0, None)], order)
+        await asyncio.sleep(0.1)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order, queue
+    order, queue = asyncio.run(main())
+    assert order == ["soon expired", "whenever"]
+    assert queue.dropped == 1 and queue.running == 0
+
+def test_an_expired_request_is_dropped_on_arrival():
+    async def main():
+        queue = RequestQueue(concurrency = 1)
+        with pytest.raises(DeadlineExpired):
+            async with queue.turn(deadline = time.time() - 1):
+                pass
+        return queue
+    queue = asyncio.run(main())
+    assert queue.dropped == 1 and queue.running == 0
+
+def test_concurrency_limits_how_many_run_at_once():
+    async def main():
+        queue = RequestQueue(concurrency = 2)
+        running = peak = 0
+        async def request():
+            nonlocal running, peak
+            async with queue.turn():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+        await asyncio.gather(*(request() for _ in range(6)))
+        return peak, queue
+    peak, queue = asyncio.run(main())
+    assert peak == 2 and queue.running == 0 and queue.depth == 0
+
+def test_a_cancelled_waiter_does_not_keep_its_place():
+    async def main():
+        queue = RequestQueue(concurrency = 1)
+        order = []
+        holder, release, tasks = await _run_in_order(queue, [("cancelled", 9, None), ("kept", 0, None)], order)
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, tasks[1])
+        return order, queue
+    order, queue = asyncio.run(main())
+    assert order == ["kept"] and queue.running == 0
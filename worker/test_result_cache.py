@@ -0,0 +1,79 @@
+import asyncio, os
+from model_pool import ModelKey
+from result_cache import DiskResultCache, result_cache_key, thousandths
+
+# Computed by resultCacheKey in server/resultCache.ts (and pinned in server/test/resultCacheKey.test.ts), so the server's
+# cache lookups and the workers' cache writes agree
+PARITY_CASES = [
+    (ModelKey.create("schnell", 8),
+     dict(prompt = "a lighthouse at dusk", seed = 42, numSteps = 4, height = 512, width = 768),
+     "f68416c89c7c7fece3e3b1d5c69261d69f8b022d2cff64aed2621b553355b19f"),
+    (ModelKey.create("dev", 4, lora_paths = ["b.safetensors", "a.safetensors"], lora_scales = [0.5, 1.25]),
+     dict(prompt = "café ☕ über alles", seed = 7, numSteps = 20, height = 1024, width = 1024, guidance = 3.5, format = "webp", quality = 80),
+     "878fad5c5a7ef541037bfea96c0471a2a18ee29331b424b99efc6d631efbf3cd"),
+    # Exactly half a thousandth, where round() and Math.round would disagree
+    (ModelKey.create("schnell", 8, lora_paths = ["tie.safetensors"], lora_scales = [2.0625]),
+     dict(prompt = "halves", seed = 3, numSteps = 4, height = 256, width = 256, guidance = 0.0625),
+     "8d67e2c282da85a57f03b2d1a95a59470d5dbe6bedf172ae42e2e9b7e027e081"),
+]
+
+
+def test_keys_match_the_server():
+    for model_key, request, expected in PARITY_CASES:
+        assert result_cache_key(model_key, request) == expected
+
+def test_halves_round_up():
+    assert [thousandths(value) for value in (0.0625, 2.0625, -0.0625, 3.5, 0.0004)] == [63, 2063, -62, 3500, 0]
+
+def test_defaults_key_the_same_as_when_given():
+    model_key = ModelKey.create("schnell", 8)
+    request = dict(prompt = "p", seed = 1, numSteps = 2, height = 64, width = 64)
+    assert result_cache_key(model_key, request) == result_cache_key(model_key, dict(request, guidance = 4.0, format = "png"))
+
+def test_everything_that_changes_the_image_changes_the_key():
+    model_key = ModelKey.create("schnell", 8)
+    request = dict(prompt = "p", seed = 1, numSteps = 2, height = 64, width = 64)
+    key = result_cache_key(model_key, request)
+    for change in (dict(prompt = "q"), dict(seed = 2), dict(numSteps = 3), dict(height = 128), dict(width = 128),
+                   dict(guidance = 3.5), dict(format = "jpeg"), dict(quality = 50)):
+        assert result_cache_key(model_key, dict(request, **change)) != key, change
+    assert result_cache_key(ModelKey.create("schnell", 4), request) != key
+    assert result_cache_key(ModelKey.create("schnell", 8, lora_paths = ["a.safetensors"]), request) != key
+
+def test_disk_cache_round_trip(tmp_path):
+    async def main():
+        cache = DiskResultCache(str(tmp_path))
+        assert await cache.get("missing") is None
+        await cache.put("key", memoryview(b"image"), dict(mimetype = "image/png"))
+        return cache, await cache.get("key")
+    cache, cached = asyncio.run(main())
+    assert cached.data == b"image" and cached.headers == dict(mimetype = "image/png")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    async def main():
+        cache = DiskResultCache(str(tmp_path), max_bytes = 10)
+        await cache.put("old", b"12345", {})
+        await cache.put("used", b"12345", {})
+        # Give the entries distinct times, and make "old" the most recently used
+        for name, mtime in (("old", 1), ("used", 2)):
+            os.utime(tmp_path / f"{name}.bin", (mtime, mtime))
+        await cache.get("old")
+        await cache.put("new", b"12345", {})
+        return [await cache.get(key) is not None for key in ("old", "used", "new")]
+    assert asyncio.run(main()) == [True, False, True]
+
+def test_disk_cache_entry_missing_its_headers_is_a_miss(tmp_path):
+    (tmp_path / "key.bin").write_bytes(b"image")
+    async def main():
+        return await DiskResultCache(str(tmp_path)).get("key")
+    assert asyncio.run(main()) is None
+
+def test_disk_cache_eviction_tolerates_entries_removed_concurrently(tmp_path, monkeypatch):
+    cache = DiskResultCache(str(tmp_path), max_bytes = 0)
+    cache._put_blocking("key", b"image", {})
+    vanished = tmp_path / "vanished.bin"
+    real_glob = type(tmp_path).glob
+    monkeypatch.setattr(type(tmp_path), "glob", lambda self, pattern: list(real_glob(self, pattern)) + [vanished])
+    cache._evict_blocking()
+    assert not (tmp_path / "key.bin").exists()
@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+from nats.errors import ConnectionClosedError, TimeoutError
+from capacity import CapacityManager
+from work_queue import UndeliverableRequest, WorkQueueConsumer
+
+
+class FakeJob:
+    def __init__(self, name = "job"):
+        self.name = name
+        self.acks = []
+
+    async def ack(self):
+        self.acks.append("ack")
+
+    async def nak(self):
+        self.acks.append("nak")
+
+    async def term(self):
+        self.acks.append("term")
+
+    async def in_progress(self):
+        self.acks.append("in_progress")
+
+
+# Hands out the queued batches of jobs, one per fetch, then times out as an empty stream does
+class FakePull:
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.fetched = []
+
+    async def fetch(self, batch, timeout):
+        self.fetched.append(batch)
+        if not self.batches:
+            await asyncio.sleep(0.01)
+            raise TimeoutError
+        return self.batches.pop(0)
+
+
+class FakeJetStream:
+    def __init__(self, pull):
+        self.pull = pull
+
+    async def stream_info(self, name):
+        return None
+
+    async def pull_subscribe(self, subject, durable, stream, config):
+        return self.pull
+
+
+class FakeNats:
+    def __init__(self, pull):
+        self.js = FakeJetStream(pull)
+
+    def jetstream(self):
+        return self.js
+
+
+def process(handle_job, ack_wait = 30.0):
+    async def main():
+        job = FakeJob()
+        consumer = WorkQueueConsumer(None, CapacityManager(slots = 1), handle_job, ack_wait = ack_wait)
+        await consumer._process(job, "lease")
+        return job.acks
+    return asyncio.run(main())
+
+
+def test_a_handled_request_is_acked():
+    async def handle_job(job, lease_id):
+        return True
+    assert process(handle_job) == ["ack"]
+
+def test_a_request_that_is_handed_back_is_naked():
+    async def handle_job(job, lease_id):
+        return False
+    assert process(handle_job) == ["nak"]
+
+def test_a_request_that_fails_on_nats_is_naked():
+    async def handle_job(job, lease_id):
+        raise ConnectionClosedError
+    assert process(handle_job) == ["nak"]
+
+def test_an_undeliverable_request_is_terminated():
+    async def handle_job(job, lease_id):
+        raise UndeliverableRequest("it has no imageInbox header")
+    assert process(handle_job) == ["term"]
+
+def test_other_errors_are_left_to_the_ack_wait():
+    async def handle_job(job, lease_id):
+        raise RuntimeError("a bug")
+    with pytest.raises(RuntimeError):
+        process(handle_job)
+
+def test_a_long_request_is_kept_alive():
+    async def handle_job(job, lease_id):
+        await asyncio.sleep(0.1)
+        return True
+    acks = process(handle_job, ack_wait = 0.09)
+    assert acks[-1] == "ack"
+    assert acks[:-1] and set(acks[:-1]) == { "in_progress" }
+
+
+def run_consumer(batches, capacity, handle_job):
+    async def main():
+        pull = FakePull(batches)
+        consumer = WorkQueueConsumer(FakeNats(pull), capacity, handle_job)
+        consumer.start()
+        await asyncio.sleep(0.05)
+        await consumer.stop()
+        return pull.fetched
+    return asyncio.run(main())
+
+
+def test_only_as_many_requests_as_free_slots_are_pulled():
+    capacity = CapacityManager(slots = 3)
+    capacity.reserve()
+    handled = []
+    async def handle_job(job, lease_id):
+        handled.append((job.name, lease_id))
+        await asyncio.sleep(1)
+        return True
+    jobs = [FakeJob("a"), FakeJob("b")]
+    fetched = run_consumer([jobs], capacity, handle_job)
+    # Two slots were free, and both went to the pulled requests, each under a lease of its own
+    assert fetched == [2]
+    assert [name for name, _ in handled] == ["a", "b"]
+    assert len({ lease_id for _, lease_id in handled }) == 2
+    assert capacity.free_slots == 0
+
+def test_a_request_pulled_without_a_free_slot_is_naked():
+    capacity = CapacityManager(slots = 1)
+    handled = []
+    async def handle_job(job, lease_id):
+        handled.append(job.name)
+        await asyncio.sleep(1)
+        return True
+    # Only one slot was free when the batch was asked for, but say a probe took it before the second one was started
+    jobs = [FakeJob("a"), FakeJob("b")]
+    run_consumer([jobs], capacity, handle_job)
+    assert handled == ["a"]
+    assert jobs[1].acks == ["nak"]
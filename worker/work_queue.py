@@ -0,0 +1,127 @@
+import asyncio
+from typing import Awaitable, Callable
+from nats.aio.client import Client as NATS
+from nats.aio.msg import Msg
+from nats.errors import Error as NatsError, TimeoutError
+from nats.js.api import AckPolicy, ConsumerConfig, RetentionPolicy, StorageType, StreamConfig
+from nats.js.errors import NotFoundError
+from capacity import CapacityManager
+
+# Requests dispatched through JetStream instead of by probing: the server publishes each request to WORK_QUEUE_SUBJECT
+# (with the same imageInbox, priority and deadline headers it would send a worker directly),
+# and every worker pulls from the one durable consumer, so each request goes to exactly one of them.
+WORK_QUEUE_STREAM = "IMG_GEN_WORK"
+WORK_QUEUE_SUBJECT = "img-gen-work"
+WORK_QUEUE_CONSUMER = "workers"
+
+
+async def ensure_work_queue(js, max_age : float = 3600) -> None:
+    try:
+        await js.stream_info(WORK_QUEUE_STREAM)
+    except NotFoundError:
+        # Work-queue retention deletes a request once it is acked. The duplicate window drops a request published twice
+        # (the server uses the imageInbox as the message ID).
+        await js.add_stream(StreamConfig(name = WORK_QUEUE_STREAM,
+                                         subjects = [WORK_QUEUE_SUBJECT],
+                                         retention = RetentionPolicy.WORK_QUEUE,
+                                         storage = StorageType.FILE,
+                                         max_age = max_age,
+                                         duplicate_window = 120))
+
+
+class UndeliverableRequest(Exception):
+    """Raised by `handle_job` for a request no worker could serve, so it is terminated instead of being redelivered."""
+
+
+class WorkQueueConsumer:
+    """
+    Pulls requests from the JetStream work queue at the worker's own pace: only as many as it has free slots,
+    so a burst waits in the stream (where it survives a server restart) instead of failing for want of a free worker.
+
+    Every pulled request reserves a slot, just as volunteering for a probe does, and `handle_job(job, lease_id)` is run for it.
+    While it runs the request is kept alive with in-progress acks, and it is acked once it is done (whatever the outcome - the
+    requester has been told) - unless `handle_job` returns False, which hands it back, or raises UndeliverableRequest, which terminates it.
+    A request whose handling fails on NATS is handed back too. If the worker dies instead, the ack wait runs out and JetStream redelivers the request
+    to another worker, up to `max_deliver` times. A request pulled without a slot to run it in is nak'ed straight back.
+    """
+
+    def __init__(self,
+                 nc : NATS,
+                 capacity : CapacityManager,
+                 handle_job : Callable[[Msg, str], Awaitable[bool]],
+                 ack_wait : float = 30.0,
+                 max_deliver : int = 5):
+        self.nc = nc
+        self.capacity = capacity
+        self.handle_job = handle_job
+        self.ack_wait = ack_wait
+        self.max_deliver = max_deliver
+        self._slot_freed = asyncio.Event()
+        self._task = None
+        self._jobs = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    # Call when a slot is freed, so that the next request is pulled without waiting for the poll
+    def slot_freed(self):
+        self._slot_freed.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        js = self.nc.jetstream()
+        await ensure_work_queue(js)
+        pull = await js.pull_subscribe(WORK_QUEUE_SUBJECT,
+                                       durable = WORK_QUEUE_CONSUMER,
+                                       stream = WORK_QUEUE_STREAM,
+                                       config = ConsumerConfig(ack_policy = AckPolicy.EXPLICIT,
+                                                               ack_wait = self.ack_wait,
+                                                               max_deliver = self.max_deliver))
+        while True:
+            free_slots = self.capacity.free_slots
+            if free_slots == 0:
+                # Slots are also freed by leases expiring, which nothing announces - so don't wait for long
+                self._slot_freed.clear()
+                try:
+                    await asyncio.wait_for(self._slot_freed.wait(), timeout = 1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                jobs = await pull.fetch(batch = free_slots, timeout = 5.0)
+            except TimeoutError:
+                continue
+            for job in jobs:
+                lease_id = self.capacity.reserve()
+                if lease_id is None:
+                    # A probe from the server took the slot in the meantime - let another worker have the request
+                    await job.nak()
+                    continue
+                task = asyncio.create_task(self._process(job, lease_id))
+                self._jobs.add(task)
+                task.add_done_callback(self._jobs.discard)
+
+    async def _process(self, job : Msg, lease_id : str):
+        keep_alive = asyncio.create_task(self._keep_alive(job))
+        try:
+            if await self.handle_job(job, lease_id):
+                await job.ack()
+            else:
+                await job.nak()
+        except UndeliverableRequest as e:
+            print(f"Terminating a work queue request: {e}")
+            await job.term()
+        except NatsError as e:
+            print(f"Work queue request failed, handing it back: {e}")
+            await job.nak()
+        finally:
+            keep_alive.cancel()
+
+    # Stops JetStream from redelivering a request that is taking longer than the ack wait
+    async def _keep_alive(self, job : Msg):
+        while True:
+            await asyncio.sleep(self.ack_wait / 3)
+            await job.in_progress()
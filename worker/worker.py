@@ -1,21 +1,91 @@
-import asyncio, uuid, json, signal
-from argparse import ArgumentParser
-from io import BytesIO
-from typing import Dict
-from PIL import Image
-from mflux import Config, Flux1, ModelConfig
-import nats
-from nats.aio.msg import Msg
-from nats.errors import ConnectionClosedError, NoServersError
-from contextlib import redirect_stdout
+# Importing mflux (mlx, transformers, torch) is a noticeable part of startup, so it is timed
+# (with the simulated backend mflux is never fully imported). The clock has to start before the other imports,
+# hence the `noqa: E402` on each of them.
+import time
+IMPORT_START = time.perf_counter()
+import asyncio, uuid, json, signal, threading  # noqa: E402
+from argparse import ArgumentParser  # noqa: E402
+from typing import Dict, List, Optional, Tuple  # noqa: E402
+from PIL import Image  # noqa: E402
+from mflux.error.exceptions import StopImageGenerationException  # noqa: E402
+from backends import BACKENDS, LatencyModel, create_backend  # noqa: E402
+from capacity import CapacityManager  # noqa: E402
+from encoding import ImageEncoder  # noqa: E402
+from engine import GenerationEngine, PipelinedGenerationEngine  # noqa: E402
+from heartbeat import HeartbeatPublisher  # noqa: E402
+from image_transfer import TRANSFER_MODES, ImageSender  # noqa: E402
+from metrics import MetricsServer, WorkerMetrics, publish_metrics_periodically  # noqa: E402
+from model_pool import ModelAllowList, ModelKey, ModelPool  # noqa: E402
+from progress import ProgressPublisher  # noqa: E402
+from request_queue import DeadlineExpired, RequestQueue  # noqa: E402
+from result_cache import RESULT_CACHE_MODES, DiskResultCache, ObjectStoreResultCache, result_cache_key  # noqa: E402
+from work_queue import UndeliverableRequest, WorkQueueConsumer  # noqa: E402
+import nats  # noqa: E402
+from nats.aio.msg import Msg  # noqa: E402
+from nats.errors import ConnectionClosedError, NoServersError  # noqa: E402
+from contextlib import redirect_stdout  # noqa: E402
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 async def main(cli_args):
 
     # This is how the worker identifies itself to the server
     worker_id = cli_args.worker_id or str(uuid.uuid4())
 
-    # Mark worker as busy when it is performing work so that it refuses new work if asked while busy
-    I_AM_BUSY = False
+    # Tracks free generation slots - the worker refuses new work if asked while all of its slots are running or reserved
+    # (a pipeline can only overlap requests if it is allowed to hold at least as many as it is deep)
+    # With --max_queued, the worker also accepts requests beyond what it can compute at once, and queues them
+    slots = max(cli_args.slots, cli_args.pipeline_depth)
+    capacity = CapacityManager(slots = slots + cli_args.max_queued, lease_ttl = cli_args.lease_ttl)
+
+    # Admitted requests take turns computing - by priority, then earliest deadline - and are dropped if their deadline passes first
+    request_queue = RequestQueue(concurrency = slots)
+
+    # Images come from mflux, or from a stand-in that needs no weights (for load testing many workers on one host)
+    # Creating the mflux backend imports mflux, which counts towards the import time
+    start = time.perf_counter()
+    backend = create_backend(cli_args.backend, LatencyModel(seconds_per_megapixel_step = cli_args.sim_seconds_per_megapixel_step,
+                                                            step_overhead = cli_args.sim_step_overhead,
+                                                            jitter = cli_args.sim_jitter,
+                                                            load_seconds = cli_args.sim_load_seconds))
+    import_seconds = IMPORT_SECONDS + time.perf_counter() - start
+
+    # Load the model(s) once, up front, so that requests don't pay for loading weights and quantizing
+    model_pool = ModelPool(backend, max_resident = cli_args.max_resident_models)
+    default_model_key = ModelKey.create(alias = cli_args.model,
+                                        quantize = cli_args.quantize,
+                                        local_path = cli_args.local_path,
+                                        lora_paths = cli_args.lora_paths,
+                                        lora_scales = cli_args.lora_scales)
+    flux = model_pool.preload(default_model_key)
+
+    # Requests can only ask for the preloaded model, or for models and LoRAs the operator allowed
+    allow_list = ModelAllowList(preloaded = [default_model_key],
+                                models = [ModelAllowList.parse_model(spec) for spec in cli_args.allowed_models],
+                                lora_paths = cli_args.allowed_lora_paths)
+
+    # Image generation runs on a compute thread so that this event loop stays responsive to probes from the server
+    # With a pipeline, prompt encoding, denoising and decoding each get their own thread and consecutive requests overlap
+    if cli_args.pipeline_depth > 1:
+        engine = PipelinedGenerationEngine(model_pool, depth = cli_args.pipeline_depth)
+    else:
+        engine = GenerationEngine(model_pool, max_workers = slots)
+
+    # The first generation at a resolution pays for building the MLX graph, growing the allocator, etc.
+    # Pay for that now - the worker doesn't join the worker pool until this is done.
+    warmup_seconds = await warm_up(engine, default_model_key, cli_args.warmup_resolutions)
+    print_startup_breakdown(import_seconds, flux.load_timings, warmup_seconds)
+
+    # Latency histograms for each phase of a request (warm-up is deliberately left out of them)
+    metrics = WorkerMetrics()
+    engine.phase_cb = metrics.observe_phase
+    metrics.track_queue_depth(lambda: request_queue.depth)
+    if cli_args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics.registry, cli_args.metrics_port)
+        metrics_server.start()
+        print(f"Serving metrics at http://127.0.0.1:{metrics_server.port}/metrics")
+
+    # Encoding the finished image (PNG, WebP, JPEG or raw) gets its own small thread pool
+    encoder = ImageEncoder(max_workers = cli_args.encode_threads)
 
     # Helpful to know
     async def disconnected_cb():
@@ -32,54 +102,218 @@ async def main(cli_args):
                             max_reconnect_attempts=-1)
     print(f"Worker {worker_id} is connected to NATs")
 
+    # Images can be bigger than the server's max_payload, so they are sent in chunks or by reference to an object store
+    image_sender = ImageSender(nc, mode = cli_args.transfer, max_chunk_size = cli_args.max_chunk_size)
+
+    # Finished images are cached by a hash of everything that determines them, so that repeat requests skip generation
+    # (with the object store, the server checks the cache too - and a hit doesn't even need a worker)
+    if cli_args.result_cache == "object-store":
+        result_cache = ObjectStoreResultCache(nc, max_bytes = cli_args.result_cache_max_bytes)
+    elif cli_args.result_cache == "disk":
+        result_cache = DiskResultCache(cli_args.result_cache_dir, max_bytes = cli_args.result_cache_max_bytes)
+    else:
+        result_cache = None
+    background_tasks = set()
+
+    # The same metrics are also published to worker-metrics.{worker_id} every so often
+    metrics_publisher = asyncio.create_task(publish_metrics_periodically(nc, worker_id, metrics.registry, cli_args.metrics_interval))
+
+    # Heartbeats let the server keep a registry of which workers are free, instead of probing the pool to find one.
+    # One goes out every heartbeat_interval, and another as soon as a slot is taken or freed.
+    def heartbeat_state():
+        return dict(freeSlots = capacity.free_slots,
+                    totalSlots = capacity.slots,
+                    running = capacity.running,
+                    loadedModels = model_pool.describe_resident(),
+                    queueDepth = request_queue.depth + engine.queue_depth,
+                    recentStepSeconds = metrics.recent_step_seconds())
+    heartbeat = HeartbeatPublisher(nc, worker_id, heartbeat_state, interval = cli_args.heartbeat_interval)
+
+    # Besides answering probes, the worker can pull requests from the JetStream work queue whenever it has a free slot
+    work_queue = None
+
     # (callback) When image generation parameters are received from the server, this receives them and generates the image
     async def generate_and_send_image(msg : Msg):
+        received_at = time.perf_counter()
+
+        # The payload must present the lease that was handed out when the worker volunteered
+        lease_id = (msg.headers or {}).get('leaseId')
 
-        # The worker is occupied with generating an image and will not accept other work
-        nonlocal I_AM_BUSY
-        if I_AM_BUSY:
-            # This shouldn't happen because of the way the worker is written
+        # A request the worker can't serve is turned away before it takes the slot
+        request, error = parse_request(msg.data)
+        if error is not None:
+            await reject_request(msg.reply, lease_id, error)
+            return
+
+        if not capacity.claim(lease_id):
+            # This only happens if the payload came without a lease, or the lease expired before the payload arrived
             print("Worker refused new image generation request while worker was already busy")
             await nc.publish(msg.reply, b'The worker was already busy.', headers = dict(success = 'false'))
             await nc.flush()
-        I_AM_BUSY = True
+            return
 
+        # The reply is where we will send the completed image to
+        await generate_in_claimed_slot(msg.reply, request, msg.headers or {}, received_at)
 
+    # (callback) A request pulled from the JetStream work queue - a slot was reserved for it when it was pulled.
+    # Returns False to hand the request back to the queue.
+    async def generate_from_work_queue(job : Msg, lease_id : str) -> bool:
+        received_at = time.perf_counter()
+        image_inbox = (job.headers or {}).get('imageInbox')
+        if image_inbox is None:
+            # There is nowhere to send the image (or even the reason it's rejected) - nor would there be on another worker
+            if capacity.cancel(lease_id):
+                heartbeat.beat_now()
+            raise UndeliverableRequest("it has no imageInbox header")
+        # A rejected request is still acked - another worker wouldn't serve it either
+        request, error = parse_request(job.data)
+        if error is not None:
+            await reject_request(image_inbox, lease_id, error)
+            return True
+        if not capacity.claim(lease_id):
+            # The lease expired (the event loop was held up) and the slot was given away since
+            print("Handing a work queue request back, its reserved slot was lost")
+            return False
+        # Nobody probed this worker, so it tells the requester (and the server) itself that it took the request
+        await nc.publish(f"{image_inbox}.worker-assigned", worker_id.encode())
+        await generate_in_claimed_slot(image_inbox, request, job.headers, received_at)
+        return True
 
-        # This is where we will send the completed image to
-        image_inbox = msg.reply
+    # Deserializes an image gen request, returning (request, None) - or (None, the reason it is rejected)
+    def parse_request(data : bytes) -> Tuple[Optional[Dict[str,any]], Optional[str]]:
+        try:
+            request = json.loads(data.decode())
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            model_key = model_key_for_request(default_model_key, request)
+            # A format or quality the encoder can't handle would only fail once the image is generated
+            ImageEncoder.validate(request.get("format", "png"), request.get("quality"))
+        except ValueError as e:
+            return None, f"The request is invalid: {e}"
+        if not allow_list.allows(model_key):
+            return None, f"This worker does not serve the model {model_key.alias} (quantize={model_key.quantize}, LoRAs={[path for path, _ in model_key.loras]})."
+        return request, None
 
-        # Deserialize image gen request
-        request = json.loads(msg.data.decode())        
+    # Replies with the reason the request was rejected, and frees the slot that was reserved for it
+    async def reject_request(image_inbox : str, lease_id : Optional[str], error : str):
+        print(f"Rejected request: {error}")
+        if lease_id is not None and capacity.cancel(lease_id):
+            heartbeat.beat_now()
+        await nc.publish(image_inbox, error.encode(), headers = dict(success = 'false', rejected = 'true'))
+        await nc.flush()
+        metrics.images.inc(outcome = "rejected")
 
-        # Every time there's a 'tic' in the mflux progress loop, broadcast progress to whoever is listening
-        async def progress_cb(progress):
-            await nc.publish(f"{image_inbox}.worker-progress", str(progress).encode())
-            await nc.flush()
+    # Generates the image and sends it to the image_inbox. The slot must already be claimed - it is released at the end.
+    async def generate_in_claimed_slot(image_inbox : str, request : Dict[str,any], headers : Dict[str,str], received_at : float):
+        heartbeat.beat_now()
+
+        # The requester may say how urgent the image is, and when it stops being worth generating (unix time in milliseconds)
+        priority, deadline = priority_and_deadline(headers)
+
+        # Broadcast progress in the mflux denoise loop to whoever is listening (throttled, only the latest step is sent)
+        progress = ProgressPublisher(nc, f"{image_inbox}.worker-progress", min_interval = cli_args.progress_interval)
+
+        # The requester can give up on the image by publishing to {imageInbox}.cancel - the compute thread checks between steps
+        cancel_event = threading.Event()
+        cancelled_at = None
+        async def cancel_cb(cancel_msg : Msg):
+            nonlocal cancelled_at
+            if not cancel_event.is_set():
+                cancelled_at = time.perf_counter()
+                cancel_event.set()
+                print(f"Cancellation received for {image_inbox}")
+        cancelSub = await nc.subscribe(f"{image_inbox}.cancel", cb = cancel_cb)
         
         try:
-            # Use mflux to generate an image conforming to the request            
-            image : Image = await generate_image(request, progress_cb)
-            
-            # Turn it into bytes
-            img_io = BytesIO()
-            image.save(img_io, 'PNG')
-            img_io.seek(0)
+            # Skip generating the image entirely if it has been generated before
+            model_key = model_key_for_request(default_model_key, request)
+            cache_key = result_cache_key(model_key, request) if result_cache is not None else None
+            cached = await lookup_cached_result(cache_key) if cache_key is not None else None
+            if cached is not None:
+                await image_sender.send(image_inbox, cached.data, mimetype=cached.headers.get('mimetype'), headers=dict(cached.headers, cached='true'))
+                metrics.images.inc(outcome = "cache_hit")
+                print(f"Sent cached image {cache_key}")
+                return
+
+            # Use mflux to generate an image conforming to the request (on the compute thread)
+            # If asked for, a low resolution preview of the latents goes out with the progress (made only when one is due to be sent)
+            preview_cb = progress.preview if request.get("preview") else None
+            try:
+                async with request_queue.turn(priority, deadline):
+                    image : Image = await engine.generate(model_key, request, progress.update, cancel_event, received_at, preview_cb,
+                                                          preview_due = progress.preview_due)
+                await progress.close()
+            finally:
+                # If generation failed, was cancelled or expired, drop the pending progress before the final reply goes out
+                await progress.close(send_pending = False)
+
+            # Turn it into bytes, in the format the requester asked for (also CPU heavy, so also off of the event loop)
+            encoded = await encoder.encode(image, request.get("format", "png"), request.get("quality"))
+            metrics.observe_phase("image_encode", encoded.seconds)
+            print(f"Encoded {request.get('format', 'png')} image ({len(encoded.data)} bytes) in {1000 * encoded.seconds:.0f}ms")
 
             # Send the image back to the `reply` (which is an inbox that the consumer and server are sub'd to)
-            await nc.publish(image_inbox, img_io.read(), headers=dict(mimetype='image/png', success='true'))
-            await nc.flush()
+            start = time.perf_counter()
+            manifest = await image_sender.send(image_inbox, encoded.data, mimetype=encoded.mimetype, headers=encoded.headers)
+            metrics.observe_phase("publish", time.perf_counter() - start)
+
+            # Cache the image once the requester has it (in the background, the slot doesn't need to wait for it)
+            if cache_key is not None:
+                task = asyncio.create_task(cache_result(cache_key, encoded.data, manifest))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+            metrics.images.inc(outcome = "success")
             print("Image generation complete.")
+            print(f"Model pool stats: {model_pool.stats()}")
+            print(f"Encoder stats: {encoder.stats()}")
+            if result_cache is not None:
+                print(f"Result cache stats: {result_cache.stats()}")
         
+        except DeadlineExpired as e:
+            print(str(e))
+            await nc.publish(image_inbox, b'The deadline for the image passed before it could be generated.', headers = dict(success = 'false', expired = 'true'))
+            await nc.flush()
+            metrics.dropped.inc(reason = "deadline")
+            metrics.images.inc(outcome = "expired")
+
+        except StopImageGenerationException as e:
+            print(str(e))
+            await nc.publish(image_inbox, b'Image generation was cancelled.', headers = dict(success = 'false', cancelled = 'true'))
+            await nc.flush()
+            metrics.images.inc(outcome = "cancelled")
+
         except Exception as e:
             print(str(e))
             # In case of failure, report failure (server also gets this response and can retry if desired)
             await nc.publish(image_inbox, b'There was a problem generating the image.', headers = dict(success = 'false'))
             await nc.flush()
+            metrics.images.inc(outcome = "failed")
             print("Image generation failed.")
         finally:
-            # After this block of code, the worker is no longer busy, regardless of success or failure
-            I_AM_BUSY = False
+            # After this block of code, the slot is free again, regardless of success or failure
+            await cancelSub.unsubscribe()
+            capacity.release()
+            heartbeat.beat_now()
+            if work_queue is not None:
+                work_queue.slot_freed()
+            if cancelled_at is not None:
+                cancel_to_free = time.perf_counter() - cancelled_at
+                metrics.cancel_to_free_seconds.observe(cancel_to_free)
+                print(f"Slot freed {1000 * cancel_to_free:.0f}ms after cancellation")
+
+    # A cache that can't be read (object store unavailable, a damaged entry on disk, ...) is a miss, not a failed request
+    async def lookup_cached_result(cache_key : str):
+        try:
+            return await result_cache.get(cache_key)
+        except Exception as e:
+            print(f"Could not look up cached result {cache_key}, generating it instead: {e}")
+            return None
+
+    async def cache_result(cache_key : str, data, manifest : Dict[str,str]):
+        try:
+            await result_cache.put(cache_key, data, manifest)
+        except Exception as e:
+            print(f"Could not cache result {cache_key}: {e}")
 
     # Respond to a request from the server for a worker, indicating whether you are willing to work
     # NOTE: This subscription is a "queue group" 
@@ -87,33 +321,77 @@ async def main(cli_args):
     requestSub = await nc.subscribe('request-worker', 'workers')
     print(f"Listening for requests for work...")
 
+    # The server can also ask this worker directly, when its heartbeats say it has a free slot
+    directRequestSub = await nc.subscribe(f'request-worker.{worker_id}')
+
+    # The server hands back leases it reserved but won't use (when it probed several workers and another one won)
+    releaseSub = await nc.subscribe(f'release-worker.{worker_id}')
+
     # This is the channel that work requests specific to this worker are received on
     imgGenPayloadSub = await nc.subscribe(worker_id)    
     await nc.flush()
     
-    # Async loop to handle the server asking this worker to volunteer to work.
-    async def handle_requests():
-        async for msg in requestSub.messages:
-            willing = str(not I_AM_BUSY).lower()
+    # Async loops to handle the server asking this worker to volunteer to work (via the queue group or directly).
+    # Volunteering reserves a slot with a lease, which the server must send back along with the payload.
+    async def handle_requests(sub):
+        async for msg in sub.messages:
+            lease_id = capacity.reserve()
+            willing = str(lease_id is not None).lower()
             print("Willing to accept work from server" if willing == 'true' else "Refused work request from server")
-            await nc.publish(msg.reply, reply=worker_id, headers=dict(willing=willing, workerId=worker_id))
+            headers = dict(willing=willing,
+                           workerId=worker_id,
+                           freeSlots=str(capacity.free_slots),
+                           totalSlots=str(capacity.slots))
+            if lease_id is not None:
+                headers.update(leaseId=lease_id, leaseTtlMs=str(int(capacity.lease_ttl * 1000)))
+            await nc.publish(msg.reply, reply=worker_id, headers=headers)
             await nc.flush()
+            if lease_id is not None:
+                heartbeat.beat_now()
+
+    # Async loop to free the slots of leases the server gave up on, rather than leaving them reserved until they expire
+    async def handle_releases():
+        async for msg in releaseSub.messages:
+            if capacity.cancel(msg.data.decode()):
+                print("Server released a reserved slot")
+                heartbeat.beat_now()
 
     # Async loop to receive the specific parameters of the work request.
+    # Each request runs as its own task so that a worker with several slots can generate several images at once.
     async def handle_image_generation():
+        in_flight = set()
         async for msg in imgGenPayloadSub.messages:
             print(f"Image generation parameters received.")
-            await generate_and_send_image(msg)
+            task = asyncio.create_task(generate_and_send_image(msg))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
 
-    # Run both loops concurrently
+    # Only start advertising free slots once the worker is listening for work
+    heartbeat.start()
+    if cli_args.work_queue:
+        work_queue = WorkQueueConsumer(nc, capacity, generate_from_work_queue,
+                                       ack_wait = cli_args.work_queue_ack_wait,
+                                       max_deliver = cli_args.work_queue_max_deliver)
+        work_queue.start()
+        print("Pulling requests from the work queue...")
+
+    # Run the loops concurrently
     await asyncio.gather(
-        handle_requests(),
+        handle_requests(requestSub),
+        handle_requests(directRequestSub),
+        handle_releases(),
         handle_image_generation()
     )
 
     input("Press [ENTER] at any time to close the worker.")
     print("Unsubscribing.")
+    metrics_publisher.cancel()
+    await heartbeat.stop()
+    if work_queue is not None:
+        await work_queue.stop()
     await requestSub.unsubscribe()
+    await directRequestSub.unsubscribe()
+    await releaseSub.unsubscribe()
     await imgGenPayloadSub.unsubscribe()
 
     # Terminate connection, waiting for all current processing to complete
@@ -122,38 +400,92 @@ async def main(cli_args):
         await nc.drain()
     except:
         pass
+    engine.shutdown()
+    encoder.shutdown()
 
 
-async def generate_image(request : Dict[str,any], progress_cb) -> Image:
+async def warm_up(engine : GenerationEngine, model_key : ModelKey, resolutions : List[Tuple[int,int]]) -> Dict[str, float]:
+    warmup_seconds = {}
+    for height, width in resolutions:
+        print(f"Warming up at {width}x{height}...")
+        start = time.perf_counter()
+        request = dict(prompt = "warm-up", seed = 0, numSteps = 1, height = height, width = width)
+        await engine.generate(model_key, request, progress_cb = lambda step, total: None)
+        warmup_seconds[f"{width}x{height}"] = time.perf_counter() - start
+    return warmup_seconds
 
-    flux = Flux1(
-        model_config=ModelConfig.from_alias('schnell'),
-        quantize=8
-    )
+def print_startup_breakdown(import_seconds : float, load_timings : Dict[str, float], warmup_seconds : Dict[str, float]):
+    phases = [("import", import_seconds),
+              ("tokenizer load", load_timings.get("tokenizers", 0.0)),
+              ("weight load", load_timings.get("weights", 0.0)),
+              ("quantize", load_timings.get("quantize", 0.0))]
+    phases += [(f"warm-up {resolution}", seconds) for resolution, seconds in warmup_seconds.items()]
+    print("Startup breakdown:")
+    for phase, seconds in phases:
+        print(f"  {phase:<24}{seconds:8.2f}s")
+    print(f"  {'total':<24}{sum(seconds for _, seconds in phases):8.2f}s")
 
+# Malformed headers are ignored rather than failing the request
+def priority_and_deadline(headers : Dict[str,str]) -> Tuple[int, Optional[float]]:
+    try:
+        priority = int(headers.get('priority', 0))
+    except ValueError:
+        priority = 0
     try:
-        # Generate an image
-        image = await flux.generate_image(
-            seed=request["seed"],
-            prompt=request["prompt"],
-            config=Config(
-                num_inference_steps=request["numSteps"],
-                height=request["height"],
-                width=request["width"]
-            ),
-            progress_cb = progress_cb
-        )
-
-        # Save the image
-        pil_img = image.image
-        return pil_img
-    except Exception as e:
-        print(str(e))
-        return None
+        deadline = float(headers['deadline']) / 1000 if 'deadline' in headers else None
+    except ValueError:
+        deadline = None
+    return priority, deadline
+
+def Resolution(x : str) -> Tuple[int,int]:
+    width, height = x.lower().split("x")
+    return int(height), int(width)
+
+def model_key_for_request(default_model_key : ModelKey, request : Dict[str,any]) -> ModelKey:
+    if not any(field in request for field in ("model", "quantize", "loraPaths", "loraScales")):
+        return default_model_key
+    default_lora_paths = [path for path, _ in default_model_key.loras]
+    default_lora_scales = [scale for _, scale in default_model_key.loras]
+    return ModelKey.create(alias = request.get("model", default_model_key.alias),
+                           quantize = request.get("quantize", default_model_key.quantize),
+                           local_path = default_model_key.local_path,
+                           lora_paths = request.get("loraPaths", default_lora_paths),
+                           lora_scales = request.get("loraScales", None if "loraPaths" in request else default_lora_scales))
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--nats_server_address", type = str, default = "nats://localhost:4223")
     parser.add_argument("--worker_id", type = str, default = None)
+    parser.add_argument("--backend", type = str, default = "mflux", choices = BACKENDS, help = "Generate with mflux, or simulate generation without weights (for load testing)")
+    parser.add_argument("--sim_seconds_per_megapixel_step", type = float, default = 0.5, help = "Simulated backend: seconds per denoise step per megapixel")
+    parser.add_argument("--sim_step_overhead", type = float, default = 0.02, help = "Simulated backend: fixed seconds per denoise step")
+    parser.add_argument("--sim_jitter", type = float, default = 0.1, help = "Simulated backend: standard deviation of every duration, as a fraction of it")
+    parser.add_argument("--sim_load_seconds", type = float, default = 0.0, help = "Simulated backend: seconds to load a model")
+    parser.add_argument("--model", type = str, default = "schnell", help = "Alias of the model to preload at startup")
+    parser.add_argument("--quantize", type = int, default = 8, choices = [4, 8])
+    parser.add_argument("--local_path", type = str, default = None, help = "Load the model from disk instead of the HuggingFace cache")
+    parser.add_argument("--lora_paths", type = str, nargs = "*", default = None)
+    parser.add_argument("--lora_scales", type = float, nargs = "*", default = None)
+    parser.add_argument("--allowed_models", type = str, nargs = "*", default = [], help = "ALIAS or ALIAS:QUANTIZE models that requests may ask for besides the preloaded one")
+    parser.add_argument("--allowed_lora_paths", type = str, nargs = "*", default = [], help = "LoRA files that requests may ask for besides the preloaded ones")
+    parser.add_argument("--max_resident_models", type = int, default = 1, help = "How many models the worker keeps loaded at once")
+    parser.add_argument("--warmup_resolutions", type = Resolution, nargs = "*", default = [Resolution("128x128")], help = "WIDTHxHEIGHT buckets to warm up before joining the worker pool")
+    parser.add_argument("--metrics_port", type = int, default = None, help = "Serve Prometheus metrics on this local port (off by default)")
+    parser.add_argument("--metrics_interval", type = float, default = 10.0, help = "Seconds between metrics published to worker-metrics.{worker_id}")
+    parser.add_argument("--heartbeat_interval", type = float, default = 2.0, help = "Seconds between heartbeats published to worker-heartbeat.{worker_id}")
+    parser.add_argument("--slots", type = int, default = 1, help = "How many images the worker generates at once")
+    parser.add_argument("--encode_threads", type = int, default = 2, help = "Threads used to encode finished images")
+    parser.add_argument("--progress_interval", type = float, default = 0.25, help = "Minimum seconds between progress messages for an image")
+    parser.add_argument("--transfer", type = str, default = "chunked", choices = TRANSFER_MODES, help = "How generated images are delivered to the requester")
+    parser.add_argument("--max_chunk_size", type = int, default = None, help = "Largest chunk in bytes (defaults to what the NATs server allows)")
+    parser.add_argument("--result_cache", type = str, default = "off", choices = RESULT_CACHE_MODES, help = "Where finished images are cached for repeat requests")
+    parser.add_argument("--result_cache_dir", type = str, default = "result-cache", help = "Directory used by the disk result cache")
+    parser.add_argument("--result_cache_max_bytes", type = int, default = 1024 ** 3, help = "Size the result cache is kept under")
+    parser.add_argument("--pipeline_depth", type = int, default = 1, help = "Overlap encode/denoise/decode of up to this many consecutive requests (1 disables the pipeline)")
+    parser.add_argument("--max_queued", type = int, default = 0, help = "How many requests the worker accepts beyond its slots, to queue by priority and deadline")
+    parser.add_argument("--work_queue", action = "store_true", help = "Also pull requests from the JetStream work queue (the server's work-queue dispatch mode)")
+    parser.add_argument("--work_queue_ack_wait", type = float, default = 30.0, help = "Seconds without an ack (or in-progress ack) before a pulled request is redelivered to another worker")
+    parser.add_argument("--work_queue_max_deliver", type = int, default = 5, help = "How many times a request is delivered before JetStream gives up on it")
+    parser.add_argument("--lease_ttl", type = float, default = 5.0, help = "Seconds a reserved slot is held for the server before it expires")
     cli_args = parser.parse_args()
     asyncio.run(main(cli_args))
\ No newline at end of file